@@ -14,6 +14,8 @@ import os
 
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -79,24 +81,59 @@ WSGI_APPLICATION = "config.wsgi.application"
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
-
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.mysql',
-#         'NAME': 'openrtmsdb',
-#         'USER': 'root',
-#         'PASSWORD': '',
-#         'HOST': 'localhost',
-#         'PORT': '3306',
-#     }
-# }
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# Chosen with DB_ENGINE: "postgresql" (needs psycopg) for deployments
+# serving several classrooms at once, or "sqlite" (the default) for
+# development and single edge boxes. `manage.py loadtest_attendance` measures attendance write
+# throughput under concurrent sessions on either.
+
+DB_ENGINE = os.environ.get("DB_ENGINE", "sqlite").lower()
+
+if DB_ENGINE in ("postgresql", "postgres"):
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("DB_NAME", "openrtmsdb"),
+            "USER": os.environ.get("DB_USER", "openrtms"),
+            "PASSWORD": os.environ.get("DB_PASSWORD", ""),
+            "HOST": os.environ.get("DB_HOST", "localhost"),
+            "PORT": os.environ.get("DB_PORT", "5432"),
+            # Persistent connections, checked before each request reuses them
+            "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {},
+        }
     }
-}
+    # DB_POOL_MAX_SIZE > 0 switches to psycopg's connection pool (needs
+    # psycopg[pool]), shared by the threads of each process; Django requires
+    # CONN_MAX_AGE = 0 alongside it
+    if int(os.environ.get("DB_POOL_MAX_SIZE", 0)) > 0:
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", 2)),
+            "max_size": int(os.environ.get("DB_POOL_MAX_SIZE")),
+            "timeout": 10,
+        }
+elif DB_ENGINE == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("DB_NAME", BASE_DIR / "db.sqlite3"),
+            "OPTIONS": {
+                # Seconds a writer waits for the lock before "database is locked"
+                "timeout": int(os.environ.get("DB_BUSY_TIMEOUT", 20)),
+                # Take the write lock at BEGIN, so concurrent writers queue on
+                # the busy timeout instead of failing to upgrade a read lock
+                "transaction_mode": "IMMEDIATE",
+                # With WAL readers never block the writer; synchronous=NORMAL
+                # only fsyncs at checkpoints, which with WAL can lose the last
+                # commits on power loss but never corrupts the database
+                "init_command": "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL",
+            },
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"Unsupported DB_ENGINE {DB_ENGINE!r}; use postgresql or sqlite")
 
 
 # Password validation
@@ -171,3 +208,233 @@ REST_FRAMEWORK = {
         "user": "100000/day",
     },
 }
+
+
+# Face matching
+# Faces further than this (Euclidean distance between 128-d encodings) from
+# every enrolled student are reported as unknown
+FACE_MATCH_THRESHOLD = 0.4
+
+# Stamped into every stored embedding; embeddings from any other model are
+# never matched against. Change it whenever the face encoder changes.
+FACE_EMBEDDING_MODEL = "dlib-resnet-v1"
+
+# Memory-mapped copy of the embedding index shared by every worker process on
+# this host. Defaults to embeddings-<database name>.snapshot next to manage.py;
+# PATH must be on a local filesystem.
+EMBEDDING_SNAPSHOT = {
+    "ENABLED": True,
+    # "PATH": BASE_DIR / "embeddings.snapshot",
+}
+
+# Exact search is fine for a few thousand students; switch to the approximate
+# IVF backend for large rosters and build it with `manage.py build_face_index`.
+# n_probe trades latency for recall.
+FACE_MATCHER = {
+    "BACKEND": "core.matchers.BruteForceMatcher",
+    # "BACKEND": "core.matchers.IVFMatcher",
+    "OPTIONS": {
+        # Closest centroids re-ranked against each student's enrolled photos
+        # "rerank_candidates": 5,
+        # "path": BASE_DIR / "face_index.npz",
+        # "n_probe": 8,
+        # "min_size": 5000,
+    },
+}
+
+# Photos a student can be enrolled with (at registration or added later)
+ENROLLMENT_MAX_PHOTOS = 5
+
+# Enrolled photos are stored upright, stripped of metadata and re-encoded at
+# most MAX_SIDE px; the main photo also gets a THUMBNAIL_SIZE px face crop.
+# Both are named by content hash and served with an immutable Cache-Control
+# of CACHE_MAX_AGE seconds. `manage.py backfill_student_photos` converts
+# photos stored before.
+STUDENT_PHOTOS = {
+    "MAX_SIDE": 1280,
+    "QUALITY": 85,
+    "THUMBNAIL_SIZE": 160,
+    "THUMBNAIL_QUALITY": 80,
+    "THUMBNAIL_PADDING": 0.3,
+    "CACHE_MAX_AGE": 365 * 24 * 60 * 60,
+}
+
+# Bulk enrollment imports (POST /api/enrollment-jobs/ or `manage.py
+# enroll_students`): photos are analysed BATCH_SIZE at a time on the inference
+# pool and every batch is written in one transaction, so a failed job resumes
+# where it stopped. CSV manifests uploaded over the API read their photos from
+# PHOTO_ROOT; BACKGROUND = False runs the import in the request.
+BULK_ENROLLMENT = {
+    "BATCH_SIZE": 16,
+    "MAX_ITEMS": 20000,
+    "NUM_JITTERS": 3,
+    "PHOTO_ROOT": os.environ.get("BULK_ENROLLMENT_PHOTO_ROOT") or None,
+    "BACKGROUND": True,
+}
+
+# Upper bound on frames accepted by /api/recognize/batch/ in one request
+RECOGNIZE_BATCH_MAX_FRAMES = 10
+
+# Face detection and encoding models, loaded lazily by core/model_registry.py.
+# Set RTMS_WARMUP=1 in the serving environment to load them at startup
+# instead of on the first request.
+FACE_MODELS = {
+    "DETECTOR": {
+        "BACKEND": "core.model_registry.YOLOFaceDetector",
+        "OPTIONS": {
+            "weights": os.environ.get(
+                "FACE_DETECTOR_WEIGHTS", BASE_DIR / "yolov8n-face-lindevs.pt"),
+            # "export": "onnx",  # run the detector on onnxruntime (needs onnx, onnxruntime)
+            # "half": True,      # float16; GPU devices only
+        },
+    },
+    "ENCODER": {
+        "BACKEND": "core.model_registry.DlibFaceEncoder",
+        "OPTIONS": {},
+    },
+    "WARMUP": os.environ.get("RTMS_WARMUP", "").lower() in ("1", "true", "yes"),
+}
+
+# Face detection/encoding runs in a pool of worker processes that each load
+# the models once. WORKERS = 0 runs inference inline in the request thread.
+# Jobs beyond MAX_QUEUE are refused with 503 rather than piling up.
+INFERENCE_POOL = {
+    "WORKERS": int(os.environ.get("INFERENCE_WORKERS", 2)),
+    "MAX_QUEUE": 32,
+    "TIMEOUT": 60,
+}
+
+# Threads per process for torch, OpenCV and the BLAS/OpenMP runtime under
+# numpy and dlib (core/runtime.py), instead of every library in every process
+# starting one thread per core. Each inference worker gets an equal share of
+# the cores by default, cpu_count // INFERENCE_POOL["WORKERS"]; web processes
+# only match embeddings and get WEB_THREADS (raise it when WORKERS = 0 runs
+# inference inline). Compare layouts with `manage.py benchmark_runtime`.
+INFERENCE_RUNTIME = {
+    "THREADS": int(os.environ.get("INFERENCE_THREADS", 0)) or None,
+    "WEB_THREADS": int(os.environ.get("WEB_THREADS", 1)),
+    "INTEROP_THREADS": 1,
+    "OPENCV_THREADS": None,
+}
+
+# Admission control in front of the recognition endpoints: at most
+# MAX_IN_FLIGHT requests per process run inference (default: the pool's
+# WORKERS), MAX_WAITING more wait up to MAX_WAIT seconds, and the rest are
+# shed at once with 429/503 and a Retry-After from the measured service time.
+# Sessions already in progress are admitted first. The per-day DRF throttles
+# above only cap abuse; they cannot react to a burst.
+ADMISSION_CONTROL = {
+    "ENABLED": True,
+    "MAX_IN_FLIGHT": None,
+    "MAX_WAITING": 16,
+    "MAX_WAIT": 5.0,
+}
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Inference results by upload content hash. Local memory keeps the
+    # MAX_ENTRIES most recently used per process; a FileBasedCache
+    # (LOCATION = a directory) shares them between processes and restarts
+    "inference": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "inference",
+        "TIMEOUT": 60 * 60,
+        "OPTIONS": {"MAX_ENTRIES": 2000, "CULL_FREQUENCY": 10},
+    },
+}
+
+# Repeated uploads (client retries, identical stills) are answered from the
+# "inference" cache instead of running YOLOv8 and dlib again
+INFERENCE_CACHE = {
+    "ENABLED": True,
+    "CACHE_ALIAS": "inference",
+}
+
+# Students already marked present are remembered per session so repeated
+# recognitions skip the attendance lookup. Set CACHE_ALIAS to a shared cache
+# (e.g. Redis/Memcached) to share the sets between worker processes.
+ATTENDANCE_SESSION_CACHE = {
+    "TTL": 4 * 60 * 60,
+    "CACHE_ALIAS": None,
+}
+
+# Which detected faces are worth the dlib encode: hard limits on detector
+# confidence, size (px in the working image), pose and blur, then best-first
+# encoding within a per-request budget. Skipped faces are reported with a
+# reason in the recognition summary; detections below MIN_CONFIDENCE are not
+# faces and are dropped everywhere (recognition, streaming, debug capture).
+FACE_QUALITY = {
+    "MIN_CONFIDENCE": 0.5,
+    "MIN_FACE_SIZE": 40,
+    "MIN_SHARPNESS": 25.0,
+    "MAX_ASYMMETRY": 0.45,
+    "ASPECT_RANGE": (0.5, 1.25),
+    "MAX_FACES": 60,
+    "ENCODE_BUDGET_SECONDS": 10.0,
+}
+
+# Sessions linked to a class section (pass `section` with the first request)
+# match against that section's students through a cached sub-index; faces
+# nobody in the section matches fall back to everyone if GLOBAL_FALLBACK
+SECTION_MATCHING = {
+    "GLOBAL_FALLBACK": True,
+    "CACHE_SIZE": 256,
+}
+
+# Live recognition from camera MJPEG streams (POST /api/sessions/<id>/stream/).
+# Faces are tracked across frames by box overlap and only new or still
+# unidentified tracks are encoded and matched.
+STREAM_RECOGNITION = {
+    "MAX_FPS": 5,
+    "IOU_THRESHOLD": 0.3,
+    "MAX_MISSES": 10,
+    "RETRY_INTERVAL": 5,
+    "MAX_ATTEMPTS": 5,
+}
+
+# Debug capture of recognition inputs: "off", "sampled" (1 in SAMPLE_RATE
+# requests) or "full". Written by a background thread, trimmed to MAX_BYTES
+# (shared among the INFERENCE_POOL workers; per web process when WORKERS = 0).
+# Only capture files count and are deleted, not the samples in debug_faces/.
+DEBUG_CAPTURE = {
+    "MODE": os.environ.get("DEBUG_CAPTURE_MODE", "off"),
+    "SAMPLE_RATE": 20,
+    "DIRECTORY": BASE_DIR / "debug_faces",
+    "MAX_BYTES": 200 * 1024 * 1024,
+    "QUEUE_SIZE": 16,
+}
+
+# Uploads are validated from their header before decoding, and JPEGs are
+# decoded at reduced resolution so the working image is at most MAX_SIDE px
+IMAGE_PREPROCESSING = {
+    "MAX_UPLOAD_BYTES": 20 * 1024 * 1024,
+    "MAX_PIXELS": 50_000_000,
+    "MAX_SIDE": 1920,
+}
+
+# Structured key=value logs from the core app; per-face details are DEBUG so
+# they cost nothing at the default level
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "structured": {
+            "format": "%(asctime)s level=%(levelname)s logger=%(name)s %(message)s",
+        },
+    },
+    "handlers": {
+        "console": {
+            "class": "logging.StreamHandler",
+            "formatter": "structured",
+        },
+    },
+    "loggers": {
+        "core": {
+            "handlers": ["console"],
+            "level": os.environ.get("RTMS_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
@@ -13,4 +13,9 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
+# Thread limits must be in place before numpy, OpenCV and dlib are loaded
+from core.runtime import configure_environment  # noqa: E402
+
+configure_environment()
+
 application = get_wsgi_application()
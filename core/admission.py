@@ -0,0 +1,197 @@
+"""
+Admission control for the recognition endpoints.
+
+A spike of recognition requests must not pile up behind slow inference
+until clients time out and retry. At most MAX_IN_FLIGHT requests per
+process run inference at once; the next MAX_WAITING wait in a short
+queue, and everything beyond is turned away at once with a Retry-After
+derived from the measured service time (an exponentially weighted moving
+average of how long admitted requests held their slot):
+
+  * 429 when the wait queue is full;
+  * 503 when the expected wait already exceeds MAX_WAIT, or a queued
+    request has waited that long.
+
+Requests for sessions already in progress (students were recognized in
+them recently) go ahead of new sessions in the queue, and may take the
+place of the newest waiting request of a new session when it is full, so
+a class that has started is not starved by the next one checking in.
+
+Configured by settings.ADMISSION_CONTROL:
+
+    ADMISSION_CONTROL = {
+        'ENABLED': True,
+        'MAX_IN_FLIGHT': None,  # default: INFERENCE_POOL workers (at least 1)
+        'MAX_WAITING': 16,
+        'MAX_WAIT': 5.0,        # seconds
+        'SERVICE_TIME': 1.0,    # initial estimate (seconds) until measured
+        'SMOOTHING': 0.2,       # weight of the latest sample in the average
+    }
+"""
+import collections
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+
+class AdmissionRejected(Exception):
+    """A request turned away; status is 429 or 503."""
+
+    def __init__(self, status, retry_after, reason):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ('admitted', 'displaced')
+
+    def __init__(self):
+        self.admitted = False
+        self.displaced = False
+
+
+class Permit:
+    """A slot to run inference in; releases itself on exit from a `with` block."""
+
+    def __init__(self, controller):
+        self._controller = controller
+        self._started = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._controller.release(time.perf_counter() - self._started)
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight=2, max_waiting=16, max_wait=5.0, service_time=1.0,
+                 smoothing=0.2):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.smoothing = smoothing
+        self.service_time = service_time
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        # Waiters of sessions in progress are admitted before the others
+        self._priority = collections.deque()
+        self._normal = collections.deque()
+
+    @property
+    def _waiting(self):
+        return len(self._priority) + len(self._normal)
+
+    def _drain_time(self, requests):
+        # Slots free up max_in_flight at a time, every service_time on average
+        return requests * self.service_time / self.max_in_flight
+
+    def retry_after(self):
+        """Whole seconds until the current backlog should have cleared."""
+        with self._condition:
+            return self._retry_after()
+
+    def _retry_after(self):
+        return max(1, math.ceil(self._drain_time(self._in_flight + self._waiting)))
+
+    def _reject(self, status, reason):
+        metrics.admission_decisions.inc(result=reason)
+        return AdmissionRejected(status, self._retry_after(), reason)
+
+    def admit(self, priority=False):
+        """
+        Wait for a slot and return a Permit, or raise AdmissionRejected.
+
+        priority is for requests of a session already in progress.
+        """
+        with self._condition:
+            ahead = len(self._priority) if priority else self._waiting
+            if self._in_flight < self.max_in_flight and not ahead:
+                self._in_flight += 1
+                metrics.admission_decisions.inc(result='admitted')
+                return Permit(self)
+
+            full = self._waiting >= self.max_waiting
+            if full and not (priority and self._normal):
+                raise self._reject(429, 'queue_full')
+            # Shed now rather than after the client has waited in vain
+            if self._drain_time(ahead + 1) > self.max_wait:
+                raise self._reject(503, 'overloaded')
+            if full:
+                # The newest request of a new session makes room
+                self._normal.pop().displaced = True
+                self._condition.notify_all()
+
+            waiter = _Waiter()
+            queue = self._priority if priority else self._normal
+            queue.append(waiter)
+            deadline = time.monotonic() + self.max_wait
+            while not (waiter.admitted or waiter.displaced):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue.remove(waiter)
+                    raise self._reject(503, 'timeout')
+                self._condition.wait(remaining)
+            if waiter.displaced:
+                raise self._reject(503, 'displaced')
+            metrics.admission_decisions.inc(result='queued')
+            return Permit(self)
+
+    def release(self, elapsed):
+        """Free a slot, handing it to the next waiter, and fold in its service time."""
+        with self._condition:
+            self.service_time += self.smoothing * (elapsed - self.service_time)
+            queue = self._priority or self._normal
+            if queue:
+                # The slot passes straight to the waiter, so no new arrival can take it
+                queue.popleft().admitted = True
+                self._condition.notify_all()
+            else:
+                self._in_flight -= 1
+
+    def stats(self):
+        with self._condition:
+            return {
+                'in_flight': self._in_flight,
+                'max_in_flight': self.max_in_flight,
+                'waiting': self._waiting,
+                'waiting_priority': len(self._priority),
+                'max_waiting': self.max_waiting,
+                'service_time_ms': round(self.service_time * 1000, 2),
+            }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """
+    Return the process-wide controller configured by
+    settings.ADMISSION_CONTROL, or None when admission control is disabled.
+    """
+    global _controller
+    config = getattr(settings, 'ADMISSION_CONTROL', {})
+    if not config.get('ENABLED', True):
+        return None
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                max_in_flight = config.get('MAX_IN_FLIGHT')
+                if max_in_flight is None:
+                    max_in_flight = getattr(settings, 'INFERENCE_POOL', {}).get('WORKERS', 2)
+                _controller = AdmissionController(
+                    max_in_flight=max_in_flight,
+                    max_waiting=config.get('MAX_WAITING', 16),
+                    max_wait=config.get('MAX_WAIT', 5.0),
+                    service_time=config.get('SERVICE_TIME', 1.0),
+                    smoothing=config.get('SMOOTHING', 0.2),
+                )
+    return _controller
+
@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CoreConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "core"
+
+    def ready(self):
+        # Keep the in-memory embedding index in sync with Student rows
+        from . import signals  # noqa: F401
+
+        # RTMS_WARMUP belongs in the serving environment only, so migrate and
+        # other management commands never load the models. Pool workers
+        # inherit it but warm up in their initializer; starting a pool from
+        # here would spawn workers of their own, recursively.
+        from .inference import in_worker
+        if getattr(settings, 'FACE_MODELS', {}).get('WARMUP') and not in_worker():
+            from .model_registry import warmup_in_background
+            warmup_in_background()
@@ -0,0 +1,167 @@
+"""
+Matching recognized faces to students and recording their attendance.
+"""
+import logging
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+from .embeddings import embedding_index
+from .matchers import get_matcher
+from .models import AttendanceRecord, Student
+from .sections import section_scope
+from .session_cache import get_session_cache
+
+logger = logging.getLogger(__name__)
+
+
+def record_attendance(student_pks, session_id, recognized_by):
+    """
+    Mark a set of students present for a session with a bulk insert.
+
+    Returns (newly_marked, already_marked) sets of student primary keys.
+    Concurrent submissions for the same session are resolved by the
+    (student, session_id) unique constraint: every row this call inserts
+    carries the same batch token, so a student only counts as newly marked
+    if the row that survived is ours.
+    """
+    student_pks = set(student_pks)
+    if not student_pks:
+        return set(), set()
+
+    existing = set(AttendanceRecord.objects.filter(
+        session_id=session_id, student_id__in=student_pks,
+    ).values_list('student_id', flat=True))
+
+    to_create = student_pks - existing
+    if not to_create:
+        return set(), existing
+
+    marked_at = timezone.now()
+    token = uuid.uuid4()
+    AttendanceRecord.objects.bulk_create([
+        AttendanceRecord(student_id=pk, session_id=session_id, recognized_by=recognized_by,
+                         timestamp=marked_at, batch_token=token)
+        for pk in to_create
+    ], ignore_conflicts=True)
+
+    # Rows another request inserted first keep that request's token
+    newly_marked = set(AttendanceRecord.objects.filter(
+        session_id=session_id, student_id__in=to_create, batch_token=token,
+    ).values_list('student_id', flat=True))
+    return newly_marked, student_pks - newly_marked
+
+
+def mark_students_present(student_pks, session_id, recognized_by):
+    """
+    Record attendance for matched students, going through the session cache.
+
+    Returns (students, newly_marked_pks): the Student rows by pk, without
+    any deleted since the index was last updated, and the pks this call
+    marked present.
+    """
+    students = Student.objects.in_bulk(student_pks)
+
+    # Students already known to be present need no attendance lookup at all
+    session_cache = get_session_cache()
+    known_present = session_cache.get_present(session_id)
+    newly_marked_pks, _ = record_attendance(
+        students.keys() - known_present, session_id, recognized_by)
+    session_cache.add_present(session_id, students.keys())
+    return students, newly_marked_pks
+
+
+def mark_recognized_faces(faces_data, session_id, recognized_by, include_frame=False,
+                          timer=None, section=None):
+    """
+    Match faces against the roster and record attendance for the session.
+
+    A student seen in several faces (e.g. across frames of a batch) is only
+    reported once, keeping the closest match. With a section, faces are
+    matched against its students first (see core/sections.py) and every
+    result says whether the student is in_section. Returns the response
+    payload, or None when there are no students to compare against. Time
+    spent matching and writing attendance is added to timer (a StageTimer).
+    """
+    if timer is None:
+        timer = metrics.StageTimer()
+
+    with timer.stage('match'):
+        # Match every face against the whole roster in one batched operation
+        embedding_index.ensure_loaded()
+        if len(embedding_index) == 0:
+            return None
+
+        # Lower is better match
+        threshold = settings.FACE_MATCH_THRESHOLD
+        encodings = [face_data['encoding'] for face_data in faces_data]
+        scope = section_scope(section)
+        if scope is not None:
+            matches = scope.match(encodings, threshold)
+        else:
+            matches = get_matcher().match(encodings, threshold)
+
+    best_matches = {}
+    unknown_faces = 0
+    for face_data, (student_pk, best_distance) in zip(faces_data, matches):
+        # No distance at all when there was nothing to compare against
+        logger.debug("match distance=%s threshold=%s student=%s",
+                     None if best_distance is None else round(float(best_distance), 4),
+                     threshold, student_pk)
+        if student_pk is None:
+            unknown_faces += 1
+            # You can optionally track unknown faces locations
+            continue
+        if student_pk not in best_matches or best_distance < best_matches[student_pk][1]:
+            best_matches[student_pk] = (face_data, best_distance)
+    metrics.faces_matched.inc(len(faces_data) - unknown_faces)
+    metrics.faces_unknown.inc(unknown_faces)
+
+    with timer.stage('attendance'):
+        students, newly_marked_pks = mark_students_present(
+            best_matches.keys(), session_id, recognized_by)
+        # Deleted since the index was last updated
+        unknown_faces += len(best_matches.keys() - students.keys())
+
+    results = []
+    newly_marked = []
+    already_marked = []
+
+    for student_pk, student in students.items():
+        face_data, best_distance = best_matches[student_pk]
+        face_location = face_data['location']
+
+        # Create result dictionary with face location
+        result_data = {
+            'student_id': student.student_id,
+            'name': student.name,
+            'distance': best_distance,
+            'face_location': face_location,
+            'confidence': face_location['confidence']
+        }
+        if include_frame:
+            result_data['frame'] = face_data['frame']
+        if scope is not None:
+            result_data['in_section'] = student_pk in scope
+
+        if student_pk in newly_marked_pks:
+            result_data['status'] = 'newly_marked'
+            newly_marked.append(result_data)
+        else:
+            result_data['status'] = 'already_marked'
+            already_marked.append(result_data)
+
+    results.extend(newly_marked)
+    results.extend(already_marked)
+
+    return {
+        'results': results,
+        'summary': {
+            'total_faces_detected': len(faces_data),
+            'newly_marked': len(newly_marked),
+            'already_marked': len(already_marked),
+            'unknown_faces': unknown_faces,
+        }
+    }
@@ -0,0 +1,489 @@
+"""
+Reproducible benchmarks for the registration and recognition pipelines.
+
+Requests go through Django's test client against synthetic rosters of random
+128-d embeddings, using the sample photos shipped in debug_faces/ and media/.
+With stub=True the YOLOv8 detector and dlib encoder are replaced by the
+deterministic stand-ins below, so the suite runs offline on any CPU and
+measures everything except model inference. Results are plain dicts meant to
+be dumped as JSON and compared across commits.
+
+Run it with `manage.py benchmark_pipeline`; `manage.py loadtest_attendance`
+runs the attendance write load test below.
+"""
+import contextlib
+import glob
+import hashlib
+import math
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection, connections
+from django.test import Client, override_settings
+
+from . import admission, inference, recognition
+from .attendance import record_attendance
+from .embeddings import EMBEDDING_DIM, embedding_index, pack_embedding
+from .matchers import get_matcher
+from .model_registry import _noop, model_registry
+from .models import AttendanceRecord, Student
+from .sections import get_section_indexes
+from .session_cache import get_session_cache
+
+SAMPLE_IMAGE_GLOBS = ('debug_faces/*.jpg', 'media/students/*.jpg')
+
+
+class StubFaceDetector:
+    """
+    Offline stand-in for YOLOv8 that reports a fixed grid of faces.
+
+    faces_per_image sets how many faces each image "contains", to simulate
+    anything from a selfie to a lecture hall. Boxes have the proportions
+    of a frontal face so they pass the quality gate's shape check.
+    """
+
+    def __init__(self, faces_per_image=1):
+        self.faces_per_image = faces_per_image
+
+    def detect(self, rgb_images):
+        detections = []
+        for rgb_image in rgb_images:
+            height, width = rgb_image.shape[:2]
+            cols = math.ceil(math.sqrt(self.faces_per_image))
+            rows = math.ceil(self.faces_per_image / cols)
+            cell_w, cell_h = width / cols, height / rows
+            boxes = []
+            box_h = cell_h * 0.6
+            box_w = min(cell_w * 0.6, box_h * 0.8)
+            for i in range(self.faces_per_image):
+                center_x = (i % cols + 0.5) * cell_w
+                center_y = (i // cols + 0.5) * cell_h
+                boxes.append([center_x - box_w / 2, center_y - box_h / 2,
+                              center_x + box_w / 2, center_y + box_h / 2])
+            detections.append((np.array(boxes, dtype=np.float32).reshape(-1, 4),
+                               np.full(len(boxes), 0.9, dtype=np.float32)))
+        return detections
+
+
+class StubFaceEncoder:
+    """
+    Offline stand-in for dlib: a unit vector seeded by the face's pixels.
+
+    The same face crop always yields the same encoding, so a photo that was
+    registered is recognized again.
+    """
+
+    def encode(self, rgb_image, locations, num_jitters=1):
+        encodings = []
+        for top, right, bottom, left in locations:
+            crop = cv2.resize(rgb_image[top:bottom, left:right], (16, 16),
+                              interpolation=cv2.INTER_AREA)
+            seed = int.from_bytes(
+                hashlib.blake2b(crop.tobytes(), digest_size=8).digest(), 'little')
+            vector = np.random.default_rng(seed).normal(size=EMBEDDING_DIM)
+            encodings.append(vector / np.linalg.norm(vector))
+        return encodings
+
+
+def sample_images(patterns=SAMPLE_IMAGE_GLOBS):
+    """(name, bytes) for every sample photo in the repository."""
+    images = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(settings.BASE_DIR, pattern))):
+            with open(path, 'rb') as f:
+                images.append((os.path.basename(path), f.read()))
+    return images
+
+
+def latency_summary(samples):
+    """Percentiles (ms) of a list of durations in seconds."""
+    if not samples:
+        return {'count': 0}
+    ms = np.asarray(samples) * 1000
+    return {
+        'count': len(ms),
+        'mean_ms': round(float(ms.mean()), 3),
+        'min_ms': round(float(ms.min()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p90_ms': round(float(np.percentile(ms, 90)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'max_ms': round(float(ms.max()), 3),
+    }
+
+
+def create_synthetic_roster(size, seed=0, batch_size=5000):
+    """Replace every Student with `size` random unit embeddings."""
+    # Unload first so the delete signals don't patch the index row by row
+    embedding_index.clear()
+    Student.objects.all().delete()
+    rng = np.random.default_rng(seed)
+    for start in range(0, size, batch_size):
+        count = min(batch_size, size - start)
+        vectors = rng.normal(size=(count, EMBEDDING_DIM))
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        Student.objects.bulk_create([
+            Student(name=f'Synthetic {start + i}', student_id=f'synthetic-{start + i}',
+                    embedding=pack_embedding(vector))
+            for i, vector in enumerate(vectors)
+        ])
+    # bulk_create sends no signals, so reload the index explicitly
+    embedding_index.load()
+
+
+def bench_matching(n_faces, iterations, seed=1):
+    """Match n_faces random encodings against the current roster."""
+    rng = np.random.default_rng(seed)
+    matcher = get_matcher()
+    samples = []
+    for _ in range(iterations):
+        faces = rng.normal(size=(n_faces, EMBEDDING_DIM))
+        started = time.perf_counter()
+        matcher.match(faces, settings.FACE_MATCH_THRESHOLD)
+        samples.append(time.perf_counter() - started)
+    return latency_summary(samples)
+
+
+def bench_register(client, images, iterations):
+    samples = []
+    statuses = {}
+    for i in range(iterations):
+        name, data = images[i % len(images)]
+        started = time.perf_counter()
+        response = client.post('/api/register/', {
+            'name': f'Benchmark {i}',
+            'student_id': f'benchmark-{i}-{time.monotonic_ns()}',
+            'photo': SimpleUploadedFile(name, data, content_type='image/jpeg'),
+        })
+        samples.append(time.perf_counter() - started)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    return {'latency': latency_summary(samples), 'statuses': statuses}
+
+
+def bench_recognize(client, images, iterations, session_id):
+    samples = []
+    stages = {}
+    statuses = {}
+    for i in range(iterations):
+        name, data = images[i % len(images)]
+        started = time.perf_counter()
+        response = client.post('/api/recognize/?timings=1', {
+            'image': SimpleUploadedFile(name, data, content_type='image/jpeg'),
+            'session_id': session_id,
+            'recognized_by': 'benchmark',
+        })
+        samples.append(time.perf_counter() - started)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        if response.status_code == 200:
+            for stage, ms in response.json().get('timings', {}).items():
+                stages.setdefault(stage, []).append(ms / 1000)
+    elapsed = sum(samples)
+    return {
+        'latency': latency_summary(samples),
+        'throughput_rps': round(iterations / elapsed, 2) if elapsed else None,
+        'stages': {stage: latency_summary(values) for stage, values in stages.items()},
+        'statuses': statuses,
+    }
+
+
+def _reset_singletons():
+    model_registry.reset()
+    inference._pool = None
+    admission._controller = None
+    get_session_cache().clear()
+    get_section_indexes().clear()
+
+
+@contextlib.contextmanager
+def benchmark_environment(stub=True, faces_per_image=1):
+    """Inline inference, no debug capture or inference cache, throwaway media, optional stubs."""
+    overrides = {
+        'INFERENCE_POOL': {'WORKERS': 0},
+        'DEBUG_CAPTURE': {'MODE': 'off'},
+        # The sample photos repeat, and every request should measure inference
+        'INFERENCE_CACHE': {'ENABLED': False},
+    }
+    if stub:
+        overrides.update(
+            FACE_MODELS={
+                'DETECTOR': {'BACKEND': 'core.benchmark.StubFaceDetector',
+                             'OPTIONS': {'faces_per_image': faces_per_image}},
+                'ENCODER': {'BACKEND': 'core.benchmark.StubFaceEncoder'},
+            },
+            # Keeps stub embeddings apart from real ones
+            FACE_EMBEDDING_MODEL='benchmark-stub',
+        )
+    with tempfile.TemporaryDirectory() as media_root:
+        with override_settings(MEDIA_ROOT=media_root, **overrides):
+            _reset_singletons()
+            try:
+                yield
+            finally:
+                _reset_singletons()
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(roster_sizes=(1000, 10000, 100000), iterations=20, stub=True,
+                  faces_per_image=1, images=None, log=None):
+    """
+    Run the full suite against the current database and return the results.
+
+    Every roster size replaces the Student table, so only call this on a
+    test database.
+    """
+    images = images or sample_images()
+    if not images:
+        raise ValueError("No sample images found")
+    log = log or (lambda message: None)
+    results = {
+        'revision': git_revision(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'platform': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': {
+            'stub_models': stub,
+            'iterations': iterations,
+            'faces_per_image': faces_per_image,
+            'sample_images': len(images),
+            'matcher': settings.FACE_MATCHER.get('BACKEND'),
+        },
+        'rosters': {},
+    }
+
+    with benchmark_environment(stub=stub, faces_per_image=faces_per_image):
+        client = Client()
+        for size in roster_sizes:
+            log(f"Roster of {size} students")
+            started = time.perf_counter()
+            create_synthetic_roster(size)
+            roster = {'setup_s': round(time.perf_counter() - started, 3)}
+
+            roster['matching'] = bench_matching(max(faces_per_image, 1), iterations)
+            roster['register'] = bench_register(client, images, iterations)
+            roster['recognize'] = bench_recognize(
+                client, images, iterations, session_id=f'benchmark-{size}')
+            results['rosters'][str(size)] = roster
+
+            AttendanceRecord.objects.filter(session_id=f'benchmark-{size}').delete()
+        embedding_index.clear()
+        Student.objects.all().delete()
+
+    return results
+
+
+def _attendance_writer(session_id, student_pks, batch_size, start, samples, errors):
+    """One classroom: marks its roster present a batch at a time."""
+    try:
+        start.wait()
+        for offset in range(0, len(student_pks), batch_size):
+            started = time.perf_counter()
+            try:
+                record_attendance(student_pks[offset:offset + batch_size],
+                                  session_id, 'loadtest')
+            except DatabaseError as e:
+                errors.append(str(e))
+                continue
+            samples.append(time.perf_counter() - started)
+    finally:
+        # Each thread has its own connection
+        connections.close_all()
+
+
+def run_attendance_loadtest(concurrency=(1, 4, 16), students=200, batch_size=5, log=None):
+    """
+    Measure attendance write throughput under concurrent sessions.
+
+    For each concurrency level N, N threads (one per classroom session, each
+    with its own database connection) mark the whole roster present at
+    once, batch_size students per write, the way consecutive recognition
+    requests of a session do. Creates a synthetic roster, so only call this
+    on a test database.
+    """
+    log = log or (lambda message: None)
+    results = {
+        'revision': git_revision(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'database': {
+            'vendor': connection.vendor,
+            'conn_max_age': connection.settings_dict.get('CONN_MAX_AGE'),
+            'options': connection.settings_dict['OPTIONS'],
+        },
+        'config': {'students': students, 'batch_size': batch_size},
+        'levels': {},
+    }
+
+    AttendanceRecord.objects.all().delete()
+    Student.objects.all().delete()
+    Student.objects.bulk_create([
+        Student(name=f'Load {i}', student_id=f'load-{i}', embedding=b'')
+        for i in range(students)
+    ])
+    student_pks = list(Student.objects.order_by('pk').values_list('pk', flat=True))
+
+    for sessions in concurrency:
+        log(f"{sessions} concurrent sessions")
+        samples = []
+        errors = []
+        start = threading.Barrier(sessions + 1)
+        threads = [
+            threading.Thread(target=_attendance_writer, args=(
+                f'loadtest-{sessions}-{i}', student_pks, batch_size, start, samples, errors))
+            for i in range(sessions)
+        ]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        records = AttendanceRecord.objects.filter(
+            session_id__startswith=f'loadtest-{sessions}-').count()
+        results['levels'][str(sessions)] = {
+            'writes': len(samples),
+            'errors': len(errors),
+            'error_samples': sorted(set(errors))[:5],
+            'records': records,
+            'elapsed_s': round(elapsed, 3),
+            'writes_per_s': round(len(samples) / elapsed, 1) if elapsed else None,
+            'records_per_s': round(records / elapsed, 1) if elapsed else None,
+            'latency': latency_summary(samples),
+        }
+
+    AttendanceRecord.objects.all().delete()
+    Student.objects.all().delete()
+    return results
+
+
+def default_layouts(cpus=None):
+    """
+    (workers, threads per worker) layouts that split the cores evenly, from
+    one many-threaded worker to one single-threaded worker per core, plus
+    every library's default of one thread per core in every worker.
+    """
+    cpus = cpus or os.cpu_count() or 1
+    layouts = []
+    workers = 1
+    while workers <= cpus:
+        layouts.append((workers, cpus // workers))
+        workers *= 2
+    if (cpus, 1) not in layouts:
+        layouts.append((cpus, 1))
+    if cpus > 1:
+        layouts.append((cpus, cpus))  # oversubscribed
+    return layouts
+
+
+def bench_layout(workers, threads, images, requests, worker_settings=None):
+    """
+    Throughput and latency of `requests` concurrent recognition jobs on a
+    fresh pool of `workers` processes with `threads` threads each.
+    """
+    pool = inference.InferencePool(
+        workers=workers, max_queue=requests + workers, timeout=None,
+        runtime={'threads': threads, 'interop_threads': 1, 'opencv_threads': threads},
+        worker_settings=worker_settings)
+    try:
+        # Spawning and loading the models is not part of the measurement
+        started = time.perf_counter()
+        for future in [pool.submit(_noop, key=i) for i in range(workers)]:
+            future.result()
+        startup = time.perf_counter() - started
+        pool.reset_stats()
+
+        started = time.perf_counter()
+        futures = [
+            pool.submit(recognition.analyze_images, [images[i % len(images)][1]],
+                        key=i % workers)
+            for i in range(requests)
+        ]
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - started
+        latency = pool.stats()['latency']
+    finally:
+        pool.close()
+
+    return {
+        'workers': workers,
+        'threads': threads,
+        'startup_s': round(startup, 3),
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_s': round(requests / elapsed, 2) if elapsed else None,
+        # From submission to result, and inside the worker only
+        'latency': latency['total'],
+        'execute': latency['execute'],
+    }
+
+
+def run_layout_benchmark(layouts=None, requests=40, stub=True, faces_per_image=1,
+                         images=None, log=None):
+    """
+    Compare inference pool layouts: how many worker processes, and how many
+    threads each gives torch, OpenCV and BLAS (see core.runtime).
+
+    With stub=True the workers run the stand-in models, which measures the
+    decoding and preprocessing around inference; real models are what the
+    layouts mostly differ on.
+    """
+    images = images or sample_images()
+    if not images:
+        raise ValueError("No sample images found")
+    log = log or (lambda message: None)
+    layouts = layouts or default_layouts()
+    worker_settings = {'DEBUG_CAPTURE': {'MODE': 'off'}}
+    if stub:
+        worker_settings.update(
+            FACE_MODELS={
+                'DETECTOR': {'BACKEND': 'core.benchmark.StubFaceDetector',
+                             'OPTIONS': {'faces_per_image': faces_per_image}},
+                'ENCODER': {'BACKEND': 'core.benchmark.StubFaceEncoder'},
+            },
+        )
+    results = {
+        'revision': git_revision(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'platform': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+        },
+        'config': {
+            'stub_models': stub,
+            'requests': requests,
+            'faces_per_image': faces_per_image,
+            'sample_images': len(images),
+        },
+        'layouts': [],
+    }
+
+    for workers, threads in layouts:
+        log(f"{workers} workers x {threads} threads")
+        results['layouts'].append(
+            bench_layout(workers, threads, images, requests, worker_settings))
+    if results['layouts']:
+        best = max(results['layouts'], key=lambda layout: layout['requests_per_s'] or 0)
+        results['best'] = {'workers': best['workers'], 'threads': best['threads']}
+    return results
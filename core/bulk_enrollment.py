@@ -0,0 +1,470 @@
+"""
+Bulk enrollment imports.
+
+Onboarding a term from one upload instead of one /api/register/ call per
+student. A job's manifest is parsed up front into EnrollmentItem rows;
+run_job() then feeds the pending items to the inference pool in batches of
+BATCH_SIZE photos, so every worker process runs YOLOv8 over a whole batch
+at once and as many batches are encoded in parallel as there are workers.
+Each finished batch is written in one transaction: its students and their
+embeddings with bulk_create, its items marked enrolled or failed with the
+reason. Items only leave 'pending' in that transaction, so a job that
+crashed or was stopped is resumed by running it again.
+
+The manifest is CSV with a header row naming (at least) student_id, name
+and photo. In a zip it is manifest.csv, or the only .csv file, and photo
+paths are relative to it; a bare CSV's photo paths are relative to the
+job's photo_root.
+
+Configured by settings.BULK_ENROLLMENT:
+
+    BULK_ENROLLMENT = {
+        'BATCH_SIZE': 16,     # photos per inference job (one YOLOv8 batch)
+        'MAX_ITEMS': 20000,   # manifest rows accepted in one job
+        'NUM_JITTERS': 3,     # dlib re-samples per photo, as for one-photo registration
+        'PHOTO_ROOT': None,   # where CSV manifests uploaded over the API find their photos
+        'BACKGROUND': True,   # False runs jobs started over the API in the request
+    }
+"""
+import collections
+import concurrent.futures
+import contextlib
+import csv
+import io
+import logging
+import os
+import posixpath
+import threading
+import time
+import zipfile
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .embeddings import EmbeddingFormatError, centroid_embedding, embedding_index, pack_embedding
+from .inference import InferenceQueueFull, get_inference_pool
+from .models import EnrollmentItem, EnrollmentJob, Student, StudentEmbedding
+from .photos import store_photo
+from .preprocessing import ImageRejected, inspect_image
+from .recognition import analyze_enrollment
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_COLUMNS = ('student_id', 'name', 'photo')
+# Seconds to wait when live recognition has filled the inference queue
+QUEUE_FULL_BACKOFF = 0.5
+
+
+class EnrollmentImportError(Exception):
+    """The uploaded manifest cannot be imported."""
+
+
+def _config():
+    return getattr(settings, 'BULK_ENROLLMENT', {})
+
+
+class _ZipPhotos:
+    """Manifest and photos from a zip archive."""
+
+    def __init__(self, fileobj):
+        try:
+            self._zip = zipfile.ZipFile(fileobj)
+        except zipfile.BadZipFile as e:
+            raise EnrollmentImportError(f'Not a valid zip file: {e}')
+        manifests = [name for name in self._zip.namelist()
+                     if name.lower().endswith('.csv') and not name.startswith('__MACOSX/')]
+        by_name = [name for name in manifests if posixpath.basename(name) == 'manifest.csv']
+        if len(by_name) == 1:
+            self._manifest = by_name[0]
+        elif len(manifests) == 1:
+            self._manifest = manifests[0]
+        else:
+            raise EnrollmentImportError('The zip must contain one manifest.csv')
+        self._base = posixpath.dirname(self._manifest)
+
+    def manifest(self):
+        return self._zip.read(self._manifest)
+
+    def read(self, name):
+        try:
+            return self._zip.read(posixpath.normpath(posixpath.join(self._base, name)))
+        except KeyError:
+            raise FileNotFoundError(name)
+
+
+class _DirectoryPhotos:
+    """A CSV manifest whose photos are files under a directory."""
+
+    def __init__(self, fileobj, root):
+        if not root:
+            raise EnrollmentImportError(
+                'CSV manifests need BULK_ENROLLMENT["PHOTO_ROOT"]; '
+                'upload a zip of the manifest and photos instead')
+        self._data = fileobj.read()
+        self._root = os.path.realpath(root)
+
+    def manifest(self):
+        return self._data
+
+    def read(self, name):
+        path = os.path.realpath(os.path.join(self._root, name))
+        # Never read outside the photo directory, whatever the manifest says
+        if os.path.commonpath([self._root, path]) != self._root:
+            raise FileNotFoundError(name)
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+@contextlib.contextmanager
+def open_photos(job):
+    """The job's manifest and photos, as an object with manifest() and read(name)."""
+    # From storage, not the upload the job may still hold
+    with job.source.storage.open(job.source.name, 'rb') as fileobj:
+        if zipfile.is_zipfile(fileobj):
+            fileobj.seek(0)
+            yield _ZipPhotos(fileobj)
+        else:
+            fileobj.seek(0)
+            yield _DirectoryPhotos(fileobj, job.photo_root)
+
+
+def parse_manifest(data):
+    """(line, row) for every row of a CSV manifest given as bytes."""
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise EnrollmentImportError('The manifest must be UTF-8 encoded CSV')
+    reader = csv.DictReader(io.StringIO(text))
+    missing = [column for column in MANIFEST_COLUMNS if column not in (reader.fieldnames or ())]
+    if missing:
+        raise EnrollmentImportError(f"Manifest is missing columns: {', '.join(missing)}")
+
+    max_items = _config().get('MAX_ITEMS', 20000)
+    rows = []
+    try:
+        for row in reader:
+            if len(rows) >= max_items:
+                raise EnrollmentImportError(f'At most {max_items} students per job')
+            rows.append((reader.line_num, row))
+    except csv.Error as e:
+        raise EnrollmentImportError(f'Invalid CSV at line {reader.line_num}: {e}')
+    return rows
+
+
+def _manifest_items(job, rows):
+    # Rows that can never be enrolled are failed up front
+    items = []
+    seen = {}
+    for line, row in rows:
+        fields = {column: (row.get(column) or '').strip() for column in MANIFEST_COLUMNS}
+        item = EnrollmentItem(job=job, line=line, **{
+            column: value[:EnrollmentItem._meta.get_field(column).max_length]
+            for column, value in fields.items()})
+        missing = [column for column, value in fields.items() if not value]
+        if missing:
+            item.status, item.error = EnrollmentItem.FAILED, f"Missing {', '.join(missing)}"
+        elif len(fields['student_id']) > Student._meta.get_field('student_id').max_length:
+            item.status, item.error = EnrollmentItem.FAILED, 'student_id is too long'
+        elif fields['student_id'] in seen:
+            item.status = EnrollmentItem.FAILED
+            item.error = f"Duplicate of line {seen[fields['student_id']]}"
+        else:
+            seen[fields['student_id']] = line
+        items.append(item)
+    return items
+
+
+def create_job(upload, photo_root=None):
+    """
+    Store an uploaded zip or CSV manifest and parse it into a pending job.
+
+    photo_root locates the photos of a CSV manifest (default
+    BULK_ENROLLMENT['PHOTO_ROOT']). Raises EnrollmentImportError when the
+    manifest cannot be imported.
+    """
+    if photo_root is None:
+        photo_root = _config().get('PHOTO_ROOT') or ''
+    job = EnrollmentJob.objects.create(source=upload, photo_root=str(photo_root))
+    try:
+        with open_photos(job) as photos:
+            items = _manifest_items(job, parse_manifest(photos.manifest()))
+        with transaction.atomic():
+            EnrollmentItem.objects.bulk_create(items, batch_size=1000)
+            job.total = len(items)
+            job.save(update_fields=['total'])
+    except BaseException:
+        job.source.delete(save=False)
+        job.delete()
+        raise
+    logger.info("enrollment job created job=%s items=%d", job.pk, job.total)
+    return job
+
+
+def job_progress(job):
+    """The job's state and item counts by status, in one query."""
+    counts = {row['status']: row['count'] for row in
+              job.items.values('status').annotate(count=Count('pk')).order_by()}
+    done = counts.get(EnrollmentItem.ENROLLED, 0) + counts.get(EnrollmentItem.FAILED, 0)
+    return {
+        'id': job.pk,
+        'status': job.status,
+        'total': job.total,
+        'pending': counts.get(EnrollmentItem.PENDING, 0),
+        'enrolled': counts.get(EnrollmentItem.ENROLLED, 0),
+        'failed': counts.get(EnrollmentItem.FAILED, 0),
+        'progress': round(done / job.total, 4) if job.total else 1.0,
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
+
+
+def failed_items(job):
+    """The job's failed items and why, in manifest order."""
+    return job.items.filter(status=EnrollmentItem.FAILED).order_by('line').values(
+        'line', 'student_id', 'photo', 'error')
+
+
+def _save_items(items):
+    EnrollmentItem.objects.bulk_update(items, ['status', 'error', 'enrolled_student'])
+
+
+def _fail(item, error):
+    item.status = EnrollmentItem.FAILED
+    item.error = error[:EnrollmentItem._meta.get_field('error').max_length]
+
+
+def _read_photos(items, photos):
+    """(items, images) of the photos that are acceptable images; the rest are failed."""
+    readable, images, failed = [], [], []
+    for item in items:
+        try:
+            img_data = photos.read(item.photo)
+            inspect_image(img_data)
+        except FileNotFoundError:
+            _fail(item, f'Photo not found: {item.photo}')
+        except ImageRejected as e:
+            _fail(item, str(e))
+        else:
+            readable.append(item)
+            images.append(img_data)
+            continue
+        failed.append(item)
+    if failed:
+        _save_items(failed)
+    return readable, images
+
+
+def _submit(pool, images, num_jitters, key):
+    while True:
+        try:
+            return pool.submit(analyze_enrollment, images, num_jitters=num_jitters, key=key)
+        except InferenceQueueFull:
+            # Live recognition comes first; wait for room rather than give up
+            time.sleep(QUEUE_FULL_BACKOFF)
+
+
+def _index_students(enrolled):
+    # bulk_create sends no post_save, so patch a loaded index as the signal would
+    if not embedding_index.loaded:
+        return
+    for student, member in enrolled:
+        try:
+            embedding_index.add(student.pk, student.embedding, members=[member.embedding],
+                                updated_at=student.updated_at, member_pks=[member.pk])
+        except EmbeddingFormatError as e:
+            logger.warning("not indexing student pk=%s: %s", student.pk, e)
+    embedding_index.save_snapshot()
+
+
+def _write_batch(items, images, photos):
+    """
+    Enroll the items whose photo yielded an encoding and fail the others.
+
+    Returns the (items, images) to analyse again: a photo that fails to
+    decode stops analyze_enrollment() before detection, so the rest of its
+    batch has not been looked at yet.
+    """
+    if not all(photo['valid'] for photo in photos):
+        retry_items, retry_images, failed = [], [], []
+        for item, img_data, photo in zip(items, images, photos):
+            if photo['valid']:
+                retry_items.append(item)
+                retry_images.append(img_data)
+            else:
+                _fail(item, photo['error'])
+                failed.append(item)
+        _save_items(failed)
+        return retry_items, retry_images
+
+    failed, encoded = [], []
+    for item, img_data, photo in zip(items, images, photos):
+        if photo['detected'] == 0:
+            _fail(item, 'No face detected')
+        elif photo['encoding'] is None:
+            _fail(item, 'Could not generate face encoding')
+        else:
+            encoded.append((item, img_data, photo.get('box'), pack_embedding(photo['encoding'])))
+            continue
+        failed.append(item)
+
+    with transaction.atomic():
+        # Items another run of the same job finished in the meantime stay as they are
+        still_pending = set(EnrollmentItem.objects.filter(
+            pk__in=[item.pk for item in items], status=EnrollmentItem.PENDING,
+        ).values_list('pk', flat=True))
+        failed = [item for item in failed if item.pk in still_pending]
+        encoded = [entry for entry in encoded if entry[0].pk in still_pending]
+        taken = set(Student.objects.filter(
+            student_id__in=[entry[0].student_id for entry in encoded],
+        ).values_list('student_id', flat=True))
+
+        new = []
+        for item, img_data, box, embedding in encoded:
+            if item.student_id in taken:
+                _fail(item, 'Student already exists')
+                failed.append(item)
+                continue
+            try:
+                photo_name, thumbnail_name = store_photo(img_data, box)
+            except (ImageRejected, OSError) as e:
+                _fail(item, f'Could not store photo: {e}')
+                failed.append(item)
+                continue
+            student = Student(name=item.name, student_id=item.student_id,
+                              embedding=centroid_embedding([embedding]),
+                              photo=photo_name, thumbnail=thumbnail_name)
+            new.append((item, student, embedding))
+
+        Student.objects.bulk_create([student for _, student, _ in new])
+        members = StudentEmbedding.objects.bulk_create([
+            StudentEmbedding(student=student, embedding=embedding, photo=student.photo.name)
+            for _, student, embedding in new
+        ])
+        for item, student, _ in new:
+            item.status = EnrollmentItem.ENROLLED
+            item.error = ''
+            item.enrolled_student = student
+        _save_items(failed + [item for item, _, _ in new])
+        enrolled = [(student, member) for (_, student, _), member in zip(new, members)]
+        transaction.on_commit(lambda: _index_students(enrolled))
+    return [], []
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def run_job(job, batch_size=None, log=None):
+    """
+    Enroll a job's pending items, then mark the job done, or failed with
+    the error that stopped it.
+
+    Safe to call again on a job that stopped part-way: only the items still
+    pending are processed. Returns the job.
+    """
+    config = _config()
+    batch_size = max(1, batch_size or config.get('BATCH_SIZE', 16))
+    num_jitters = config.get('NUM_JITTERS', 3)
+    log = log or (lambda message: None)
+
+    job.status = EnrollmentJob.RUNNING
+    job.error = ''
+    job.started_at = job.started_at or timezone.now()
+    job.finished_at = None
+    job.save(update_fields=['status', 'error', 'started_at', 'finished_at'])
+
+    pool = get_inference_pool()
+    key = f'enrollment-{job.pk}'
+    started = time.perf_counter()
+    try:
+        pending = list(job.items.filter(status=EnrollmentItem.PENDING).order_by('line'))
+        logger.info("enrollment job started job=%s pending=%d", job.pk, len(pending))
+        with open_photos(job) as photos:
+            # One batch per worker in flight keeps every worker busy without
+            # taking the whole queue from live recognition
+            in_flight = collections.deque()
+
+            def finish_oldest():
+                items, images, future = in_flight.popleft()
+                retry_items, retry_images = _write_batch(items, images, future.result()['photos'])
+                if retry_items:
+                    in_flight.append((retry_items, retry_images,
+                                      _submit(pool, retry_images, num_jitters, key)))
+                progress = job_progress(job)
+                log(f"job {job.pk}: {progress['enrolled']} enrolled, "
+                    f"{progress['failed']} failed, {progress['pending']} pending")
+
+            for batch in _batches(pending, batch_size):
+                items, images = _read_photos(batch, photos)
+                if items:
+                    in_flight.append((items, images, _submit(pool, images, num_jitters, key)))
+                while len(in_flight) >= max(1, pool.workers):
+                    finish_oldest()
+            while in_flight:
+                finish_oldest()
+    except Exception as e:
+        logger.exception("enrollment job failed job=%s", job.pk)
+        job.status = EnrollmentJob.FAILED
+        job.error = str(e) or type(e).__name__
+    else:
+        job.status = EnrollmentJob.DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    logger.info("enrollment job finished job=%s status=%s elapsed_s=%.1f",
+                job.pk, job.status, time.perf_counter() - started)
+    return job
+
+
+_runner = None
+_runner_lock = threading.Lock()
+# Jobs queued or running in this process's runner
+_queued = set()
+
+
+def get_job_runner():
+    """Return the process-wide thread that runs jobs started over the API, one at a time."""
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='bulk-enrollment')
+    return _runner
+
+
+def is_queued(job):
+    with _runner_lock:
+        return job.pk in _queued
+
+
+def _run_queued(job_pk):
+    try:
+        run_job(EnrollmentJob.objects.get(pk=job_pk))
+    except Exception:
+        logger.exception("enrollment job could not run job=%s", job_pk)
+    finally:
+        with _runner_lock:
+            _queued.discard(job_pk)
+        # The runner thread's own connections
+        connections.close_all()
+
+
+def start_job(job):
+    """
+    Run a job in the background, unless BULK_ENROLLMENT['BACKGROUND'] is
+    false. Returns False when it is already queued in this process.
+    """
+    if not _config().get('BACKGROUND', True):
+        run_job(job)
+        return True
+    with _runner_lock:
+        if job.pk in _queued:
+            return False
+        _queued.add(job.pk)
+    get_job_runner().submit(_run_queued, job.pk)
+    return True
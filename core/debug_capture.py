@@ -0,0 +1,180 @@
+"""
+Optional capture of recognition inputs for debugging.
+
+Images are JPEG-encoded and written by a background thread, never by the
+request. Captures go through a small bounded queue and are dropped when the
+writer falls behind, and this module's files in the capture directory are
+trimmed (oldest first) to a size budget; anything else there is left alone.
+
+Capture runs wherever inference does. Each inference pool worker keeps its
+own byte count, so it gets MAX_BYTES divided among the pool's WORKERS; with
+WORKERS = 0 every web process has the full MAX_BYTES.
+
+Configured by settings.DEBUG_CAPTURE:
+
+    DEBUG_CAPTURE = {
+        'MODE': 'off',          # 'off', 'sampled' (1 in SAMPLE_RATE) or 'full'
+        'SAMPLE_RATE': 20,
+        'DIRECTORY': BASE_DIR / 'debug_faces',
+        'MAX_BYTES': 200 * 1024 * 1024,
+        'QUEUE_SIZE': 16,
+    }
+"""
+import collections
+import itertools
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+
+import cv2
+from django.conf import settings
+from django.utils.text import slugify
+
+logger = logging.getLogger(__name__)
+
+MODES = ('off', 'sampled', 'full')
+# Names written by _write(); e.g. the sample photos in debug_faces/ do not match
+CAPTURE_NAME = re.compile(r'^(original|face)_\d+_[0-9a-f]{8}(_[-\w]+)?\.jpg$')
+
+
+class DebugCapture:
+    def __init__(self, mode='off', sample_rate=20, directory=None,
+                 max_bytes=200 * 1024 * 1024, queue_size=16):
+        if mode not in MODES:
+            raise ValueError(f"DEBUG_CAPTURE mode must be one of {MODES}, got {mode!r}")
+        self.mode = mode
+        self.sample_rate = max(1, sample_rate)
+        self.directory = str(directory or os.path.join(settings.BASE_DIR, 'debug_faces'))
+        self.max_bytes = max_bytes
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._counter = itertools.count()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self.dropped = 0
+        self.written = 0
+
+    def should_capture(self):
+        if self.mode == 'off':
+            return False
+        if self.mode == 'full':
+            return True
+        return next(self._counter) % self.sample_rate == 0
+
+    def capture(self, rgb_image, boxes, tag=''):
+        """
+        Queue an image and its face boxes for writing; never blocks.
+
+        Returns False when the capture was not sampled or had to be dropped.
+        """
+        if not self.should_capture():
+            return False
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((rgb_image, boxes, tag))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _ensure_writer(self):
+        if self._writer is None:
+            with self._writer_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(
+                        target=self._write_loop, name='debug-capture', daemon=True)
+                    self._writer.start()
+
+    def _write_loop(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = collections.deque(self._existing_files())
+        total = sum(size for _, size in files)
+        while True:
+            rgb_image, boxes, tag = self._queue.get()
+            try:
+                for path in self._write(rgb_image, boxes, tag):
+                    size = os.path.getsize(path)
+                    files.append((path, size))
+                    total += size
+                total = self._enforce_retention(files, total)
+                self.written += 1
+            except Exception:
+                logger.exception("debug capture failed")
+            finally:
+                self._queue.task_done()
+
+    def _existing_files(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and CAPTURE_NAME.match(entry.name):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return [(path, size) for _, path, size in sorted(entries)]
+
+    def _enforce_retention(self, files, total):
+        # Oldest first; files is kept in write order
+        while total > self.max_bytes and files:
+            path, size = files.popleft()
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+    def _write(self, rgb_image, boxes, tag):
+        # Unique per capture, so concurrent requests never overwrite each other
+        stem = f"{int(time.time())}_{uuid.uuid4().hex[:8]}"
+        tag = slugify(tag)
+        if tag:
+            stem = f"{stem}_{tag}"
+        bgr_image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
+
+        path = os.path.join(self.directory, f"original_{stem}.jpg")
+        cv2.imwrite(path, bgr_image)
+        paths = [path]
+
+        for i, box in enumerate(boxes):
+            x1, y1, x2, y2 = map(int, box)
+            face_img = bgr_image[max(y1, 0):y2, max(x1, 0):x2]
+            if face_img.size == 0:
+                continue
+            path = os.path.join(self.directory, f"face_{stem}_{i}.jpg")
+            cv2.imwrite(path, face_img)
+            paths.append(path)
+        return paths
+
+    def flush(self):
+        """Block until every queued capture has been written."""
+        self._queue.join()
+
+
+_debug_capture = None
+_debug_capture_lock = threading.Lock()
+
+
+def get_debug_capture():
+    """Return the process-wide capture configured by settings.DEBUG_CAPTURE."""
+    global _debug_capture
+    if _debug_capture is None:
+        with _debug_capture_lock:
+            if _debug_capture is None:
+                from .inference import in_worker
+
+                config = getattr(settings, 'DEBUG_CAPTURE', {})
+                max_bytes = config.get('MAX_BYTES', 200 * 1024 * 1024)
+                if in_worker():
+                    # Every worker trims on its own; together they stay within MAX_BYTES
+                    max_bytes //= max(1, getattr(settings, 'INFERENCE_POOL', {}).get('WORKERS', 2))
+                _debug_capture = DebugCapture(
+                    mode=config.get('MODE', 'off'),
+                    sample_rate=config.get('SAMPLE_RATE', 20),
+                    directory=config.get('DIRECTORY'),
+                    max_bytes=max_bytes,
+                    queue_size=config.get('QUEUE_SIZE', 16),
+                )
+    return _debug_capture
@@ -0,0 +1,678 @@
+"""
+Student face embeddings: the storage format and the in-memory index.
+
+Embeddings are stored in Student.embedding as a 32-byte header followed by
+the vector as little-endian float32:
+
+    magic    4s   b'FEMB'
+    version  B    format version (1)
+    dtype    B    1 = float32
+    dim      H    vector length
+    norm     f    L2 norm of the vector, checked on read
+    model   16s   id of the encoder that produced it (settings.FACE_EMBEDDING_MODEL)
+    (4 bytes padding, so the vector is 16-byte aligned)
+
+Rows written before the header existed are raw float64 bytes; they are still
+read (as the default dlib model) and are converted by migration 0003.
+
+The index built from those rows is also written to a snapshot file (student
+ids, centroid matrix and squared norms, and every enrolled embedding, after
+a 128-byte header) that every worker process on the host maps with
+np.memmap instead of decoding the whole Student table itself. The header
+records a signature of the rows it covers, checked against the database on
+load: (count, max pk, pk sum) of the Student and StudentEmbedding rows and
+the latest Student.updated_at. updated_at is only set by save() and
+bulk_create(); an embedding changed with queryset.update(), bulk_update()
+or raw SQL must also set it, or the snapshot is trusted stale.
+"""
+import collections
+import contextlib
+import logging
+import os
+import struct
+import tempfile
+import threading
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# face_recognition/dlib produce 128-dimension face encodings
+EMBEDDING_DIM = 128
+DEFAULT_EMBEDDING_MODEL = 'dlib-resnet-v1'
+
+EMBEDDING_MAGIC = b'FEMB'
+EMBEDDING_FORMAT_VERSION = 1
+_HEADER = struct.Struct('<4sBBHf16s4x')
+_DTYPES = {1: np.dtype('<f4')}
+_DTYPE_CODES = {dtype: code for code, dtype in _DTYPES.items()}
+
+EmbeddingHeader = collections.namedtuple('EmbeddingHeader', 'version model dim dtype norm')
+
+
+class EmbeddingFormatError(ValueError):
+    """A stored embedding is corrupt or was produced by a different model."""
+
+
+def current_embedding_model():
+    return getattr(settings, 'FACE_EMBEDDING_MODEL', DEFAULT_EMBEDDING_MODEL)
+
+
+def pack_embedding(vector, model=None):
+    """Serialize an encoding as a versioned float32 embedding."""
+    vector = np.ascontiguousarray(vector, dtype='<f4').ravel()
+    model = (model or current_embedding_model()).encode('ascii')
+    if len(model) > 16:
+        raise ValueError(f"Embedding model id {model!r} is longer than 16 bytes")
+    header = _HEADER.pack(EMBEDDING_MAGIC, EMBEDDING_FORMAT_VERSION,
+                          _DTYPE_CODES[vector.dtype], vector.shape[0],
+                          float(np.linalg.norm(vector)), model)
+    return header + vector.tobytes()
+
+
+def unpack_embedding(data, model=None, dim=EMBEDDING_DIM):
+    """
+    Parse a stored embedding into (EmbeddingHeader, vector).
+
+    The vector is a read-only view on data, not a copy. With model given,
+    embeddings produced by any other model raise EmbeddingFormatError.
+    """
+    if bytes(data[:4]) != EMBEDDING_MAGIC:
+        if len(data) != dim * 8:
+            raise EmbeddingFormatError(f"Unrecognised embedding of {len(data)} bytes")
+        # Pre-header rows: raw float64 from the dlib encoder
+        vector = np.frombuffer(data, dtype=np.float64).astype(np.float32)
+        header = EmbeddingHeader(0, DEFAULT_EMBEDDING_MODEL, dim, vector.dtype,
+                                 float(np.linalg.norm(vector)))
+    else:
+        if len(data) < _HEADER.size:
+            raise EmbeddingFormatError("Truncated embedding header")
+        _, version, dtype_code, length, norm, stored_model = _HEADER.unpack_from(data)
+        if version != EMBEDDING_FORMAT_VERSION or dtype_code not in _DTYPES:
+            raise EmbeddingFormatError(
+                f"Unsupported embedding format v{version} dtype {dtype_code}")
+        dtype = _DTYPES[dtype_code]
+        if len(data) != _HEADER.size + length * dtype.itemsize:
+            raise EmbeddingFormatError("Embedding length does not match its header")
+        vector = np.frombuffer(data, dtype=dtype, count=length, offset=_HEADER.size)
+        header = EmbeddingHeader(version, stored_model.rstrip(b'\0').decode('ascii'),
+                                 length, dtype, norm)
+        if not np.isclose(np.linalg.norm(vector), norm, rtol=1e-4, atol=1e-6):
+            raise EmbeddingFormatError("Embedding does not match its stored norm")
+
+    if header.dim != dim:
+        raise EmbeddingFormatError(f"Expected a {dim}-d embedding, got {header.dim}")
+    if model is not None and header.model != model:
+        raise EmbeddingFormatError(
+            f"Embedding was produced by {header.model!r}, expected {model!r}")
+    return header, vector
+
+
+def centroid_embedding(embeddings, model=None):
+    """Pack the mean of several stored embeddings of the same model."""
+    model = model or current_embedding_model()
+    vectors = [unpack_embedding(data, model=model)[1] for data in embeddings]
+    if not vectors:
+        raise ValueError("A centroid needs at least one embedding")
+    return pack_embedding(np.mean(vectors, axis=0), model=model)
+
+
+_SNAPSHOT_MAGIC = b'FSNP'
+_SNAPSHOT_VERSION = 4
+# magic, version, dim, rows, rejected rows, member rows, StudentEmbedding rows,
+# roster signature (student count, max pk, pk sum, latest update,
+# StudentEmbedding count, max pk, pk sum), model
+_SNAPSHOT_HEADER = struct.Struct('<4sBxHQQQQqqqqqqq16s')
+_SNAPSHOT_DATA_OFFSET = 128
+
+Snapshot = collections.namedtuple(
+    'Snapshot',
+    'signature model ids matrix sq_norms rejected_pks members member_rows file_id')
+
+
+def update_stamp(updated_at):
+    """Student.updated_at as integer microseconds since the epoch (0 for None)."""
+    if updated_at is None:
+        return 0
+    return int(updated_at.timestamp()) * 1_000_000 + updated_at.microsecond
+
+
+def _pk_signature(pks):
+    pks = np.asarray(pks, dtype=np.int64)
+    if pks.size == 0:
+        return (0, 0, 0)
+    return (int(pks.size), int(pks.max()), int(pks.sum()))
+
+
+def roster_signature(pks, updated=0, member_pks=()):
+    """
+    (count, max pk, pk sum) of a set of Student primary keys, the latest
+    update_stamp() among them, and (count, max pk, pk sum) of their
+    StudentEmbedding primary keys.
+    """
+    return (*_pk_signature(pks), updated, *_pk_signature(member_pks))
+
+
+def database_roster_signature():
+    """roster_signature() of the Student and StudentEmbedding tables, by the database."""
+    from django.db.models import Count, Max, Sum
+
+    from .models import Student, StudentEmbedding
+
+    row = Student.objects.aggregate(
+        count=Count('id'), top=Max('id'), total=Sum('id'), updated=Max('updated_at'))
+    members = StudentEmbedding.objects.aggregate(
+        count=Count('id'), top=Max('id'), total=Sum('id'))
+    return (row['count'], row['top'] or 0, row['total'] or 0, update_stamp(row['updated']),
+            members['count'], members['top'] or 0, members['total'] or 0)
+
+
+def snapshot_path():
+    """
+    Where this database's embedding snapshot lives, or None when disabled.
+
+    settings.EMBEDDING_SNAPSHOT = {'PATH': ...} overrides the default of a
+    file named after the database next to manage.py; in-memory databases
+    (the test suite) never get one.
+    """
+    from django.db import connection
+
+    config = getattr(settings, 'EMBEDDING_SNAPSHOT', {})
+    if not config.get('ENABLED', True):
+        return None
+    if config.get('PATH'):
+        return str(config['PATH'])
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        return None
+    name = os.path.basename(str(connection.settings_dict['NAME']))
+    return os.path.join(settings.BASE_DIR, f'embeddings-{name}.snapshot')
+
+
+def _file_id(stat):
+    return (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def write_snapshot(path, ids, matrix, sq_norms, rejected_pks, members, model, updated=0,
+                   member_rows=None):
+    """
+    Atomically replace the snapshot at path.
+
+    members is the (owner pks, matrix) pair of enrolled embeddings,
+    member_rows the (owner pks, pks) of every StudentEmbedding row, usable
+    or not, and updated the latest update_stamp() of the students.
+
+    Readers that still map the previous file keep a consistent copy of it;
+    new readers see the new one.
+    """
+    owners, member_matrix = members
+    if member_rows is None:
+        member_rows = (np.empty(0, dtype=np.int64),) * 2
+    row_owners, row_pks = member_rows
+    signature = roster_signature(np.concatenate([ids, rejected_pks]), updated, row_pks)
+    header = _SNAPSHOT_HEADER.pack(
+        _SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, matrix.shape[1], len(ids),
+        len(rejected_pks), len(owners), len(row_pks), *signature, model.encode('ascii'))
+    # A file of its own per write: threads of one process may write at once
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header.ljust(_SNAPSHOT_DATA_OFFSET, b'\0'))
+            for array, dtype in ((ids, '<i8'), (rejected_pks, '<i8'), (owners, '<i8'),
+                                 (row_owners, '<i8'), (row_pks, '<i8'), (matrix, '<f4'),
+                                 (sq_norms, '<f4'), (member_matrix, '<f4')):
+                np.ascontiguousarray(array, dtype=dtype).tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+    return _file_id(os.stat(path))
+
+
+def read_snapshot(path, dim=EMBEDDING_DIM):
+    """
+    Memory-map the snapshot at path; None if it is missing or unreadable.
+
+    The arrays are read-only views on one np.memmap of the file, so every
+    process reading the same snapshot shares its page-cached copy.
+    """
+    try:
+        with open(path, 'rb') as f:
+            # Identify the file by the descriptor that is mapped, in case it is replaced meanwhile
+            file_id = _file_id(os.fstat(f.fileno()))
+            if file_id[3] < _SNAPSHOT_DATA_OFFSET:
+                return None
+            data = np.memmap(f, dtype=np.uint8, mode='r')
+    except FileNotFoundError:
+        return None
+    magic, version = _SNAPSHOT_HEADER.unpack_from(data)[:2]
+    if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+        logger.warning("ignoring embedding snapshot %s in an old or unknown format", path)
+        return None
+    (_, _, stored_dim, rows, rejected, member_rows, all_member_rows, *signature,
+     model) = _SNAPSHOT_HEADER.unpack_from(data)
+    expected = (_SNAPSHOT_DATA_OFFSET + 8 * (rows + rejected + member_rows + 2 * all_member_rows)
+                + 4 * (rows * (dim + 1) + member_rows * dim))
+    if stored_dim != dim or len(data) != expected:
+        logger.warning("ignoring unreadable embedding snapshot %s", path)
+        return None
+
+    offset = _SNAPSHOT_DATA_OFFSET
+
+    def take(dtype, count, shape=None):
+        nonlocal offset
+        size = np.dtype(dtype).itemsize * count
+        array = data[offset:offset + size].view(dtype)
+        offset += size
+        return array.reshape(shape) if shape else array
+
+    ids = take('<i8', rows)
+    rejected_pks = take('<i8', rejected)
+    owners = take('<i8', member_rows)
+    row_owners = take('<i8', all_member_rows)
+    row_pks = take('<i8', all_member_rows)
+    matrix = take('<f4', rows * dim, (rows, dim))
+    sq_norms = take('<f4', rows)
+    member_matrix = take('<f4', member_rows * dim, (member_rows, dim))
+    return Snapshot(tuple(signature), model.rstrip(b'\0').decode('ascii'), ids,
+                    matrix, sq_norms, rejected_pks, (owners, member_matrix),
+                    (row_owners, row_pks), file_id)
+
+
+class EmbeddingIndex:
+    """
+    Process-wide index of every enrolled student's face embeddings.
+
+    Each student is represented by the centroid of their enrolled embeddings
+    (Student.embedding). All centroids live in one contiguous (n, 128) float32
+    matrix with a parallel array of Student primary keys, so a whole photo's
+    worth of faces can be compared against the roster in a single matrix
+    operation. The enrolled embeddings themselves (StudentEmbedding) are kept
+    sorted by student and are only consulted to re-rank the few closest
+    centroids, so extra photos per student raise the match rate without
+    multiplying the cost of the roster-wide search. Only embeddings produced
+    by the configured encoder (settings.FACE_EMBEDDING_MODEL) are indexed,
+    since distances between different models' embeddings are meaningless.
+
+    On first use the index maps the shared snapshot file (see snapshot_path)
+    if it still matches the Student table, and otherwise rebuilds from the
+    database and writes a new snapshot. It is then kept up to date
+    incrementally by the Student signals in core/signals.py, which rewrite the
+    snapshot; other processes notice the new file and map it in turn.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._loaded = False
+        # Students left out of the index because of their embedding
+        self._rejected_pks = np.empty(0, dtype=np.int64)
+        # (owner pks, matrix) of enrolled embeddings, sorted by owner
+        self._members = self._empty_members()
+        # For the snapshot signature: the latest update_stamp() of the students,
+        # and the (owner pks, pks) of all their StudentEmbedding rows
+        self._updated = 0
+        self._member_rows = self._empty_member_rows()
+        # Identity and index version of the snapshot last read or written
+        self._snapshot_id = None
+        self._snapshot_version = None
+        # Bumped on every mutation so matchers can tell when to resync
+        self.version = 0
+        self._set_state(np.empty(0, dtype=np.int64),
+                        np.empty((0, dim), dtype=np.float32))
+
+    def _empty_members(self):
+        return (np.empty(0, dtype=np.int64), np.empty((0, self.dim), dtype=np.float32))
+
+    def _empty_member_rows(self):
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+    def _set_state(self, ids, matrix, sq_norms=None):
+        # Readers grab the tuple once and never see a half-applied update
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        if sq_norms is None:
+            sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+        self._state = (ids, matrix, sq_norms)
+        self.version += 1
+
+    def _to_vector(self, embedding):
+        return unpack_embedding(embedding, model=current_embedding_model(), dim=self.dim)[1]
+
+    def _to_members(self, pk, embeddings):
+        vectors = []
+        for embedding in embeddings:
+            try:
+                vectors.append(self._to_vector(embedding))
+            except EmbeddingFormatError as e:
+                logger.warning("not indexing an enrolled embedding of student pk=%s: %s", pk, e)
+        return np.array(vectors, dtype=np.float32).reshape(-1, self.dim)
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    @property
+    def rejected(self):
+        """Number of students left out because of their stored embedding."""
+        return len(self._rejected_pks)
+
+    @property
+    def member_count(self):
+        return len(self._members[0])
+
+    def load(self):
+        """(Re)build the index from every Student row in the database."""
+        from .models import Student, StudentEmbedding
+
+        rows = list(Student.objects.values_list('id', 'embedding', 'updated_at'))
+        ids = np.empty(len(rows), dtype=np.int64)
+        matrix = np.empty((len(rows), self.dim), dtype=np.float32)
+        count = 0
+        rejected = []
+        updated = max((update_stamp(row[2]) for row in rows), default=0)
+        for pk, embedding, _ in rows:
+            try:
+                matrix[count] = self._to_vector(embedding)
+            except EmbeddingFormatError as e:
+                rejected.append(pk)
+                logger.warning("not indexing student pk=%s: %s", pk, e)
+                continue
+            ids[count] = pk
+            count += 1
+        if rejected:
+            logger.warning("%d of %d student embeddings rejected; re-enroll them with "
+                           "the current encoder", len(rejected), len(rows))
+        ids = ids[:count]
+
+        owners = []
+        members = []
+        member_rows = list(StudentEmbedding.objects.order_by(
+            'student_id', 'id').values_list('student_id', 'id', 'embedding'))
+        for pk, _, embedding in member_rows:
+            try:
+                members.append(self._to_vector(embedding))
+            except EmbeddingFormatError:
+                continue
+            owners.append(pk)
+        owners = np.array(owners, dtype=np.int64)
+        members = np.array(members, dtype=np.float32).reshape(-1, self.dim)
+        # Members of rejected students are never searched
+        keep = np.isin(owners, ids)
+
+        with self._lock:
+            self._set_state(ids, matrix[:count])
+            self._members = (owners[keep], members[keep])
+            self._rejected_pks = np.array(rejected, dtype=np.int64)
+            self._updated = updated
+            self._member_rows = (np.array([row[0] for row in member_rows], dtype=np.int64),
+                                 np.array([row[1] for row in member_rows], dtype=np.int64))
+            self._loaded = True
+        self.save_snapshot()
+
+    def load_snapshot(self):
+        """
+        Map the shared snapshot if it matches the Student table.
+
+        Returns False, leaving the index untouched, when there is no usable
+        snapshot or it is stale.
+        """
+        path = snapshot_path()
+        snapshot = read_snapshot(path, self.dim) if path else None
+        if snapshot is None:
+            return False
+        if (snapshot.model != current_embedding_model()
+                or snapshot.signature != database_roster_signature()):
+            logger.info("embedding snapshot %s is stale", path)
+            return False
+
+        with self._lock:
+            self._set_state(snapshot.ids, snapshot.matrix, snapshot.sq_norms)
+            self._members = snapshot.members
+            self._rejected_pks = snapshot.rejected_pks
+            self._updated = snapshot.signature[3]
+            self._member_rows = snapshot.member_rows
+            self._snapshot_id = snapshot.file_id
+            self._snapshot_version = self.version
+            self._loaded = True
+        return True
+
+    def save_snapshot(self):
+        """Write the current state to the shared snapshot, if one is configured."""
+        path = snapshot_path()
+        # A batch of signals schedules one write each; only the first has work to do
+        if path is None or not self._loaded or self._snapshot_version == self.version:
+            return
+        with self._lock:
+            version = self.version
+            state = self._state
+            members = self._members
+            rejected_pks = self._rejected_pks
+            updated = self._updated
+            member_rows = self._member_rows
+        ids, matrix, sq_norms = state
+        try:
+            file_id = write_snapshot(path, ids, matrix, sq_norms, rejected_pks, members,
+                                     current_embedding_model(), updated, member_rows)
+        except OSError:
+            logger.exception("could not write embedding snapshot %s", path)
+            return
+
+        # Swap in the mapped copy so this process shares the page cache too;
+        # the contents are identical, so matchers need not resync
+        snapshot = read_snapshot(path, self.dim)
+        with self._lock:
+            if (self._state is state and snapshot is not None
+                    and snapshot.file_id == file_id):
+                self._state = (snapshot.ids, snapshot.matrix, snapshot.sq_norms)
+                self._members = snapshot.members
+            self._snapshot_id = file_id
+            self._snapshot_version = version
+
+    def ensure_loaded(self):
+        """Load the index on first use and pick up snapshots written by other processes."""
+        if not self._loaded:
+            if not self.load_snapshot():
+                self.load()
+            return
+
+        path = snapshot_path()
+        if path is None:
+            return
+        try:
+            file_id = _file_id(os.stat(path))
+        except FileNotFoundError:
+            return
+        if file_id != self._snapshot_id:
+            # Another process changed the roster; a stale file means yet another
+            # change it did not see, so rebuild from the database instead
+            if not self.load_snapshot():
+                self.load()
+
+    def add(self, pk, embedding, members=None, updated_at=None, member_pks=None):
+        """
+        Insert or replace the centroid stored for a student.
+
+        members, if given, replaces the student's enrolled embeddings; a
+        student enrolled from a single photo needs none, its centroid is that
+        photo's embedding. updated_at is the row's Student.updated_at and
+        member_pks the StudentEmbedding pks of members, which the snapshot
+        signature needs. Raises EmbeddingFormatError, and drops the student
+        from the index, when the centroid is unusable.
+        """
+        with self._lock:
+            self._updated = max(self._updated, update_stamp(updated_at))
+            if member_pks is not None:
+                self._set_member_rows(pk, member_pks)
+        try:
+            vector = self._to_vector(embedding)
+        except EmbeddingFormatError:
+            with self._lock:
+                self._remove(pk)
+                self._rejected_pks = np.union1d(self._rejected_pks, [pk])
+            raise
+        member_vectors = self._to_members(pk, members) if members is not None else None
+        with self._lock:
+            self._rejected_pks = self._rejected_pks[self._rejected_pks != pk]
+            if member_vectors is not None:
+                self._set_members(pk, member_vectors)
+            ids, matrix, _ = self._state
+            position = np.flatnonzero(ids == pk)
+            if position.size:
+                matrix = matrix.copy()
+                matrix[position[0]] = vector
+            else:
+                ids = np.append(ids, np.int64(pk))
+                matrix = np.vstack([matrix, vector])
+            self._set_state(ids, matrix)
+
+    def _set_members(self, pk, vectors):
+        owners, members = self._members
+        keep = owners != pk
+        owners = np.concatenate([owners[keep], np.full(len(vectors), pk, dtype=np.int64)])
+        members = np.concatenate([members[keep], vectors])
+        order = np.argsort(owners, kind='stable')
+        self._members = (owners[order], members[order])
+
+    def _set_member_rows(self, pk, pks):
+        owners, row_pks = self._member_rows
+        keep = owners != pk
+        self._member_rows = (
+            np.concatenate([owners[keep], np.full(len(pks), pk, dtype=np.int64)]),
+            np.concatenate([row_pks[keep], np.asarray(pks, dtype=np.int64)]))
+
+    def _remove(self, pk):
+        ids, matrix, _ = self._state
+        keep = ids != pk
+        if not keep.all():
+            self._set_state(ids[keep], matrix[keep])
+        if (self._members[0] == pk).any():
+            self._set_members(pk, np.empty((0, self.dim), dtype=np.float32))
+        # Deleting a student deletes its StudentEmbedding rows too
+        if (self._member_rows[0] == pk).any():
+            self._set_member_rows(pk, [])
+
+    def remove(self, pk):
+        with self._lock:
+            self._rejected_pks = self._rejected_pks[self._rejected_pks != pk]
+            self._remove(pk)
+
+    def clear(self):
+        with self._lock:
+            self._set_state(np.empty(0, dtype=np.int64),
+                            np.empty((0, self.dim), dtype=np.float32))
+            self._members = self._empty_members()
+            self._rejected_pks = np.empty(0, dtype=np.int64)
+            self._updated = 0
+            self._member_rows = self._empty_member_rows()
+            self._snapshot_id = None
+            self._snapshot_version = None
+            self._loaded = False
+
+    def __len__(self):
+        return self._state[0].shape[0]
+
+    @property
+    def state(self):
+        """Consistent (ids, matrix, squared_norms) view of the index."""
+        return self._state
+
+    def subset(self, pks):
+        """
+        A standalone index over some of the students, e.g. one class section.
+
+        Copies their rows of the centroid matrix and their enrolled
+        embeddings, so searching it costs time in proportion to len(pks).
+        The copy is not kept up to date; rebuild it when version changes.
+        """
+        with self._lock:
+            ids, matrix, sq_norms = self._state
+            owners, members = self._members
+        keep = np.isin(ids, pks)
+        member_keep = np.isin(owners, pks)
+        index = EmbeddingIndex(dim=self.dim)
+        index._set_state(ids[keep], matrix[keep], sq_norms[keep])
+        index._members = (owners[member_keep], members[member_keep])
+        index._loaded = True
+        return index
+
+    def distances(self, encodings):
+        """
+        Euclidean distance from every face encoding to every student.
+
+        Returns (ids, distances) where distances has shape
+        (len(encodings), len(ids)). Uses |a - b|^2 = |a|^2 + |b|^2 - 2ab so the
+        whole comparison is one matrix product instead of one
+        face_recognition.face_distance call per face.
+        """
+        ids, matrix, sq_norms = self._state
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        if len(ids) == 0 or len(queries) == 0:
+            return ids, np.empty((len(queries), len(ids)))
+
+        squared = (np.einsum('ij,ij->i', queries, queries)[:, None]
+                   + sq_norms[None, :]
+                   - 2.0 * queries @ matrix.T)
+        np.maximum(squared, 0.0, out=squared)
+        return ids, np.sqrt(squared, out=squared)
+
+    def rerank(self, query, pks, distances):
+        """
+        Refine the centroid distances of a few candidate students.
+
+        Each candidate's distance becomes the smallest of its centroid
+        distance and the distances to its enrolled embeddings, so a face
+        close to any one enrolled photo is recognized even when the
+        student's centroid is further away. Returns (pk, distance) of the
+        closest candidate.
+        """
+        owners, members = self._members
+        refined = np.asarray(distances, dtype=np.float64).copy()
+        if len(owners):
+            starts = np.searchsorted(owners, pks, side='left')
+            ends = np.searchsorted(owners, pks, side='right')
+            for i, (start, end) in enumerate(zip(starts, ends)):
+                if end > start:
+                    member_distances = np.linalg.norm(members[start:end] - query, axis=1)
+                    refined[i] = min(refined[i], member_distances.min())
+        best = int(np.argmin(refined))
+        return int(pks[best]), float(refined[best])
+
+    def match(self, encodings, threshold, candidates=5):
+        """
+        Best student for each face encoding.
+
+        The candidates students with the closest centroids are re-ranked
+        against their enrolled embeddings (see rerank). Returns a list of
+        (student_pk, distance) tuples in the same order as encodings;
+        student_pk is None when the closest student is not within the
+        threshold (distance is None when the index is empty).
+        """
+        ids, distances = self.distances(encodings)
+        if distances.shape[1] == 0:
+            return [(None, None) for _ in range(distances.shape[0])]
+
+        if not len(self._members[0]) or candidates <= 1:
+            best = np.argmin(distances, axis=1)
+            best_distances = distances[np.arange(len(best)), best]
+            return [
+                (int(ids[i]) if d < threshold else None, float(d))
+                for i, d in zip(best, best_distances)
+            ]
+
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        candidates = min(candidates, len(ids))
+        shortlist = np.argpartition(distances, candidates - 1, axis=1)[:, :candidates]
+        matches = []
+        for query, rows, row_distances in zip(queries, shortlist, distances):
+            pk, distance = self.rerank(query, ids[rows], row_distances[rows])
+            matches.append((pk if distance < threshold else None, distance))
+        return matches
+
+
+# Shared by every request handled by this process
+embedding_index = EmbeddingIndex()
@@ -0,0 +1,319 @@
+"""
+Inference worker pool.
+
+YOLOv8 detection and dlib encoding are CPU-bound and take seconds per photo,
+so they run in a pool of worker processes instead of the Django request
+threads. Each worker loads the models once. Jobs wait in a bounded queue
+and are dispatched round-robin across keys (the attendance session), so a
+burst from one classroom cannot starve the others.
+
+Configured by settings.INFERENCE_POOL:
+
+    INFERENCE_POOL = {
+        'WORKERS': 2,     # 0 runs jobs inline in the request thread
+        'MAX_QUEUE': 32,  # jobs waiting for a worker before submit() refuses
+        'TIMEOUT': 60,    # seconds a request waits for its result
+    }
+"""
+import collections
+import concurrent.futures
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceQueueFull(Exception):
+    """Raised when the pool's wait queue is at capacity."""
+
+
+_in_worker = False
+
+
+def in_worker():
+    """Whether this process is one of an InferencePool's workers."""
+    return _in_worker
+
+
+def _init_worker(runtime_options=None, worker_settings=None):
+    global _in_worker
+    # Before django.setup(): ready() must not start a pool of its own in here
+    _in_worker = True
+
+    # Thread limits first: the BLAS runtime reads them when numpy loads
+    from . import runtime
+    runtime.configure_environment(runtime_options and runtime_options['threads'])
+
+    # Overrides first too, so that app ready() hooks already see them
+    for name, value in (worker_settings or {}).items():
+        setattr(settings, name, value)
+    import django
+    django.setup()
+    runtime.apply(runtime_options)
+
+    # Load the models once per worker instead of once per job
+    from .model_registry import model_registry
+    try:
+        model_registry.warmup()
+    except Exception:
+        # An initializer error would break the pool for good; jobs report it instead
+        logger.exception("model warm-up failed in inference worker")
+
+
+def _run_job(fn, args, kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+class LatencyStats:
+    """Count, mean and percentiles over a sliding window of durations."""
+
+    def __init__(self, window=1000):
+        self._samples = collections.deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self._samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def summary(self):
+        samples = sorted(self._samples)
+
+        def percentile(p):
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 2)
+
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 2) if self.count else None,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'max_ms': round(samples[-1] * 1000, 2) if samples else None,
+        }
+
+
+class _Job:
+    __slots__ = ('fn', 'args', 'kwargs', 'future', 'submitted')
+
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = concurrent.futures.Future()
+        self.submitted = time.perf_counter()
+
+
+class InferencePool:
+    """
+    Round-robin job queue in front of a pool of worker processes.
+
+    runtime holds each worker's thread counts (core.runtime.thread_settings()
+    by default); worker_settings are settings overrides for the workers,
+    which load the settings module afresh (e.g. the benchmark's stub models).
+    """
+
+    def __init__(self, workers=2, max_queue=32, timeout=60, runtime=None,
+                 worker_settings=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.runtime = runtime
+        self.worker_settings = worker_settings
+        self._condition = threading.Condition()
+        # key -> deque of waiting jobs; rotated for round-robin dispatch
+        self._queues = collections.OrderedDict()
+        self._waiting = 0
+        self._in_flight = 0
+        self._executor = None
+        self._dispatcher = None
+        self._closed = False
+        self._stats = collections.defaultdict(LatencyStats)
+        self._stats_lock = threading.Lock()
+
+    def _start(self):
+        if self._executor is None:
+            from .runtime import thread_settings
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.runtime or thread_settings(self.workers), self.worker_settings),
+            )
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(
+                target=self._dispatch_loop, name='inference-dispatcher', daemon=True)
+            self._dispatcher.start()
+
+    def _record(self, stage, seconds):
+        with self._stats_lock:
+            self._stats[stage].add(seconds)
+
+    def _record_result(self, job, result, elapsed):
+        self._record('execute', elapsed)
+        self._record('total', time.perf_counter() - job.submitted)
+        # Jobs may report their own per-stage timings (seconds)
+        if isinstance(result, dict):
+            for stage, seconds in result.get('timings', {}).items():
+                self._record(stage, seconds)
+
+    def submit(self, fn, *args, key=None, **kwargs):
+        """
+        Queue fn(*args, **kwargs) for a worker and return a Future.
+
+        fn must be a module-level function so it can be pickled. Raises
+        InferenceQueueFull when max_queue jobs are already waiting.
+        """
+        job = _Job(fn, args, kwargs)
+        if self.workers <= 0:
+            self._run_inline(job)
+            return job.future
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("InferencePool is closed")
+            if self._waiting >= self.max_queue:
+                raise InferenceQueueFull()
+            self._start()
+            self._queues.setdefault(key, collections.deque()).append(job)
+            self._waiting += 1
+            self._condition.notify()
+        return job.future
+
+    def run(self, fn, *args, key=None, **kwargs):
+        """Submit a job and block until its result is available."""
+        return self.submit(fn, *args, key=key, **kwargs).result(timeout=self.timeout)
+
+    def _run_inline(self, job):
+        self._record('queue_wait', 0.0)
+        try:
+            result, elapsed = _run_job(job.fn, job.args, job.kwargs)
+        except Exception as e:
+            job.future.set_exception(e)
+            return
+        self._record_result(job, result, elapsed)
+        job.future.set_result(result)
+
+    def _next_job(self):
+        key, queue = self._queues.popitem(last=False)
+        job = queue.popleft()
+        if queue:
+            # Back of the line until every other key has had a turn
+            self._queues[key] = queue
+        self._waiting -= 1
+        return job
+
+    def _dispatch_loop(self):
+        while True:
+            with self._condition:
+                while not self._closed and (not self._waiting or self._in_flight >= self.workers):
+                    self._condition.wait()
+                if self._closed:
+                    return
+                job = self._next_job()
+                self._in_flight += 1
+
+            if not job.future.set_running_or_notify_cancel():
+                self._job_done()
+                continue
+
+            self._record('queue_wait', time.perf_counter() - job.submitted)
+            executor = self._executor
+            try:
+                worker_future = executor.submit(
+                    _run_job, job.fn, job.args, job.kwargs)
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    self._reset_executor(executor)
+                job.future.set_exception(e)
+                self._job_done()
+                continue
+            worker_future.add_done_callback(
+                lambda f, job=job, executor=executor: self._on_done(job, executor, f))
+
+    def _on_done(self, job, executor, worker_future):
+        try:
+            result, elapsed = worker_future.result()
+        except BrokenProcessPool as e:
+            self._reset_executor(executor)
+            job.future.set_exception(e)
+        except Exception as e:
+            job.future.set_exception(e)
+        else:
+            self._record_result(job, result, elapsed)
+            job.future.set_result(result)
+        finally:
+            self._job_done()
+
+    def _job_done(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def _reset_executor(self, broken):
+        # A worker died (e.g. OOM-killed); start a fresh pool for later jobs
+        with self._condition:
+            if self._executor is not broken:
+                return  # Already replaced by another failed job
+            self._executor = None
+            self._start()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        """Stop the dispatcher and the worker processes; waiting jobs are cancelled."""
+        with self._condition:
+            self._closed = True
+            executor, self._executor = self._executor, None
+            waiting = [job for queue in self._queues.values() for job in queue]
+            self._queues.clear()
+            self._waiting = 0
+            self._condition.notify_all()
+        for job in waiting:
+            job.future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats.clear()
+
+    def stats(self):
+        with self._condition:
+            snapshot = {
+                'workers': self.workers,
+                'queue_depth': self._waiting,
+                'queue_capacity': self.max_queue,
+                'in_flight': self._in_flight,
+                'waiting_keys': len(self._queues),
+            }
+        with self._stats_lock:
+            snapshot['latency'] = {
+                stage: stats.summary() for stage, stats in self._stats.items()}
+        return snapshot
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_inference_pool():
+    """Return the process-wide pool configured by settings.INFERENCE_POOL."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                config = getattr(settings, 'INFERENCE_POOL', {})
+                _pool = InferencePool(
+                    workers=config.get('WORKERS', 2),
+                    max_queue=config.get('MAX_QUEUE', 32),
+                    timeout=config.get('TIMEOUT', 60),
+                )
+    return _pool
@@ -0,0 +1,163 @@
+"""
+Content-addressed cache of inference results.
+
+Clients resubmit the same frame after a network timeout, and a batch of
+identical stills is common. Jobs run through run_cached() are keyed by a
+hash of their arguments (the uploaded bytes) together with everything that
+shapes their output: the embedding model, FACE_MODELS, FACE_QUALITY and
+IMAGE_PREPROCESSING. A repeated upload is then answered from the cache
+without touching the worker pool, and a retry that arrives while the
+original is still being analysed waits for that result instead of queueing
+the same work twice. Results that left faces unencoded for reasons of the
+moment (INCOMPLETE_REASONS, e.g. a slow worker running out of time) are
+handed to the waiting requests but never stored.
+
+Entries live in a Django cache, so the size bound and eviction policy are
+the backend's: the default local-memory cache keeps MAX_ENTRIES results and
+evicts the least recently used; a FileBasedCache shares results between
+processes and survives restarts.
+
+Configured by settings.INFERENCE_CACHE:
+
+    INFERENCE_CACHE = {
+        'ENABLED': True,
+        'CACHE_ALIAS': 'inference',  # an entry of settings.CACHES
+    }
+"""
+import concurrent.futures
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+from .embeddings import current_embedding_model
+from .inference import get_inference_pool
+
+# Skipped-face reasons that say more about the run than about the upload
+INCOMPLETE_REASONS = frozenset({'budget', 'encoding_failed'})
+
+# cache key -> Future of the job computing it in this process
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def _config():
+    return getattr(settings, 'INFERENCE_CACHE', {})
+
+
+def _update_digest(digest, value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        digest.update(b'b%d:' % len(value))
+        digest.update(value)
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'l%d:' % len(value))
+        for item in value:
+            _update_digest(digest, item)
+    elif isinstance(value, dict):
+        digest.update(b'd%d:' % len(value))
+        for key in sorted(value):
+            _update_digest(digest, key)
+            _update_digest(digest, value[key])
+    else:
+        text = repr(value).encode()
+        digest.update(b's%d:' % len(text))
+        digest.update(text)
+
+
+def pipeline_version():
+    """Everything besides the job's arguments that changes its results."""
+    return json.dumps({
+        'embedding_model': current_embedding_model(),
+        'models': getattr(settings, 'FACE_MODELS', {}),
+        'quality': getattr(settings, 'FACE_QUALITY', {}),
+        'preprocessing': getattr(settings, 'IMAGE_PREPROCESSING', {}),
+    }, sort_keys=True, default=str)
+
+
+def cache_key(fn, args, kwargs):
+    """Key for fn(*args, **kwargs): a BLAKE2b hash of the arguments and pipeline version."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(pipeline_version().encode())
+    _update_digest(digest, args)
+    _update_digest(digest, kwargs)
+    return f'inference:{fn.__module__}.{fn.__qualname__}:{digest.hexdigest()}'
+
+
+def is_complete(result):
+    """Whether a job result may be cached: no face was skipped for INCOMPLETE_REASONS."""
+    skipped = result.get('skipped', ()) if isinstance(result, dict) else ()
+    return not any(face['reason'] in INCOMPLETE_REASONS for face in skipped)
+
+
+def _served_from_cache(result, started):
+    # The stored per-stage timings describe the original run, not this request
+    result = dict(result)
+    result['timings'] = {'inference_cache': time.perf_counter() - started}
+    return result
+
+
+def peek_cached(fn, *args, **kwargs):
+    """
+    The cached result of fn(*args, **kwargs), or None without running it.
+
+    Lets callers skip steps only real inference needs, such as waiting for
+    admission; a miss is left for run_cached() to count.
+    """
+    config = _config()
+    if not config.get('ENABLED', True):
+        return None
+    started = time.perf_counter()
+    result = caches[config.get('CACHE_ALIAS', 'default')].get(cache_key(fn, args, kwargs))
+    if result is None:
+        return None
+    metrics.inference_cache_lookups.inc(result='hit')
+    return _served_from_cache(result, started)
+
+
+def run_cached(fn, *args, key=None, **kwargs):
+    """
+    get_inference_pool().run(), answered from the cache when possible.
+
+    Raises whatever the pool raises (InferenceQueueFull, TimeoutError),
+    also to requests that were waiting on the same job.
+    """
+    config = _config()
+    pool = get_inference_pool()
+    if not config.get('ENABLED', True):
+        return pool.run(fn, *args, key=key, **kwargs)
+
+    started = time.perf_counter()
+    cache = caches[config.get('CACHE_ALIAS', 'default')]
+    entry_key = cache_key(fn, args, kwargs)
+    result = cache.get(entry_key)
+    if result is not None:
+        metrics.inference_cache_lookups.inc(result='hit')
+        return _served_from_cache(result, started)
+
+    with _in_flight_lock:
+        future = _in_flight.get(entry_key)
+        owner = future is None
+        if owner:
+            future = _in_flight[entry_key] = concurrent.futures.Future()
+    if not owner:
+        metrics.inference_cache_lookups.inc(result='in_flight')
+        return _served_from_cache(future.result(timeout=pool.timeout), started)
+
+    metrics.inference_cache_lookups.inc(result='miss')
+    try:
+        result = pool.run(fn, *args, key=key, **kwargs)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        if is_complete(result):
+            cache.set(entry_key, result)
+        future.set_result(result)
+        return result
+    finally:
+        with _in_flight_lock:
+            del _in_flight[entry_key]
@@ -0,0 +1,108 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from core.inference import get_inference_pool
+from core.models import Student, StudentEmbedding
+from core.photos import PHOTO_DIRECTORY, is_derived, store_photo, store_thumbnail
+from core.preprocessing import ImageRejected
+from core.recognition import locate_faces
+
+
+class Command(BaseCommand):
+    help = ("Re-encode the photos of students enrolled before photos were stored "
+            "size-capped, and give them face thumbnails. Faces are located with "
+            "the detector on the inference pool.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=16,
+            help="Photos per detection job (default: 16)")
+        parser.add_argument(
+            '--delete-originals', action='store_true',
+            help="Delete the replaced files from storage once nothing refers to them")
+
+    def handle(self, *args, **options):
+        students = Student.objects.exclude(photo='').exclude(photo__isnull=True).filter(
+            ~Q(photo__startswith=f'{PHOTO_DIRECTORY}/') | Q(thumbnail='')
+            | Q(thumbnail__isnull=True))
+        pks = list(students.order_by('pk').values_list('pk', flat=True))
+        self.stderr.write(f"{len(pks)} students to convert")
+
+        converted = failed = 0
+        batch_size = max(1, options['batch_size'])
+        for start in range(0, len(pks), batch_size):
+            batch = Student.objects.filter(pk__in=pks[start:start + batch_size]).order_by('pk')
+            done, errors = self.convert(list(batch), options['delete_originals'])
+            converted += done
+            failed += errors
+            self.stderr.write(f"{min(start + batch_size, len(pks))}/{len(pks)} students")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Converted {converted} students, {failed} failed"))
+
+    def read(self, name):
+        try:
+            with Student.photo.field.storage.open(name, 'rb') as f:
+                return f.read()
+        except OSError as e:
+            self.stderr.write(f"Cannot read {name}: {e}")
+            return None
+
+    def convert(self, students, delete_originals):
+        readable = []
+        for student in students:
+            img_data = self.read(student.photo.name)
+            if img_data is not None:
+                readable.append((student, img_data))
+        if not readable:
+            return 0, len(students)
+        boxes = get_inference_pool().run(
+            locate_faces, [img_data for _, img_data in readable], key='photo-backfill')
+
+        renamed = {}
+        converted = []
+        for (student, img_data), box in zip(readable, boxes):
+            try:
+                if is_derived(student.photo.name):
+                    # Only the thumbnail is missing; never re-encode a stored photo twice
+                    photo_name = student.photo.name
+                    thumbnail_name = store_thumbnail(img_data, box)
+                else:
+                    photo_name, thumbnail_name = store_photo(img_data, box)
+            except ImageRejected as e:
+                self.stderr.write(f"Skipping {student.student_id}: {e}")
+                continue
+            renamed[student.photo.name] = photo_name
+            student.photo = photo_name
+            student.thumbnail = thumbnail_name
+            converted.append(student)
+
+        # The students' other enrolled photos need no thumbnail
+        embeddings = list(StudentEmbedding.objects.filter(student__in=converted)
+                          .exclude(photo='').exclude(photo__isnull=True))
+        for embedding in embeddings:
+            name = embedding.photo.name
+            if name not in renamed and not is_derived(name):
+                img_data = self.read(name)
+                try:
+                    renamed[name] = store_photo(img_data, thumbnail=False)[0] if img_data else name
+                except ImageRejected:
+                    renamed[name] = name
+            embedding.photo = renamed.get(name, name)
+
+        with transaction.atomic():
+            Student.objects.bulk_update(converted, ['photo', 'thumbnail'])
+            StudentEmbedding.objects.bulk_update(embeddings, ['photo'])
+
+        if delete_originals:
+            self.delete_unreferenced(old for old, new in renamed.items() if old != new)
+        return len(converted), len(students) - len(converted)
+
+    def delete_unreferenced(self, names):
+        storage = Student.photo.field.storage
+        for name in names:
+            if (Student.objects.filter(photo=name).exists()
+                    or StudentEmbedding.objects.filter(photo=name).exists()):
+                continue
+            storage.delete(name)
@@ -0,0 +1,59 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.benchmark import run_benchmark
+
+
+class Command(BaseCommand):
+    help = ("Benchmark registration and recognition against synthetic rosters "
+            "on a throwaway test database, and write the results as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rosters', default='1000,10000,100000',
+            help="Comma-separated roster sizes (default: 1000,10000,100000)")
+        parser.add_argument(
+            '--iterations', type=int, default=20,
+            help="Requests per endpoint and roster size (default: 20)")
+        parser.add_argument(
+            '--faces-per-image', type=int, default=1,
+            help="Faces the stub detector reports per image (default: 1)")
+        parser.add_argument(
+            '--real-models', action='store_true',
+            help="Use YOLOv8 and dlib instead of the offline stubs")
+        parser.add_argument(
+            '--output', default='-',
+            help="JSON output path, or - for stdout (default: -)")
+
+    def handle(self, *args, **options):
+        try:
+            rosters = [int(size) for size in options['rosters'].split(',') if size]
+        except ValueError:
+            raise CommandError(f"Invalid --rosters value: {options['rosters']}")
+        if options['iterations'] < 1 or options['faces_per_image'] < 1:
+            raise CommandError("--iterations and --faces-per-image must be positive")
+
+        # Synthetic rosters replace the Student table, so never touch the real database
+        test_db = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = run_benchmark(
+                roster_sizes=rosters,
+                iterations=options['iterations'],
+                stub=not options['real_models'],
+                faces_per_image=options['faces_per_image'],
+                log=self.stderr.write,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            connection.creation.destroy_test_db(test_db, verbosity=0)
+
+        output = json.dumps(results, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']}"))
@@ -0,0 +1,58 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import default_layouts, run_layout_benchmark
+
+
+class Command(BaseCommand):
+    help = ("Compare inference pool layouts (worker processes x threads per worker) "
+            "on this machine and write the results as JSON. Set the winner with "
+            "INFERENCE_WORKERS and INFERENCE_THREADS.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--layouts',
+            help="Comma-separated WORKERSxTHREADS layouts, e.g. 1x8,2x4,8x1 "
+                 "(default: even splits of the cores, plus one thread per core per worker)")
+        parser.add_argument(
+            '--requests', type=int, default=40,
+            help="Recognition jobs per layout (default: 40)")
+        parser.add_argument(
+            '--faces-per-image', type=int, default=1,
+            help="Faces the stub detector reports per image (default: 1)")
+        parser.add_argument(
+            '--real-models', action='store_true',
+            help="Use the configured YOLOv8/dlib models instead of the stubs")
+        parser.add_argument(
+            '--output', default='-',
+            help="JSON output path, or - for stdout (default: -)")
+
+    def handle(self, *args, **options):
+        layouts = default_layouts()
+        if options['layouts']:
+            try:
+                layouts = [tuple(int(n) for n in layout.lower().split('x'))
+                           for layout in options['layouts'].split(',') if layout]
+            except ValueError:
+                raise CommandError(f"Invalid --layouts value: {options['layouts']}")
+            if any(len(layout) != 2 or min(layout) < 1 for layout in layouts):
+                raise CommandError("--layouts must be positive WORKERSxTHREADS pairs")
+        if options['requests'] < 1:
+            raise CommandError("--requests must be positive")
+
+        results = run_layout_benchmark(
+            layouts=layouts,
+            requests=options['requests'],
+            stub=not options['real_models'],
+            faces_per_image=options['faces_per_image'],
+            log=self.stderr.write,
+        )
+
+        output = json.dumps(results, indent=2, default=str)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']}"))
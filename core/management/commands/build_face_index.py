@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.embeddings import embedding_index
+from core.matchers import IVFMatcher, get_matcher
+
+
+class Command(BaseCommand):
+    help = "Rebuild the approximate nearest-neighbour face index from the Student table."
+
+    def handle(self, *args, **options):
+        matcher = get_matcher()
+        if not isinstance(matcher, IVFMatcher):
+            raise CommandError(
+                f"FACE_MATCHER backend {type(matcher).__name__} has no index to build")
+
+        started = time.perf_counter()
+        embedding_index.load()
+        try:
+            n_lists = matcher.rebuild()
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(embedding_index)} students into {n_lists} lists "
+            f"at {matcher.path} in {time.perf_counter() - started:.1f}s"))
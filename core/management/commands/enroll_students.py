@@ -0,0 +1,54 @@
+import json
+import os
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from core.bulk_enrollment import EnrollmentImportError, create_job, job_progress, run_job
+from core.models import EnrollmentItem, EnrollmentJob
+
+
+class Command(BaseCommand):
+    help = ("Enroll students in bulk from a zip of manifest.csv and photos, or from a "
+            "CSV manifest whose photo paths are relative to it. Runs in this process "
+            "on the configured inference pool; --resume continues a job that stopped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'manifest', nargs='?',
+            help="Zip archive or CSV manifest (columns student_id, name, photo)")
+        parser.add_argument(
+            '--resume', type=int, metavar='JOB_ID',
+            help="Continue an earlier job with its items still pending")
+        parser.add_argument(
+            '--batch-size', type=int,
+            help="Photos per inference job (default: BULK_ENROLLMENT['BATCH_SIZE'])")
+
+    def handle(self, *args, **options):
+        if bool(options['manifest']) == bool(options['resume']):
+            raise CommandError("Give either a manifest or --resume JOB_ID")
+
+        if options['resume']:
+            try:
+                job = EnrollmentJob.objects.get(pk=options['resume'])
+            except EnrollmentJob.DoesNotExist:
+                raise CommandError(f"No enrollment job {options['resume']}")
+            if not job.items.filter(status=EnrollmentItem.PENDING).exists():
+                raise CommandError(f"Job {job.pk} has nothing left to enroll")
+        else:
+            path = options['manifest']
+            try:
+                with open(path, 'rb') as f:
+                    job = create_job(File(f, name=os.path.basename(path)),
+                                     photo_root=os.path.dirname(os.path.abspath(path)))
+            except OSError as e:
+                raise CommandError(f"Cannot read {path}: {e}")
+            except EnrollmentImportError as e:
+                raise CommandError(str(e))
+            self.stderr.write(f"Created job {job.pk} with {job.total} students")
+
+        job = run_job(job, batch_size=options['batch_size'], log=self.stderr.write)
+        self.stdout.write(json.dumps(job_progress(job), indent=2, default=str))
+        if job.status == EnrollmentJob.FAILED:
+            raise CommandError(f"Job {job.pk} stopped: {job.error}. "
+                               f"Continue it with --resume {job.pk}")
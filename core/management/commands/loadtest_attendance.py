@@ -0,0 +1,61 @@
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.benchmark import run_attendance_loadtest
+
+
+class Command(BaseCommand):
+    help = ("Measure attendance write throughput under concurrent classroom sessions "
+            "on a throwaway test database of the configured engine, and write the "
+            "results as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sessions', default='1,4,16',
+            help="Comma-separated numbers of concurrent sessions (default: 1,4,16)")
+        parser.add_argument(
+            '--students', type=int, default=200,
+            help="Students each session marks present (default: 200)")
+        parser.add_argument(
+            '--batch-size', type=int, default=5,
+            help="Students marked per write (default: 5)")
+        parser.add_argument(
+            '--output', default='-',
+            help="JSON output path, or - for stdout (default: -)")
+
+    def handle(self, *args, **options):
+        try:
+            concurrency = [int(n) for n in options['sessions'].split(',') if n]
+        except ValueError:
+            raise CommandError(f"Invalid --sessions value: {options['sessions']}")
+        if (not concurrency or min(concurrency) < 1 or options['students'] < 1
+                or options['batch_size'] < 1):
+            raise CommandError("--sessions, --students and --batch-size must be positive")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            if connection.vendor == 'sqlite':
+                # The default in-memory test database serializes threads on a
+                # shared-cache lock; a file measures what deployments see
+                connection.settings_dict['TEST']['NAME'] = os.path.join(tmp, 'loadtest.sqlite3')
+            test_db = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                results = run_attendance_loadtest(
+                    concurrency=concurrency,
+                    students=options['students'],
+                    batch_size=options['batch_size'],
+                    log=self.stderr.write,
+                )
+            finally:
+                connection.creation.destroy_test_db(test_db, verbosity=0)
+
+        output = json.dumps(results, indent=2, default=str)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']}"))
@@ -0,0 +1,265 @@
+"""
+Pluggable face matchers.
+
+The backend is chosen with the FACE_MATCHER setting, following the same
+BACKEND/OPTIONS layout Django uses for caches and databases:
+
+    FACE_MATCHER = {
+        'BACKEND': 'core.matchers.IVFMatcher',
+        'OPTIONS': {'n_probe': 8},
+    }
+
+Every backend returns exact Euclidean distances for the candidates it
+considers, so the recognition threshold means the same thing regardless of
+which backend is in use. Backends search student centroids and then
+re-rank the rerank_candidates closest students against their enrolled
+embeddings (EmbeddingIndex.rerank).
+"""
+import logging
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .embeddings import _file_id, embedding_index
+
+logger = logging.getLogger(__name__)
+
+
+class BaseMatcher:
+    def __init__(self, index=None, rerank_candidates=5, **options):
+        self.index = index if index is not None else embedding_index
+        self.rerank_candidates = rerank_candidates
+
+    def match(self, encodings, threshold):
+        """Return a (student_pk or None, distance) tuple per face encoding."""
+        raise NotImplementedError
+
+    def rebuild(self):
+        """Recompute any derived search structure from the embedding index."""
+
+
+class BruteForceMatcher(BaseMatcher):
+    """Exact search: every face is compared against every student."""
+
+    def match(self, encodings, threshold):
+        return self.index.match(encodings, threshold, candidates=self.rerank_candidates)
+
+
+def _squared_distances(queries, vectors):
+    squared = (np.einsum('ij,ij->i', queries, queries)[:, None]
+               + np.einsum('ij,ij->i', vectors, vectors)[None, :]
+               - 2.0 * queries @ vectors.T)
+    return np.maximum(squared, 0.0, out=squared)
+
+
+def kmeans(vectors, n_clusters, iterations=10, seed=0):
+    """Plain Lloyd's k-means; returns the (n_clusters, dim) centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmin(_squared_distances(vectors, centroids), axis=1)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters so no list ends up permanently unused
+        empty = np.flatnonzero(~filled)
+        if empty.size:
+            centroids[empty] = vectors[rng.choice(len(vectors), empty.size, replace=False)]
+    return centroids
+
+
+class IVFMatcher(BaseMatcher):
+    """
+    Approximate search over an inverted-file (k-means partitioned) index.
+
+    Students are bucketed by their nearest of n_lists centroids; a face is
+    only compared against the students in its n_probe nearest buckets.
+    Raising n_probe trades latency for recall. Students registered after the
+    last build are assigned to their nearest existing centroid on the fly,
+    so the partition only needs rebuilding when the roster drifts a lot.
+    A partition rebuilt by another process is picked up when the saved file
+    changes.
+
+    Options:
+        path:         where the trained centroids and list assignment are saved
+        n_lists:      number of partitions (default: sqrt of roster size)
+        n_probe:      partitions searched per face
+        min_size:     rosters smaller than this are searched exactly
+        iterations:   k-means iterations used by rebuild()
+        train_sample: maximum number of embeddings k-means is trained on
+    """
+
+    def __init__(self, index=None, path=None, n_lists=None, n_probe=8,
+                 min_size=5000, iterations=10, train_sample=50000, **options):
+        super().__init__(index, **options)
+        self.path = str(path or os.path.join(settings.BASE_DIR, 'face_index.npz'))
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_size = min_size
+        self.iterations = iterations
+        self.train_sample = train_sample
+        self._lock = threading.Lock()
+        self._centroids = None
+        self._list_pks = None
+        self._list_offsets = None
+        self._synced = None
+        # Identity of the saved file last installed, or False once found missing
+        self._file_id = None
+
+    def rebuild(self):
+        """Train the partition on the current roster and save it to self.path."""
+        self.index.ensure_loaded()
+        ids, matrix, _ = self.index.state
+        if len(ids) == 0:
+            raise ValueError("Cannot build a face index for an empty roster")
+
+        n_lists = self.n_lists or max(1, int(np.sqrt(len(ids))))
+        n_lists = min(n_lists, len(ids))
+        rng = np.random.default_rng(0)
+        sample = matrix
+        if len(matrix) > self.train_sample:
+            sample = matrix[rng.choice(len(matrix), self.train_sample, replace=False)]
+        centroids = kmeans(sample, n_lists, iterations=self.iterations)
+
+        assignment = np.argmin(_squared_distances(matrix, centroids), axis=1)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(tmp_path, centroids=centroids, list_pks=ids[order],
+                 list_offsets=offsets)
+        os.replace(tmp_path, self.path)
+        self._install(centroids, ids[order], offsets, _file_id(os.stat(self.path)))
+        return n_lists
+
+    def _install(self, centroids, list_pks, list_offsets, file_id):
+        with self._lock:
+            self._file_id = file_id
+            self._centroids = centroids
+            self._list_pks = list_pks
+            self._list_offsets = list_offsets
+            self._synced = None
+
+    def _load(self):
+        """(Re)load the saved partition if the file changed since it was installed."""
+        try:
+            file_id = _file_id(os.stat(self.path))
+        except FileNotFoundError:
+            file_id = False
+        if file_id == self._file_id:
+            return
+        if file_id is False:
+            # Keep serving a partition that was installed before the file went away
+            if self._centroids is None:
+                logger.warning("No face index at %s; falling back to exact "
+                               "matching. Run `manage.py build_face_index`.", self.path)
+            self._file_id = False
+            return
+        try:
+            with np.load(self.path) as data:
+                self._install(data['centroids'], data['list_pks'],
+                              data['list_offsets'], file_id)
+        except FileNotFoundError:
+            # Replaced between the stat and the read; the next match retries
+            pass
+        else:
+            logger.info("loaded face index %s", self.path)
+
+    def _sync(self):
+        """
+        Map the saved list assignment onto the current embedding index rows.
+
+        Runs once per index version: deleted students are dropped and newly
+        registered ones are assigned to their nearest centroid.
+        """
+        version = self.index.version
+        synced = self._synced
+        if synced is not None and synced[0] == version:
+            return synced
+
+        state = self.index.state
+        ids, matrix, _ = state
+        with self._lock:
+            centroids, list_pks, offsets = (
+                self._centroids, self._list_pks, self._list_offsets)
+        n_lists = len(centroids)
+
+        if len(ids):
+            order = np.argsort(ids)
+            positions = np.searchsorted(ids, list_pks, sorter=order)
+            rows = order[np.minimum(positions, len(ids) - 1)]
+            found = ids[rows] == list_pks
+        else:
+            rows = np.zeros(len(list_pks), dtype=np.int64)
+            found = np.zeros(len(list_pks), dtype=bool)
+        list_of_row = np.repeat(np.arange(n_lists), np.diff(offsets))
+
+        assigned = np.zeros(len(ids), dtype=bool)
+        assigned[rows[found]] = True
+        pending = np.flatnonzero(~assigned)
+
+        all_rows = np.concatenate([rows[found], pending])
+        all_lists = np.concatenate([
+            list_of_row[found],
+            np.argmin(_squared_distances(matrix[pending], centroids), axis=1)
+            if pending.size else np.empty(0, dtype=np.int64),
+        ])
+        sort = np.argsort(all_lists, kind='stable')
+        new_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(all_lists, minlength=n_lists))])
+
+        synced = (version, centroids, state, all_rows[sort], new_offsets)
+        self._synced = synced
+        return synced
+
+    def match(self, encodings, threshold):
+        self.index.ensure_loaded()
+        if len(self.index) < self.min_size:
+            return self.index.match(encodings, threshold, candidates=self.rerank_candidates)
+        self._load()
+        if self._centroids is None:
+            return self.index.match(encodings, threshold, candidates=self.rerank_candidates)
+
+        _, centroids, (ids, matrix, _), list_rows, offsets = self._sync()
+        queries = np.asarray(encodings, dtype=matrix.dtype).reshape(-1, self.index.dim)
+        n_probe = min(self.n_probe, len(centroids))
+        nearest_lists = np.argpartition(
+            _squared_distances(queries, centroids), n_probe - 1, axis=1)[:, :n_probe]
+
+        matches = []
+        for query, lists in zip(queries, nearest_lists):
+            candidates = np.concatenate(
+                [list_rows[offsets[i]:offsets[i + 1]] for i in lists])
+            if candidates.size == 0:
+                matches.append((None, None))
+                continue
+            distances = np.sqrt(_squared_distances(query[None, :], matrix[candidates])[0])
+            shortlist = min(max(self.rerank_candidates, 1), len(candidates))
+            closest = np.argpartition(distances, shortlist - 1)[:shortlist]
+            pk, distance = self.index.rerank(
+                query, ids[candidates[closest]], distances[closest])
+            matches.append((pk if distance < threshold else None, distance))
+        return matches
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def get_matcher():
+    """Return the process-wide matcher configured by settings.FACE_MATCHER."""
+    global _matcher
+    if _matcher is None:
+        with _matcher_lock:
+            if _matcher is None:
+                config = getattr(settings, 'FACE_MATCHER', {})
+                backend = import_string(
+                    config.get('BACKEND', 'core.matchers.BruteForceMatcher'))
+                _matcher = backend(**config.get('OPTIONS', {}))
+    return _matcher
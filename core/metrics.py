@@ -0,0 +1,253 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition.
+
+Each metric is a small lock-protected counter, gauge or histogram keyed by
+label values; render() produces the text format served at /metrics. Metrics
+are per process, so with several server workers each one reports its own.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) tuples."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.type_name}']
+        for suffix, values, extra, value in self.samples():
+            labels = _format_labels(self.labelnames, values, extra)
+            lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, value in items:
+            yield '_total', values, (), value
+
+
+class Gauge(Metric):
+    """A gauge that is either set directly or read from a callback at scrape time."""
+
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.callback is not None:
+            yield '', (), (), self.callback()
+            return
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, value in items:
+            yield '', values, (), value
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total))
+                           for key, (counts, total) in self._values.items())
+        for values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield '_bucket', values, (('le', _format_value(bound)),), cumulative
+            yield '_sum', values, (), total
+            yield '_count', values, (), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+registry = Registry()
+
+stage_duration = registry.register(Histogram(
+    'rtms_stage_duration_seconds',
+    'Time spent in each recognition/registration pipeline stage.',
+    ['stage']))
+requests_total = registry.register(Counter(
+    'rtms_requests',
+    'API requests handled, by endpoint and HTTP status.',
+    ['endpoint', 'status']))
+faces_detected = registry.register(Counter(
+    'rtms_faces_detected',
+    'Faces found by the detector.'))
+faces_matched = registry.register(Counter(
+    'rtms_faces_matched',
+    'Faces matched to an enrolled student.'))
+faces_unknown = registry.register(Counter(
+    'rtms_faces_unknown',
+    'Encoded faces that matched no enrolled student.'))
+
+faces_skipped = registry.register(Counter(
+    'rtms_faces_skipped',
+    'Detected faces not encoded, by reason (see core/quality.py).',
+    ['reason']))
+
+inference_cache_lookups = registry.register(Counter(
+    'rtms_inference_cache_lookups',
+    'Inference cache lookups, by result (hit, in_flight or miss).',
+    ['result']))
+
+admission_decisions = registry.register(Counter(
+    'rtms_admission_decisions',
+    'Recognition requests by admission outcome (admitted, queued, queue_full, '
+    'overloaded, timeout or displaced).',
+    ['result']))
+
+
+def _roster_size():
+    from .embeddings import embedding_index
+    return len(embedding_index)
+
+
+def _inference_queue_depth():
+    from .inference import get_inference_pool
+    return get_inference_pool().stats()['queue_depth']
+
+
+def _admission_waiting():
+    from .admission import get_admission_controller
+    controller = get_admission_controller()
+    return controller.stats()['waiting'] if controller else 0
+
+
+roster_size = registry.register(Gauge(
+    'rtms_roster_size',
+    'Student embeddings held by this process\'s embedding index.',
+    callback=_roster_size))
+inference_queue_depth = registry.register(Gauge(
+    'rtms_inference_queue_depth',
+    'Inference jobs waiting for a worker.',
+    callback=_inference_queue_depth))
+admission_waiting = registry.register(Gauge(
+    'rtms_admission_waiting',
+    'Recognition requests waiting for an inference slot.',
+    callback=_admission_waiting))
+
+
+def observe_stages(timings):
+    """Record a {stage: seconds} mapping into the stage histogram."""
+    for stage, seconds in timings.items():
+        stage_duration.observe(seconds, stage=stage)
+
+
+def observe_skipped_faces(skipped):
+    """Count the faces the quality gate or encoding budget passed over."""
+    for face in skipped:
+        faces_skipped.inc(reason=face['reason'])
+
+
+class StageTimer:
+    """
+    Collects per-stage durations for one request.
+
+    Used as `with timer.stage('match'): ...`; the collected timings feed the
+    stage histogram and the optional `timings` block of API responses.
+    """
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - started
+
+    def update(self, timings):
+        for name, seconds in timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def as_milliseconds(self):
+        return {name: round(seconds * 1000, 2) for name, seconds in self.timings.items()}
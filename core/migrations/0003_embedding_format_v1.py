@@ -0,0 +1,52 @@
+"""
+Convert Student.embedding from raw float64 bytes to the versioned float32
+format described in core/embeddings.py.
+
+The format is spelled out here rather than imported so the migration keeps
+working if core.embeddings changes.
+"""
+import struct
+
+import numpy as np
+from django.db import migrations
+
+MAGIC = b'FEMB'
+HEADER = struct.Struct('<4sBBHf16s4x')
+FLOAT32 = 1
+LEGACY_MODEL = b'dlib-resnet-v1'
+
+
+def to_float32(apps, schema_editor):
+    Student = apps.get_model('core', 'Student')
+    for student in Student.objects.only('pk', 'embedding').iterator():
+        data = bytes(student.embedding)
+        if data[:4] == MAGIC or len(data) % 8:
+            continue
+        vector = np.frombuffer(data, dtype='<f8').astype('<f4')
+        student.embedding = HEADER.pack(
+            MAGIC, 1, FLOAT32, len(vector), float(np.linalg.norm(vector)),
+            LEGACY_MODEL) + vector.tobytes()
+        student.save(update_fields=['embedding'])
+
+
+def to_float64(apps, schema_editor):
+    Student = apps.get_model('core', 'Student')
+    for student in Student.objects.only('pk', 'embedding').iterator():
+        data = bytes(student.embedding)
+        if data[:4] != MAGIC:
+            continue
+        dim = HEADER.unpack_from(data)[3]
+        vector = np.frombuffer(data, dtype='<f4', count=dim, offset=HEADER.size)
+        student.embedding = vector.astype('<f8').tobytes()
+        student.save(update_fields=['embedding'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0002_attendancerecord_session_id_and_more"),
+    ]
+
+    operations = [
+        migrations.RunPython(to_float32, to_float64),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def enroll_existing_embeddings(apps, schema_editor):
+    # Each student's single embedding becomes its first enrolled embedding,
+    # and stays in Student.embedding as the (one-member) centroid
+    Student = apps.get_model("core", "Student")
+    StudentEmbedding = apps.get_model("core", "StudentEmbedding")
+    StudentEmbedding.objects.bulk_create(
+        StudentEmbedding(student_id=student.pk, embedding=student.embedding,
+                         photo=student.photo.name or None)
+        for student in Student.objects.only("pk", "embedding", "photo").iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0003_embedding_format_v1"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StudentEmbedding",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("embedding", models.BinaryField()),
+                (
+                    "photo",
+                    models.ImageField(blank=True, null=True, upload_to="students/"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "student",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="embeddings",
+                        to="core.student",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(enroll_existing_embeddings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0004_studentembedding"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="attendancerecord",
+            index=models.Index(
+                fields=["session_id", "timestamp"], name="attendance_session_time"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="attendancerecord",
+            index=models.Index(
+                fields=["student", "timestamp"], name="attendance_student_time"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="attendancerecord",
+            index=models.Index(fields=["timestamp"], name="attendance_time"),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0007_enrollmentjob_enrollmentitem"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="student",
+            name="thumbnail",
+            field=models.ImageField(
+                blank=True, null=True, upload_to="students/thumbs/"
+            ),
+        ),
+    ]
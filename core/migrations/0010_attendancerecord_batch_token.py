@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0009_student_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="attendancerecord",
+            name="batch_token",
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+    ]
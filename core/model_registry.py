@@ -0,0 +1,208 @@
+"""
+Lazily loaded face detection and encoding models.
+
+Importing this module is cheap: torch/ultralytics and dlib are only imported
+when a model is first used, so migrations, the admin and management commands
+never pay for them. Where inference runs (the pool workers, or the request
+thread with WORKERS = 0) the models are loaded once per process, on first use
+or ahead of time with warmup().
+
+Configured by settings.FACE_MODELS, with the BACKEND/OPTIONS layout used by
+FACE_MATCHER:
+
+    FACE_MODELS = {
+        'DETECTOR': {
+            'BACKEND': 'core.model_registry.YOLOFaceDetector',
+            'OPTIONS': {'weights': BASE_DIR / 'yolov8n-face-lindevs.pt'},
+        },
+        'ENCODER': {
+            'BACKEND': 'core.model_registry.DlibFaceEncoder',
+            'OPTIONS': {},
+        },
+        'WARMUP': False,  # load the models when Django starts serving
+    }
+
+A detector has detect(rgb_images) returning one (boxes, confidences) pair per
+image with boxes in (x1, y1, x2, y2) format; an encoder has
+encode(rgb_image, locations, num_jitters) taking dlib (top, right, bottom,
+left) locations and returning one 128-d encoding per location.
+"""
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from . import runtime
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKENDS = {
+    'DETECTOR': 'core.model_registry.YOLOFaceDetector',
+    'ENCODER': 'core.model_registry.DlibFaceEncoder',
+}
+
+
+class YOLOFaceDetector:
+    """
+    YOLOv8 face detector working on batches of RGB images.
+
+    export runs the model through another CPU runtime ('onnx', 'torchscript'
+    or 'openvino'; the package each needs must be installed): the weights
+    are exported once, next to the .pt file, and the export is loaded from
+    then on. half runs in float16, which only pays off on a GPU device.
+    """
+
+    EXPORT_FORMATS = {'onnx': '.onnx', 'torchscript': '.torchscript', 'openvino': '_openvino_model'}
+
+    def __init__(self, weights=None, device=None, half=False, export=None):
+        # or 'yolov8s-face.pt' for better accuracy
+        weights = str(weights or os.path.join(settings.BASE_DIR, 'yolov8n-face-lindevs.pt'))
+        if not os.path.exists(weights):
+            raise ImproperlyConfigured(
+                f"YOLOv8 face weights not found at {weights}; set FACE_DETECTOR_WEIGHTS "
+                f"or FACE_MODELS['DETECTOR']['OPTIONS']['weights']")
+        if export is not None and export not in self.EXPORT_FORMATS:
+            raise ImproperlyConfigured(
+                f"Unknown detector export format {export!r}; "
+                f"choose from {', '.join(self.EXPORT_FORMATS)}")
+        from ultralytics import YOLO
+
+        runtime.configure_torch()
+
+        if export:
+            weights = self._exported(YOLO, weights, export)
+            self.model = YOLO(weights, task='detect')
+        else:
+            self.model = YOLO(weights)
+        self.options = {'verbose': False}
+        if device:
+            self.options['device'] = device
+        if half:
+            self.options['half'] = True
+
+    def _exported(self, YOLO, weights, export):
+        path = os.path.splitext(weights)[0] + self.EXPORT_FORMATS[export]
+        if not os.path.exists(path):
+            logger.info("exporting %s to %s", weights, export)
+            path = YOLO(weights).export(format=export)
+        return str(path)
+
+    def detect(self, rgb_images):
+        import torch
+
+        with torch.inference_mode():
+            results = self.model(list(rgb_images), **self.options)
+        return [(r.boxes.xyxy.cpu().numpy(), r.boxes.conf.cpu().numpy())
+                for r in results]
+
+
+class DlibFaceEncoder:
+    """face_recognition (dlib ResNet) encodings for known face locations."""
+
+    def __init__(self, landmarks='small'):
+        import face_recognition  # Still useful for face embeddings
+
+        self._face_encodings = face_recognition.face_encodings
+        self.landmarks = landmarks
+
+    def encode(self, rgb_image, locations, num_jitters=1):
+        return self._face_encodings(rgb_image, locations, num_jitters=num_jitters,
+                                    model=self.landmarks)
+
+
+class ModelRegistry:
+    """Loads each configured model once per process, on first use."""
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get(self, role):
+        """Return the 'DETECTOR' or 'ENCODER' model, loading it if needed."""
+        model = self._models.get(role)
+        if model is None:
+            with self._lock:
+                model = self._models.get(role)
+                if model is None:
+                    model = self._load(role)
+                    self._models[role] = model
+        return model
+
+    def _load(self, role):
+        # Thread pools are sized before a framework first creates them
+        runtime.apply()
+        config = getattr(settings, 'FACE_MODELS', {}).get(role, {})
+        backend = config.get('BACKEND', DEFAULT_BACKENDS[role])
+        started = time.perf_counter()
+        model = import_string(backend)(**config.get('OPTIONS', {}))
+        logger.info("loaded %s backend=%s seconds=%.2f", role.lower(), backend,
+                    time.perf_counter() - started)
+        return model
+
+    def detector(self):
+        return self.get('DETECTOR')
+
+    def encoder(self):
+        return self.get('ENCODER')
+
+    @property
+    def loaded(self):
+        return sorted(self._models)
+
+    def warmup(self):
+        """
+        Load both models and run them once on a blank image.
+
+        The first inference pays for lazy initialisation inside the
+        frameworks as well as for loading weights; doing it here keeps that
+        off the first real request.
+        """
+        started = time.perf_counter()
+        blank = np.zeros((640, 640, 3), dtype=np.uint8)
+        self.detector().detect([blank])
+        self.encoder().encode(blank, [(200, 440, 440, 200)], num_jitters=1)
+        logger.info("models warm seconds=%.2f", time.perf_counter() - started)
+
+    def reset(self):
+        """Forget loaded models, e.g. after FACE_MODELS has been overridden."""
+        with self._lock:
+            self._models.clear()
+
+
+# Shared by everything running inference in this process
+model_registry = ModelRegistry()
+
+
+def warmup_in_background():
+    """
+    Warm up wherever inference will run, without delaying startup.
+
+    With a worker pool the workers load the models (see
+    core.inference._init_worker); otherwise this process does.
+    """
+    from .inference import get_inference_pool
+
+    def warm():
+        try:
+            pool = get_inference_pool()
+            if pool.workers > 0:
+                # Submitted together so each lands on a newly spawned worker
+                futures = [pool.submit(_noop, key=i) for i in range(pool.workers)]
+                for future in futures:
+                    future.result()
+            else:
+                model_registry.warmup()
+        except Exception:
+            logger.exception("model warm-up failed")
+
+    threading.Thread(target=warm, name='model-warmup', daemon=True).start()
+
+
+def _noop():
+    # Starting the pool is what warms it: each worker runs the initializer
+    return None
@@ -5,12 +5,41 @@ from django.utils import timezone
 class Student(models.Model):
     name = models.CharField(max_length=255)
     student_id = models.CharField(max_length=50, unique=True)
-    embedding = models.BinaryField()  # Stores face embedding as bytes
+    # Centroid of the student's enrolled embeddings (see StudentEmbedding)
+    embedding = models.BinaryField()
+    # Re-encoded main photo and its face thumbnail, named by content hash
+    # (see core/photos.py); `manage.py backfill_student_photos` converts
+    # photos stored as uploaded
     photo = models.ImageField(upload_to='students/', null=True, blank=True)
+    thumbnail = models.ImageField(upload_to='students/thumbs/', null=True, blank=True)
+    # Part of the embedding snapshot's signature (see core/embeddings.py), so
+    # a changed embedding is noticed even if the snapshot was not rewritten
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.name} ({self.student_id})"
 
+    def refresh_centroid(self):
+        """Recompute and save the centroid from the enrolled embeddings."""
+        from .embeddings import centroid_embedding
+
+        self.embedding = centroid_embedding(
+            self.embeddings.values_list('embedding', flat=True))
+        self.save(update_fields=['embedding', 'updated_at'])
+
+
+class StudentEmbedding(models.Model):
+    """One enrolled photo of a student and its face embedding."""
+
+    student = models.ForeignKey(
+        Student, on_delete=models.CASCADE, related_name='embeddings')
+    embedding = models.BinaryField()
+    photo = models.ImageField(upload_to='students/', null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Embedding {self.pk} of {self.student.student_id}"
+
 
 class AttendanceRecord(models.Model):
     student = models.ForeignKey(
@@ -19,10 +48,96 @@ class AttendanceRecord(models.Model):
     recognized_by = models.CharField(
         max_length=255, blank=True)  # Teacher/device info
     session_id = models.CharField(max_length=100, blank=True)
+    # Set by each record_attendance call to tell the rows it inserted apart
+    # from rows concurrent calls inserted first
+    batch_token = models.UUIDField(null=True, blank=True, editable=False)
 
     class Meta:
         # This ensures only one attendance record per student per session
         unique_together = ['student', 'session_id']
+        # Serve the reporting API (session rosters, student history and
+        # date-range summaries) from index range scans
+        indexes = [
+            models.Index(fields=['session_id', 'timestamp'], name='attendance_session_time'),
+            models.Index(fields=['student', 'timestamp'], name='attendance_student_time'),
+            models.Index(fields=['timestamp'], name='attendance_time'),
+        ]
 
     def __str__(self):
         return f"Attendance: {self.student.name} at {self.timestamp}"
+
+
+class Section(models.Model):
+    """A course section: the students expected in its class sessions."""
+
+    code = models.CharField(max_length=50, unique=True)
+    name = models.CharField(max_length=255, blank=True)
+    students = models.ManyToManyField(Student, related_name='sections', blank=True)
+
+    def __str__(self):
+        return f"{self.name or self.code} ({self.code})"
+
+
+class ClassSession(models.Model):
+    """Links an attendance session_id to the section it belongs to."""
+
+    session_id = models.CharField(max_length=100, unique=True)
+    section = models.ForeignKey(Section, on_delete=models.CASCADE, related_name='sessions')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Session {self.session_id} of {self.section.code}"
+
+
+class EnrollmentJob(models.Model):
+    """A bulk enrollment import, processed by core/bulk_enrollment.py."""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'),
+                      (FAILED, 'Failed')]
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    # The uploaded zip, or a CSV manifest whose photos live under photo_root
+    source = models.FileField(upload_to='enrollment_jobs/')
+    photo_root = models.CharField(max_length=500, blank=True)
+    total = models.PositiveIntegerField(default=0)
+    # Why the job as a whole stopped; its pending items can be resumed
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Enrollment job {self.pk} ({self.status})"
+
+
+class EnrollmentItem(models.Model):
+    """One student of an enrollment job's manifest."""
+
+    PENDING = 'pending'
+    ENROLLED = 'enrolled'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (ENROLLED, 'Enrolled'), (FAILED, 'Failed')]
+
+    job = models.ForeignKey(EnrollmentJob, on_delete=models.CASCADE, related_name='items')
+    line = models.PositiveIntegerField()  # Manifest line, for error reports
+    student_id = models.CharField(max_length=50)
+    name = models.CharField(max_length=255)
+    photo = models.CharField(max_length=500)  # Path within the zip or photo_root
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    error = models.CharField(max_length=255, blank=True)
+    enrolled_student = models.ForeignKey(
+        Student, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='enrollment_items')
+
+    class Meta:
+        unique_together = ['job', 'line']
+        indexes = [
+            models.Index(fields=['job', 'status', 'line'], name='enrollment_item_status'),
+        ]
+
+    def __str__(self):
+        return f"Line {self.line} of job {self.job_id}: {self.student_id}"
@@ -0,0 +1,141 @@
+"""
+Stored student photos and their face thumbnails.
+
+Phone uploads run to several MB, and roster screens only need a small face.
+So uploads are not stored as sent: every enrolled photo is stored upright,
+without its metadata and re-encoded at most MAX_SIDE px, and the student's
+main photo also gets a square JPEG thumbnail cropped around the face box
+YOLOv8 already found while encoding it. JPEG uploads are decoded at reduced
+resolution (PIL draft mode), as in core/preprocessing.py.
+
+Files are named by a hash of their content, so a name never changes
+meaning: they are served with a year-long immutable Cache-Control (see
+views.student_image_view), and storing the same photo twice stores one file.
+
+Configured by settings.STUDENT_PHOTOS:
+
+    STUDENT_PHOTOS = {
+        'MAX_SIDE': 1280,           # px, longest side of stored photos
+        'QUALITY': 85,              # JPEG quality of stored photos
+        'THUMBNAIL_SIZE': 160,      # px, side of the square thumbnails
+        'THUMBNAIL_QUALITY': 80,
+        'THUMBNAIL_PADDING': 0.3,   # fraction of the face box added on each side
+        'CACHE_MAX_AGE': 365 * 24 * 60 * 60,
+    }
+"""
+import hashlib
+import io
+import re
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .preprocessing import inspect_image
+
+PHOTO_DIRECTORY = 'students/photos'
+THUMBNAIL_DIRECTORY = 'students/thumbs'
+KINDS = {'photos': PHOTO_DIRECTORY, 'thumbs': THUMBNAIL_DIRECTORY}
+HASHED_NAME = re.compile(r'^[0-9a-f]{32}\.jpg$')
+
+
+def _config():
+    return getattr(settings, 'STUDENT_PHOTOS', {})
+
+
+def hashed_name(directory, data):
+    """Storage name of a derived file: a BLAKE2b hash of its bytes."""
+    return f'{directory}/{hashlib.blake2b(data, digest_size=16).hexdigest()}.jpg'
+
+
+def is_derived(name):
+    """Whether a stored file name was produced by this module."""
+    directory, _, filename = (name or '').rpartition('/')
+    return directory in KINDS.values() and bool(HASHED_NAME.match(filename))
+
+
+def _jpeg(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def _square_crop(box, width, height, padding):
+    x1, y1, x2, y2 = box
+    side = min(max(x2 - x1, y2 - y1) * (1 + 2 * padding), width, height)
+    # Centred on the face, shifted back inside the image at the edges
+    left = min(max(0, (x1 + x2 - side) / 2), width - side)
+    top = min(max(0, (y1 + y2 - side) / 2), height - side)
+    return tuple(round(v) for v in (left, top, left + side, top + side))
+
+
+def _decode(img_data):
+    # Upright RGB at no more than needed for MAX_SIDE, and its scale to the upload
+    max_side = _config().get('MAX_SIDE', 1280)
+    header = inspect_image(img_data)
+    with Image.open(io.BytesIO(img_data)) as image:
+        # Lets libjpeg decode at 1/2, 1/4 or 1/8 scale when that is still large enough
+        image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    return image, image.width / header.width
+
+
+def _photo_jpeg(image):
+    config = _config()
+    max_side = config.get('MAX_SIDE', 1280)
+    photo = image.copy()
+    photo.thumbnail((max_side, max_side), Image.LANCZOS)
+    return _jpeg(photo, config.get('QUALITY', 85))
+
+
+def _thumbnail_jpeg(image, scale, box):
+    config = _config()
+    if box is None:
+        crop = _square_crop((0, 0, image.width, image.height), image.width, image.height, 0)
+    else:
+        crop = _square_crop([v * scale for v in box], image.width, image.height,
+                            config.get('THUMBNAIL_PADDING', 0.3))
+    size = config.get('THUMBNAIL_SIZE', 160)
+    face = image.crop(crop).resize((size, size), Image.LANCZOS)
+    return _jpeg(face, config.get('THUMBNAIL_QUALITY', 80))
+
+
+def _store(directory, data):
+    name = hashed_name(directory, data)
+    # Same bytes, same name: a stored copy is already what we would write
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(data))
+    return name
+
+
+def store_photo(img_data, box=None, thumbnail=True):
+    """
+    Store an upload re-encoded and, with thumbnail, its face thumbnail.
+
+    box is the face as (x1, y1, x2, y2) in the upload's own (EXIF-rotated)
+    coordinates; without it the thumbnail is the centre square. Returns
+    (photo name, thumbnail name or None); raises ImageRejected for an
+    unusable upload.
+    """
+    image, scale = _decode(img_data)
+    return (_store(PHOTO_DIRECTORY, _photo_jpeg(image)),
+            _store(THUMBNAIL_DIRECTORY, _thumbnail_jpeg(image, scale, box)) if thumbnail else None)
+
+
+def store_thumbnail(img_data, box=None):
+    """Store only the face thumbnail of a photo, e.g. one already stored re-encoded."""
+    image, scale = _decode(img_data)
+    return _store(THUMBNAIL_DIRECTORY, _thumbnail_jpeg(image, scale, box))
+
+
+def open_derived(kind, name):
+    """A stored photo ('photos') or thumbnail ('thumbs') by file name; raises FileNotFoundError."""
+    path = f'{KINDS.get(kind)}/{name}'
+    if not is_derived(path):
+        raise FileNotFoundError(path)
+    return default_storage.open(path, 'rb')
+
+
+def cache_max_age():
+    return _config().get('CACHE_MAX_AGE', 365 * 24 * 60 * 60)
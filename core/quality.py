@@ -0,0 +1,139 @@
+"""
+Deciding which detected faces are worth encoding.
+
+dlib encoding is the expensive step of recognition, and in a lecture-hall
+photo most of its time goes to back-row faces too small, blurred or turned
+away to ever match. Each detection is scored from cheap measurements of its
+box and pixels; faces that fail a hard limit are skipped with a reason, and
+the rest are encoded best-first until the request's budget runs out, so the
+faces most likely to match are never the ones dropped.
+
+Configured by settings.FACE_QUALITY:
+
+    FACE_QUALITY = {
+        'MIN_CONFIDENCE': 0.5,         # detector confidence; below it, not a face
+        'MIN_FACE_SIZE': 40,           # px, shorter side of the box as encoded
+        'MIN_SHARPNESS': 25.0,         # Laplacian variance of the face at 64x64
+        'MAX_ASYMMETRY': 0.45,         # left/right difference; profiles score high
+        'ASPECT_RANGE': (0.5, 1.25),   # box width / height of a roughly frontal face
+        'MAX_FACES': 60,               # faces encoded per request
+        'ENCODE_BUDGET_SECONDS': 10.0, # encoding time per request
+    }
+"""
+import collections
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+# Side of the grayscale patch the sharpness and symmetry are measured on
+PATCH_SIZE = 64
+
+Assessment = collections.namedtuple('Assessment', 'score reason size sharpness asymmetry')
+
+DEFAULTS = {
+    'MIN_CONFIDENCE': 0.5,
+    'MIN_FACE_SIZE': 40,
+    'MIN_SHARPNESS': 25.0,
+    'MAX_ASYMMETRY': 0.45,
+    'ASPECT_RANGE': (0.5, 1.25),
+    'MAX_FACES': 60,
+    'ENCODE_BUDGET_SECONDS': 10.0,
+}
+
+
+def _config():
+    return {**DEFAULTS, **getattr(settings, 'FACE_QUALITY', {})}
+
+
+def min_confidence():
+    """Detector confidence below which a detection is not a face at all."""
+    return _config()['MIN_CONFIDENCE']
+
+
+def face_patch(rgb_image, box):
+    """The face inside an (x1, y1, x2, y2) box as a square grayscale patch."""
+    height, width = rgb_image.shape[:2]
+    x1, y1, x2, y2 = (int(round(float(v))) for v in box)
+    x1, y1 = max(0, x1), max(0, y1)
+    x2, y2 = min(width, x2), min(height, y2)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    gray = cv2.cvtColor(rgb_image[y1:y2, x1:x2], cv2.COLOR_RGB2GRAY)
+    return cv2.resize(gray, (PATCH_SIZE, PATCH_SIZE),
+                      interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def sharpness(patch):
+    """Variance of the Laplacian: low for blurred (or upscaled) faces."""
+    return float(cv2.Laplacian(patch, cv2.CV_32F).var())
+
+
+def asymmetry(patch):
+    """Mean difference between the face and its mirror image, 0 to 1."""
+    return float(np.abs(patch - patch[:, ::-1]).mean() / 255.0)
+
+
+def assess_face(rgb_image, box, confidence, config=None):
+    """
+    Score one detection; reason is None when the face is worth encoding.
+
+    Checks run cheapest first and stop at the first failure, which becomes
+    the reason: 'low_confidence', 'too_small', 'pose' (box shape or left/
+    right asymmetry of a face turned away), or 'blurry'. The score, the
+    detector confidence discounted for small, soft and asymmetric faces,
+    orders the faces that pass.
+    """
+    config = config or _config()
+    x1, y1, x2, y2 = (float(v) for v in box)
+    width, height = x2 - x1, y2 - y1
+    size = min(width, height)
+    if confidence < config['MIN_CONFIDENCE']:
+        return Assessment(0.0, 'low_confidence', size, None, None)
+    if size < config['MIN_FACE_SIZE']:
+        return Assessment(0.0, 'too_small', size, None, None)
+    min_aspect, max_aspect = config['ASPECT_RANGE']
+    if not min_aspect <= width / height <= max_aspect:
+        return Assessment(0.0, 'pose', size, None, None)
+
+    patch = face_patch(rgb_image, box)
+    if patch is None:
+        return Assessment(0.0, 'too_small', size, None, None)
+    face_asymmetry = asymmetry(patch)
+    if face_asymmetry > config['MAX_ASYMMETRY']:
+        return Assessment(0.0, 'pose', size, None, face_asymmetry)
+    face_sharpness = sharpness(patch)
+    if face_sharpness < config['MIN_SHARPNESS']:
+        return Assessment(0.0, 'blurry', size, face_sharpness, face_asymmetry)
+
+    score = (float(confidence)
+             * min(1.0, size / (2 * config['MIN_FACE_SIZE']))
+             * min(1.0, face_sharpness / (4 * config['MIN_SHARPNESS']))
+             * (1.0 - face_asymmetry))
+    return Assessment(score, None, size, face_sharpness, face_asymmetry)
+
+
+class EncodeBudget:
+    """How many more faces one request may encode, by count and by time."""
+
+    def __init__(self, max_faces=None, seconds=None):
+        self.max_faces = max_faces
+        self.seconds = seconds
+        self.spent = 0
+        self.started = time.perf_counter()
+
+    @classmethod
+    def from_settings(cls):
+        config = _config()
+        return cls(max_faces=config['MAX_FACES'], seconds=config['ENCODE_BUDGET_SECONDS'])
+
+    def allows(self):
+        if self.max_faces is not None and self.spent >= self.max_faces:
+            return False
+        if self.seconds is not None and time.perf_counter() - self.started >= self.seconds:
+            return False
+        return True
+
+    def spend(self, faces=1):
+        self.spent += faces
@@ -0,0 +1,349 @@
+"""
+Face detection and encoding steps.
+
+The analyze_* functions are the jobs submitted to the inference pool
+(core/inference.py); they run in worker processes and only return plain
+data (boxes, encodings, timings) so results pickle cheaply. The models
+themselves come from core/model_registry.py.
+"""
+import logging
+import time
+
+import numpy as np
+
+from .debug_capture import get_debug_capture
+from .model_registry import model_registry
+from .preprocessing import ImageRejected, load_image
+from .quality import EncodeBudget, assess_face, min_confidence
+
+logger = logging.getLogger(__name__)
+
+
+# Fraction of the box size added on each side before dlib landmarking
+FACE_BOX_PADDING = 0.1
+
+# Faces of one image handed to a single encoder call; the encoding time
+# budget is checked between calls
+ENCODE_CHUNK_SIZE = 16
+
+
+def detect_faces(rgb_images):
+    """
+    Detect faces in every image with a single batched YOLOv8 call.
+
+    Returns one (boxes, confidences) pair per image, with boxes in
+    (x1, y1, x2, y2) format.
+    """
+    return model_registry.detector().detect(rgb_images)
+
+
+def face_locations(boxes, image_shape, padding=FACE_BOX_PADDING):
+    """
+    Convert YOLOv8 (x1, y1, x2, y2) boxes to dlib (top, right, bottom, left).
+
+    YOLO boxes are tighter than the HOG boxes dlib's landmark model was
+    trained on, so each side is padded by a fraction of the box size before
+    clipping to the image.
+    """
+    height, width = image_shape[:2]
+    locations = []
+    for x1, y1, x2, y2 in boxes:
+        pad_x = (x2 - x1) * padding
+        pad_y = (y2 - y1) * padding
+        locations.append((
+            max(0, int(y1 - pad_y)),
+            min(width - 1, int(x2 + pad_x)),
+            min(height - 1, int(y2 + pad_y)),
+            max(0, int(x1 - pad_x)),
+        ))
+    return locations
+
+
+def encode_faces(rgb_image, boxes, num_jitters=1):
+    """
+    Generate 128-d face_recognition encodings for every box in one pass.
+
+    The boxes are handed to dlib as known face locations, so there is no
+    second face detection; dlib aligns each face from its landmarks and
+    extracts a normalised chip itself, which makes the old crop/upscale
+    step unnecessary. Returns one encoding per box.
+    """
+    if len(boxes) == 0:
+        return []
+    return model_registry.encoder().encode(
+        rgb_image, face_locations(boxes, rgb_image.shape), num_jitters=num_jitters)
+
+
+def _face_location(box, confidence, scale):
+    x1, y1, x2, y2 = (int(round(float(v) * scale)) for v in box)
+    return {
+        'x': x1,
+        'y': y1,
+        'width': x2 - x1,
+        'height': y2 - y1,
+        'confidence': float(confidence)
+    }
+
+
+def _original_box(box, scale):
+    return tuple(float(v) * scale for v in box)
+
+
+def _encode_chunk(rgb_image, frame, chunk, skipped):
+    """Encode (box, location) pairs of one image in one call, face by face if it fails."""
+    try:
+        encodings = encode_faces(rgb_image, np.stack([box for box, _ in chunk]))
+    except Exception as e:
+        logger.warning("encoding failed frame=%d faces=%d error=%s", frame, len(chunk), e)
+        encodings = None
+
+    faces_data = []
+    for i, (box, location) in enumerate(chunk):
+        if encodings is not None:
+            encoding = encodings[i]
+        elif len(chunk) == 1:
+            encoding = None
+        else:
+            try:
+                encoding = encode_faces(rgb_image, box[None, :])[0]
+            except Exception as e:
+                logger.warning("encoding failed frame=%d error=%s", frame, e)
+                encoding = None
+        if encoding is None:
+            skipped.append({'frame': frame, 'location': location, 'reason': 'encoding_failed'})
+            continue
+        faces_data.append({'frame': frame, 'encoding': encoding, 'location': location})
+    return faces_data
+
+
+def extract_faces(rgb_images, detections, scales=None):
+    """
+    Encode the detected faces worth encoding across all images.
+
+    Detections below the detector confidence threshold are not faces and
+    are dropped; every other one goes through the quality gate
+    (core/quality.py). The best of those that pass, across all images, are
+    kept up to the request's face budget and encoded with one encoder call
+    per image (per ENCODE_CHUNK_SIZE faces of it), images with the best
+    faces first, until the time budget is spent. Returns (faces_data, skipped):
+    face dicts holding the frame index, encoding and location of each
+    encoded face, and dicts holding the frame, location and reason of each
+    face that was not. Locations are multiplied by the per-image scale so
+    they refer to the original upload rather than the working image.
+    """
+    if scales is None:
+        scales = [1.0] * len(rgb_images)
+    threshold = min_confidence()
+    candidates = []
+    skipped = []
+    for frame, (rgb_image, (boxes, confidences), scale) in enumerate(
+            zip(rgb_images, detections, scales)):
+        for box, conf in zip(boxes, confidences):
+            if conf < threshold:
+                continue
+            location = _face_location(box, conf, scale)
+            assessment = assess_face(rgb_image, box, conf)
+            if assessment.reason is not None:
+                skipped.append({'frame': frame, 'location': location,
+                                'reason': assessment.reason})
+                continue
+            candidates.append((assessment.score, frame, box, location))
+
+    # Most promising faces first, so the budget cuts off the least likely matches
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+    budget = EncodeBudget.from_settings()
+    admitted = candidates if budget.max_faces is None else candidates[:budget.max_faces]
+    for _, frame, _, location in candidates[len(admitted):]:
+        skipped.append({'frame': frame, 'location': location, 'reason': 'budget'})
+
+    by_frame = {}
+    for _, frame, box, location in admitted:
+        by_frame.setdefault(frame, []).append((box, location))
+    faces_data = []
+    for frame, faces in by_frame.items():
+        for start in range(0, len(faces), ENCODE_CHUNK_SIZE):
+            chunk = faces[start:start + ENCODE_CHUNK_SIZE]
+            if not budget.allows():
+                skipped.extend({'frame': frame, 'location': location, 'reason': 'budget'}
+                               for _, location in chunk)
+                continue
+            budget.spend(len(chunk))
+            faces_data.extend(_encode_chunk(rgb_images[frame], frame, chunk, skipped))
+    return faces_data, skipped
+
+
+def analyze_images(images, capture_tag=''):
+    """
+    Inference job for recognition: decode, detect and encode every image.
+
+    Returns {'images': [...], 'faces': [...], 'skipped': [...],
+    'timings': {...}} where each entry of 'images' describes one input
+    (whether it decoded and why not, its original shape and how many faces
+    YOLOv8 found) and 'faces' and 'skipped' are the extract_faces() output.
+    """
+    timings = {}
+
+    started = time.perf_counter()
+    prepared = []
+    summaries = []
+    for img_data in images:
+        try:
+            image = load_image(img_data)
+        except ImageRejected as e:
+            prepared.append(None)
+            summaries.append({'valid': False, 'error': str(e), 'shape': None, 'detected': 0})
+            continue
+        prepared.append(image)
+        width, height = image.original_size
+        summaries.append({'valid': True, 'error': None, 'shape': (height, width, 3),
+                          'detected': 0})
+    timings['decode'] = time.perf_counter() - started
+
+    if any(image is None for image in prepared):
+        return {'images': summaries, 'faces': [], 'skipped': [], 'timings': timings}
+    rgb_images = [image.rgb for image in prepared]
+
+    started = time.perf_counter()
+    detections = detect_faces(rgb_images)
+    timings['detect'] = time.perf_counter() - started
+    for summary, (boxes, _) in zip(summaries, detections):
+        summary['detected'] = len(boxes)
+
+    # Written in the background only if DEBUG_CAPTURE selects this request
+    debug_capture = get_debug_capture()
+    threshold = min_confidence()
+    for rgb_image, (boxes, confidences) in zip(rgb_images, detections):
+        debug_capture.capture(rgb_image, boxes[confidences >= threshold], tag=capture_tag)
+
+    started = time.perf_counter()
+    faces_data, skipped = extract_faces(
+        rgb_images, detections, [image.scale for image in prepared])
+    timings['encode'] = time.perf_counter() - started
+    if faces_data:
+        timings['encode_per_face'] = timings['encode'] / len(faces_data)
+
+    return {'images': summaries, 'faces': faces_data, 'skipped': skipped, 'timings': timings}
+
+
+def analyze_enrollment(images, num_jitters=3):
+    """
+    Inference job for registration: encode the most confident face per photo.
+
+    All photos go through YOLOv8 as one batch. Returns {'photos': [...],
+    'timings': {...}} where each entry of 'photos' holds 'valid', 'error',
+    'detected', 'encoding' and 'box' for one input; encoding is None when
+    no face could be encoded, and box is the face's (x1, y1, x2, y2) in the
+    original photo, for its thumbnail (see core/photos.py).
+    """
+    timings = {}
+
+    started = time.perf_counter()
+    photos = []
+    prepared = []
+    for img_data in images:
+        try:
+            prepared.append(load_image(img_data))
+        except ImageRejected as e:
+            photos.append({'valid': False, 'error': str(e), 'detected': 0, 'encoding': None,
+                           'box': None})
+            continue
+        photos.append({'valid': True, 'error': None, 'detected': 0, 'encoding': None,
+                       'box': None})
+    timings['decode'] = time.perf_counter() - started
+    if len(prepared) < len(images):
+        return {'photos': photos, 'timings': timings}
+    rgb_images = [image.rgb for image in prepared]
+
+    started = time.perf_counter()
+    detections = detect_faces(rgb_images)
+    timings['detect'] = time.perf_counter() - started
+
+    # Generate face embedding using face_recognition
+    # This step generates a 128-dimension face encoding vector
+    started = time.perf_counter()
+    for photo, image, (boxes, confidences) in zip(photos, prepared, detections):
+        photo['detected'] = len(boxes)
+        if len(boxes) == 0:
+            continue
+        # Find the face with highest confidence
+        best_face_idx = np.argmax(confidences)
+        photo['box'] = _original_box(boxes[best_face_idx], image.scale)
+        try:
+            photo['encoding'] = encode_faces(
+                image.rgb, boxes[best_face_idx:best_face_idx + 1], num_jitters=num_jitters)[0]
+        except Exception as e:
+            logger.warning("enrollment encoding failed error=%s", e)
+    timings['encode'] = time.perf_counter() - started
+
+    return {'photos': photos, 'timings': timings}
+
+
+def locate_faces(images):
+    """
+    Inference job for photo backfills: the most confident face per photo.
+
+    Returns one (x1, y1, x2, y2) box in original-photo coordinates per
+    image, or None where the photo is unreadable or shows no face.
+    """
+    prepared = []
+    for img_data in images:
+        try:
+            prepared.append(load_image(img_data))
+        except ImageRejected:
+            prepared.append(None)
+    readable = [image for image in prepared if image is not None]
+    detections = iter(detect_faces([image.rgb for image in readable]) if readable else [])
+
+    located = []
+    for image in prepared:
+        if image is None:
+            located.append(None)
+            continue
+        boxes, confidences = next(detections)
+        located.append(_original_box(boxes[np.argmax(confidences)], image.scale)
+                       if len(boxes) else None)
+    return located
+
+
+def analyze_stream_frame(img_data, tracker):
+    """
+    Inference job for streaming recognition: one video frame.
+
+    Detections advance the tracker (a core.tracking.IoUTracker), and only
+    tracks the tracker selects, new or not yet identified, are encoded.
+    Returns {'valid', 'error', 'detected', 'scale', 'tracker', 'encodings',
+    'timings'}, where 'tracker' is the updated tracker and 'encodings' holds
+    (track_id, encoding) pairs.
+    """
+    timings = {}
+
+    started = time.perf_counter()
+    try:
+        image = load_image(img_data)
+    except ImageRejected as e:
+        return {'valid': False, 'error': str(e), 'detected': 0, 'scale': None,
+                'tracker': tracker, 'encodings': [], 'timings': timings}
+    timings['decode'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    boxes, confidences = detect_faces([image.rgb])[0]
+    keep = confidences >= min_confidence()
+    tracker.update(boxes[keep], confidences[keep])
+    timings['detect'] = time.perf_counter() - started
+
+    # Faces too small, blurred or turned away wait for a better frame
+    encodings = []
+    pending = tracker.select_for_encoding(
+        accept=lambda track: assess_face(image.rgb, track.box, track.confidence).reason is None)
+    if pending:
+        started = time.perf_counter()
+        try:
+            encoded = encode_faces(image.rgb, np.array([track.box for track in pending]))
+            encodings = [(track.track_id, encoding)
+                         for track, encoding in zip(pending, encoded)]
+        except Exception as e:
+            logger.warning("stream encoding failed faces=%d error=%s", len(pending), e)
+        timings['encode'] = time.perf_counter() - started
+
+    return {'valid': True, 'error': None, 'detected': len(boxes), 'scale': image.scale,
+            'tracker': tracker, 'encodings': encodings, 'timings': timings}
@@ -0,0 +1,132 @@
+"""
+Attendance reporting queries.
+
+Each report is one query over AttendanceRecord joined to Student, returning
+plain values rather than model instances, so a page of results costs one
+query (plus the paginator's COUNT) however many rows it holds. The
+composite indexes on AttendanceRecord cover the filters and orderings used
+here: (session_id, timestamp) for session rosters, (student, timestamp) for
+student history and (timestamp) for date ranges.
+"""
+import datetime
+
+from django.db.models import Count, F, Max, Min
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import AttendanceRecord
+
+RECORD_FIELDS = ('student_code', 'student_name', 'session_id', 'timestamp', 'recognized_by')
+SUMMARY_GROUPS = ('session', 'student', 'day')
+EXPORT_CHUNK_SIZE = 2000
+
+
+def parse_bound(value, end=False):
+    """
+    A range bound from an ISO date or datetime query parameter.
+
+    A bare date covers the whole day: as an end bound it means the start of
+    the next day. Returns None for an empty value; raises ValueError for
+    anything else that does not parse.
+    """
+    if not value:
+        return None
+    try:
+        # A bare date first: parse_datetime() would read it as midnight
+        day = parse_date(value)
+        moment = None if day else parse_datetime(value)
+    except ValueError:
+        day = moment = None
+    if day is not None:
+        if end:
+            day += datetime.timedelta(days=1)
+        moment = datetime.datetime.combine(day, datetime.time.min)
+    elif moment is None:
+        raise ValueError(f"Invalid date: {value}")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def date_range(params):
+    """(start, end) from the `from` and `to` query parameters."""
+    start = parse_bound(params.get('from'))
+    end = parse_bound(params.get('to'), end=True)
+    if start and end and start >= end:
+        raise ValueError("`from` must be before `to`")
+    return start, end
+
+
+def in_range(queryset, start=None, end=None):
+    if start is not None:
+        queryset = queryset.filter(timestamp__gte=start)
+    if end is not None:
+        queryset = queryset.filter(timestamp__lt=end)
+    return queryset
+
+
+def records(start=None, end=None, **filters):
+    """Attendance records with their student, as dicts of RECORD_FIELDS."""
+    return in_range(AttendanceRecord.objects.filter(**filters), start, end).annotate(
+        student_code=F('student__student_id'), student_name=F('student__name'),
+    ).values(*RECORD_FIELDS)
+
+
+def session_roster(session_id):
+    """Students marked present in a session, in the order they arrived."""
+    return records(session_id=session_id).order_by('timestamp', 'pk')
+
+
+def student_history(student, start=None, end=None):
+    """A student's attendance, most recent first."""
+    return records(start, end, student=student).order_by('-timestamp', '-pk')
+
+
+def student_totals(student, start=None, end=None):
+    """Sessions attended, first and last seen, in one aggregate query."""
+    return in_range(AttendanceRecord.objects.filter(student=student), start, end).aggregate(
+        sessions=Count('pk'), first_seen=Min('timestamp'), last_seen=Max('timestamp'))
+
+
+def range_summary(group, start=None, end=None):
+    """
+    Attendance grouped by session, student or day, one row per group.
+
+    Every row counts its attendance records ('present') next to the group's
+    own columns; sessions also carry their first and last arrival.
+    """
+    queryset = in_range(AttendanceRecord.objects.all(), start, end)
+    if group == 'session':
+        return queryset.values('session_id').annotate(
+            present=Count('pk'), first_seen=Min('timestamp'), last_seen=Max('timestamp'),
+        ).order_by('-first_seen', 'session_id')
+    if group == 'student':
+        return queryset.annotate(
+            student_code=F('student__student_id'), student_name=F('student__name'),
+        ).values('student_code', 'student_name').annotate(
+            present=Count('pk'), sessions=Count('session_id', distinct=True),
+            last_seen=Max('timestamp'),
+        ).order_by('-present', 'student_code')
+    if group == 'day':
+        return queryset.annotate(day=TruncDate('timestamp')).values('day').annotate(
+            present=Count('pk'), students=Count('student', distinct=True),
+            sessions=Count('session_id', distinct=True),
+        ).order_by('-day')
+    raise ValueError(f"group must be one of {', '.join(SUMMARY_GROUPS)}")
+
+
+def export_rows(start=None, end=None, session_id=None):
+    """
+    CSV rows (header first) for every record in a range, oldest first.
+
+    Rows are fetched in chunks with a server-side cursor where the database
+    has one, so exporting a whole term never holds it in memory.
+    """
+    filters = {'session_id': session_id} if session_id else {}
+    yield ['student_id', 'name', 'session_id', 'timestamp', 'recognized_by']
+    queryset = records(start, end, **filters).order_by('timestamp', 'pk').values_list(
+        *RECORD_FIELDS)
+    for code, name, session, timestamp, recognized_by in queryset.iterator(
+            chunk_size=EXPORT_CHUNK_SIZE):
+        yield [code, name, session, timezone.localtime(timestamp).isoformat(), recognized_by]
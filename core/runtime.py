@@ -0,0 +1,128 @@
+"""
+CPU thread configuration for the inference libraries.
+
+torch, OpenCV and the BLAS/OpenMP runtime under numpy and dlib each size
+their thread pools to every core of the machine, in every process. With
+several inference workers (and web workers doing the matching) that means
+many times more busy threads than cores, and latency worse than running
+each process single-threaded. Every process therefore gets an explicit
+share: each INFERENCE_POOL worker THREADS threads, by default the cores
+divided among the workers, and each web process (which only does the
+numpy matching, unless WORKERS = 0 runs inference inline) WEB_THREADS.
+
+The BLAS/OpenMP variables only take effect in libraries loaded afterwards,
+so configure_environment() runs before Django loads the app (config/wsgi.py,
+config/asgi.py) and before each pool worker sets Django up; apply() sets
+OpenCV's and torch's pools where inference runs. Use `manage.py
+benchmark_runtime` to compare worker x thread layouts on the target machine.
+
+Configured by settings.INFERENCE_RUNTIME:
+
+    INFERENCE_RUNTIME = {
+        'THREADS': None,         # per pool worker; default cpu_count // INFERENCE_POOL workers
+        'WEB_THREADS': 1,        # per web (or management command) process
+        'INTEROP_THREADS': 1,    # torch inter-op pool
+        'OPENCV_THREADS': None,  # default the process's threads; 0 runs OpenCV single-threaded
+    }
+"""
+import logging
+import os
+import sys
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Read when the BLAS/OpenMP runtimes load; numexpr, OpenBLAS, MKL, Accelerate
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                   'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+# Which of them configure_environment() set, as opposed to the deployment
+_CONFIGURED_ENV_VAR = 'RTMS_CONFIGURED_THREAD_VARS'
+
+_applied = None
+_torch_configured = False
+_lock = threading.Lock()
+
+
+def _config():
+    return getattr(settings, 'INFERENCE_RUNTIME', {})
+
+
+def thread_settings(workers=None):
+    """
+    Thread counts for each process of a pool of `workers` inference
+    processes, or with workers=None for a web process.
+    """
+    config = _config()
+    if workers is None:
+        threads = config.get('WEB_THREADS') or 1
+    else:
+        threads = config.get('THREADS') or max(1, (os.cpu_count() or 1) // max(1, workers))
+    opencv_threads = config.get('OPENCV_THREADS')
+    return {
+        'threads': threads,
+        'interop_threads': config.get('INTEROP_THREADS', 1),
+        'opencv_threads': threads if opencv_threads is None else opencv_threads,
+    }
+
+
+def configure_environment(threads=None):
+    """
+    Set the BLAS/OpenMP thread variables for this process and its children.
+
+    Variables the deployment set are left alone, so it can still pin them
+    explicitly. Ones set here are recorded in _CONFIGURED_ENV_VAR, so that a
+    pool worker, which inherits the web process's environment, replaces them
+    with its own share.
+    """
+    threads = threads or thread_settings()['threads']
+    configured = set(filter(None, os.environ.get(_CONFIGURED_ENV_VAR, '').split(',')))
+    for name in THREAD_ENV_VARS:
+        if name not in os.environ or name in configured:
+            os.environ[name] = str(threads)
+            configured.add(name)
+    os.environ[_CONFIGURED_ENV_VAR] = ','.join(sorted(configured))
+
+
+def configure_torch(options=None):
+    """Size torch's thread pools; called where torch is loaded, before its first use."""
+    global _torch_configured
+    import torch
+
+    options = options or _applied or thread_settings()
+    with _lock:
+        if _torch_configured:
+            return
+        _torch_configured = True
+        torch.set_num_threads(options['threads'])
+        try:
+            torch.set_num_interop_threads(options['interop_threads'])
+        except RuntimeError:
+            # Only possible before any inter-op work has started in this process
+            logger.warning("torch inter-op threads already fixed at %d",
+                           torch.get_num_interop_threads())
+
+
+def apply(options=None):
+    """
+    Apply thread counts to this process; later calls are no-ops.
+
+    options defaults to thread_settings(); pool workers are handed the
+    parent's, since they do not see its overridden settings.
+    """
+    global _applied
+    with _lock:
+        if _applied is not None:
+            return _applied
+        _applied = options = options or thread_settings()
+    configure_environment(options['threads'])
+
+    import cv2
+    cv2.setNumThreads(options['opencv_threads'])
+    if 'torch' in sys.modules:
+        configure_torch(options)
+    logger.info("runtime threads=%d interop_threads=%d opencv_threads=%d pid=%d",
+                options['threads'], options['interop_threads'], options['opencv_threads'],
+                os.getpid())
+    return options
@@ -0,0 +1,149 @@
+"""
+Matching scoped to the class section a session belongs to.
+
+A session is linked to a Section through ClassSession, either ahead of time
+or by passing `section` with the first recognition request of the session.
+Faces are then matched against that section's students only, through an
+EmbeddingIndex.subset() built once per section and roster version and kept
+in a small LRU, so matching costs scale with class size rather than with
+the institution. Faces nobody in the section matches can optionally fall
+back to a search of every student (a student sitting in on another
+class); those are reported with in_section false.
+
+Configured by settings.SECTION_MATCHING:
+
+    SECTION_MATCHING = {
+        'GLOBAL_FALLBACK': True,  # search everyone for faces unmatched in the section
+        'CACHE_SIZE': 256,        # section sub-indexes kept per process
+    }
+"""
+import collections
+import threading
+
+from django.conf import settings
+
+from .embeddings import embedding_index
+from .matchers import get_matcher
+from .models import ClassSession, Section
+
+
+class SectionError(Exception):
+    """The section given for a session is unknown or contradicts its binding."""
+
+
+def _config():
+    return getattr(settings, 'SECTION_MATCHING', {})
+
+
+def session_section(session_id, section_code=None):
+    """
+    The Section a session belongs to, or None for an unscoped session.
+
+    With section_code the session is bound to that section on first use;
+    naming a different section for an already bound session raises
+    SectionError, as does an unknown code.
+    """
+    if not section_code:
+        binding = ClassSession.objects.select_related('section').filter(
+            session_id=session_id).first()
+        return binding.section if binding else None
+
+    try:
+        section = Section.objects.get(code=section_code)
+    except Section.DoesNotExist:
+        raise SectionError(f'Unknown section {section_code}')
+    binding, _ = ClassSession.objects.get_or_create(
+        session_id=session_id, defaults={'section': section})
+    if binding.section_id != section.pk:
+        raise SectionError(f'Session {session_id} belongs to another section')
+    return section
+
+
+class SectionScope:
+    """Matching restricted to one section's students."""
+
+    def __init__(self, section, student_pks, index, fallback):
+        self.section = section
+        self.student_pks = student_pks
+        self.index = index
+        self.fallback = fallback
+
+    def __contains__(self, student_pk):
+        return student_pk in self.student_pks
+
+    def match(self, encodings, threshold):
+        """
+        (student_pk or None, distance) per encoding, like BaseMatcher.match.
+
+        Searches the section sub-index first; with fallback, encodings it
+        leaves unmatched are searched again across every student.
+        """
+        matcher = get_matcher()
+        matches = self.index.match(encodings, threshold, candidates=matcher.rerank_candidates)
+        unmatched = [i for i, (pk, _) in enumerate(matches) if pk is None]
+        if self.fallback and unmatched:
+            retried = matcher.match([encodings[i] for i in unmatched], threshold)
+            for i, (pk, distance) in zip(unmatched, retried):
+                if pk is not None:
+                    matches[i] = (pk, distance)
+        return matches
+
+
+class SectionIndexCache:
+    """Per-section sub-indexes, rebuilt when the roster or the section changes."""
+
+    def __init__(self, size=256):
+        self.size = size
+        self._lock = threading.Lock()
+        # section pk -> (embedding index version, student pks, sub-index)
+        self._entries = collections.OrderedDict()
+
+    def get(self, section_pk, student_pks):
+        version = embedding_index.version
+        with self._lock:
+            entry = self._entries.get(section_pk)
+            if entry is not None and entry[0] == version and entry[1] == student_pks:
+                self._entries.move_to_end(section_pk)
+                return entry[2]
+
+        index = embedding_index.subset(list(student_pks))
+        with self._lock:
+            self._entries[section_pk] = (version, student_pks, index)
+            self._entries.move_to_end(section_pk)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return index
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_section_indexes = None
+_section_indexes_lock = threading.Lock()
+
+
+def get_section_indexes():
+    """Return the process-wide cache configured by settings.SECTION_MATCHING."""
+    global _section_indexes
+    if _section_indexes is None:
+        with _section_indexes_lock:
+            if _section_indexes is None:
+                _section_indexes = SectionIndexCache(size=_config().get('CACHE_SIZE', 256))
+    return _section_indexes
+
+
+def section_scope(section):
+    """
+    A SectionScope for matching a section's faces, or None without a section.
+
+    Reads the section's membership (one query, the size of the class) and
+    reuses the cached sub-index while neither it nor the roster changed.
+    """
+    if section is None:
+        return None
+    embedding_index.ensure_loaded()
+    student_pks = frozenset(section.students.values_list('pk', flat=True))
+    index = get_section_indexes().get(section.pk, student_pks)
+    return SectionScope(section, student_pks, index,
+                        fallback=_config().get('GLOBAL_FALLBACK', True))
@@ -6,7 +6,7 @@ from .models import Student, AttendanceRecord
 class StudentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Student
-        fields = ['id', 'name', 'student_id', 'photo']
+        fields = ['id', 'name', 'student_id', 'photo', 'thumbnail']
 
 
 class AttendanceRecordSerializer(serializers.ModelSerializer):
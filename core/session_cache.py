@@ -0,0 +1,162 @@
+"""
+Per-session cache of students already marked present.
+
+During a live session the same students are recognized frame after frame.
+Remembering who is already present lets the recognition path skip the
+attendance lookup for them entirely.
+
+The cache only ever under-reports: a student missing from it (marked by
+another process, or evicted) falls through to the database check, so a
+stale entry costs a query, never a wrong answer. Updates to the shared set
+are serialized with a short cache.add lock; an update that cannot get it
+in time is dropped rather than risk overwriting a concurrent one.
+
+Configured by settings.ATTENDANCE_SESSION_CACHE:
+
+    ATTENDANCE_SESSION_CACHE = {
+        'TTL': 4 * 60 * 60,   # seconds a session is kept after its last use
+        'CACHE_ALIAS': None,  # a Django cache alias to share across processes
+    }
+"""
+import contextlib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import AttendanceRecord
+
+# How long a shared-set update may wait for the lock, and how long a lock
+# left by a crashed process lives
+LOCK_WAIT = 0.2
+LOCK_TTL = 5
+
+
+class SessionAttendanceCache:
+    def __init__(self, ttl=4 * 60 * 60, cache_alias=None):
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self._lock = threading.Lock()
+        # session_id -> (set of student pks, expiry timestamp)
+        self._sessions = {}
+
+    @property
+    def _shared(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    def _cache_key(self, session_id):
+        return f'attendance-session:{session_id}'
+
+    @contextlib.contextmanager
+    def _shared_lock(self, shared, key):
+        """Hold the cache.add lock on key; yields whether it was acquired."""
+        lock_key, token = f'{key}:lock', uuid.uuid4().hex
+        deadline = time.monotonic() + LOCK_WAIT
+        while not shared.add(lock_key, token, LOCK_TTL):
+            if time.monotonic() >= deadline:
+                yield False
+                return
+            time.sleep(0.005)
+        try:
+            yield True
+        finally:
+            # Leave a lock that expired and was taken over by someone else
+            if shared.get(lock_key) == token:
+                shared.delete(lock_key)
+
+    def _evict_expired(self, now):
+        expired = [session_id for session_id, (_, expires_at)
+                   in self._sessions.items() if expires_at <= now]
+        for session_id in expired:
+            del self._sessions[session_id]
+
+    def _lookup(self, session_id, now):
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._sessions.get(session_id)
+            present = set(entry[0]) if entry else None
+
+        shared = self._shared
+        if shared is not None:
+            shared_present = shared.get(self._cache_key(session_id))
+            if shared_present is not None:
+                present = (present or set()) | shared_present
+
+        if present is None:
+            present = set(AttendanceRecord.objects.filter(
+                session_id=session_id).values_list('student_id', flat=True))
+        return present
+
+    def get_present(self, session_id):
+        """Student pks known to be present; loaded from the DB on first use."""
+        now = time.monotonic()
+        present = self._lookup(session_id, now)
+        with self._lock:
+            self._sessions[session_id] = (present, now + self.ttl)
+        return set(present)
+
+    def peek_present(self, session_id):
+        """
+        Like get_present, for readers such as the roster: nothing is cached,
+        so looking at a session does not make it active.
+        """
+        return self._lookup(session_id, time.monotonic())
+
+    def is_active(self, session_id):
+        """Whether the session was recognized in within the TTL; never queries the database."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None and entry[1] > time.monotonic():
+                return True
+        shared = self._shared
+        return shared is not None and shared.get(self._cache_key(session_id)) is not None
+
+    def add_present(self, session_id, student_pks):
+        student_pks = set(student_pks)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            known = entry[0] if entry else set()
+            self._sessions[session_id] = (known | student_pks, now + self.ttl)
+
+        shared = self._shared
+        # Students this process already knew about were published before
+        if shared is not None and not student_pks <= known:
+            key = self._cache_key(session_id)
+            with self._shared_lock(shared, key) as locked:
+                if locked:
+                    shared.set(key, (shared.get(key) or set()) | student_pks, self.ttl)
+
+    def end_session(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        shared = self._shared
+        if shared is not None:
+            key = self._cache_key(session_id)
+            # Let an update in flight land first so it cannot resurrect the set
+            with self._shared_lock(shared, key):
+                shared.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+
+_session_cache = None
+_session_cache_lock = threading.Lock()
+
+
+def get_session_cache():
+    """Return the process-wide cache configured by settings.ATTENDANCE_SESSION_CACHE."""
+    global _session_cache
+    if _session_cache is None:
+        with _session_cache_lock:
+            if _session_cache is None:
+                config = getattr(settings, 'ATTENDANCE_SESSION_CACHE', {})
+                _session_cache = SessionAttendanceCache(
+                    ttl=config.get('TTL', 4 * 60 * 60),
+                    cache_alias=config.get('CACHE_ALIAS'),
+                )
+    return _session_cache
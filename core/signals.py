@@ -0,0 +1,55 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .embeddings import EmbeddingFormatError, embedding_index
+from .models import AttendanceRecord, Student, StudentEmbedding
+from .session_cache import get_session_cache
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Student)
+def index_student_embedding(sender, instance, **kwargs):
+    # Nothing to patch until the first recognition request loads the index
+    if embedding_index.loaded and instance.embedding:
+        rows = list(instance.embeddings.values_list('id', 'embedding'))
+        try:
+            embedding_index.add(instance.pk, instance.embedding,
+                                members=[embedding for _, embedding in rows],
+                                updated_at=instance.updated_at,
+                                member_pks=[pk for pk, _ in rows])
+        except EmbeddingFormatError as e:
+            # Never match against an embedding the current encoder cannot compare with
+            logger.warning("not indexing student pk=%s: %s", instance.pk, e)
+        transaction.on_commit(embedding_index.save_snapshot)
+
+
+@receiver(post_delete, sender=Student)
+def unindex_student_embedding(sender, instance, **kwargs):
+    if embedding_index.loaded:
+        embedding_index.remove(instance.pk)
+        transaction.on_commit(embedding_index.save_snapshot)
+
+
+@receiver(post_delete, sender=StudentEmbedding)
+def refresh_student_centroid(sender, instance, origin=None, **kwargs):
+    # Deleting a student cascades here first; its own signal unindexes it
+    if isinstance(origin, Student) or getattr(origin, 'model', None) is Student:
+        return
+    student = Student.objects.filter(pk=instance.student_id).first()
+    if student is None:
+        return
+    if student.embeddings.exists():
+        student.refresh_centroid()
+    else:
+        # The centroid stays the only embedding; re-index it without members
+        student.save(update_fields=['updated_at'])
+
+
+@receiver(post_delete, sender=AttendanceRecord)
+def forget_session_attendance(sender, instance, **kwargs):
+    # The session cache must never claim a student is present when they are not
+    get_session_cache().end_session(instance.session_id)
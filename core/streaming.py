@@ -0,0 +1,242 @@
+"""
+Streaming recognition over a chunked MJPEG upload.
+
+A classroom camera POSTs its MJPEG feed (multipart/x-mixed-replace, as
+served by most IP cameras and `ffmpeg -f mpjpeg`) to
+/api/sessions/<session_id>/stream/ and reads attendance back from the same
+request as newline-delimited JSON, one event per processed frame:
+
+    {"event": "frame", "frame": 12, "detected": 3, "encoded": 1,
+     "tracks": [...], "newly_marked": [...]}
+
+followed by a final {"event": "summary", ...} when the upload ends. YOLOv8
+runs on every processed frame, but faces are followed with an IoU tracker
+(core/tracking.py) and only new or unidentified tracks are encoded and
+matched, so a seated class costs dlib nothing after the first few frames.
+
+Django reads request bodies by Content-Length, so a never-ending chunked
+upload needs a WSGI server that passes it through unbuffered and sets
+wsgi.input_terminated (gunicorn does); Django's ASGI handler and runserver
+buffer the whole body first. A recorded clip sent with a Content-Length
+works anywhere.
+
+Configured by settings.STREAM_RECOGNITION:
+
+    STREAM_RECOGNITION = {
+        'MAX_FPS': 5,           # frames arriving faster than this are skipped
+        'IOU_THRESHOLD': 0.3,   # overlap that continues a track
+        'MAX_MISSES': 10,       # frames a track survives without a detection
+        'RETRY_INTERVAL': 5,    # frames between encodings of an unknown face
+        'MAX_ATTEMPTS': 5,      # encodings before a face is left unknown
+    }
+"""
+import concurrent.futures
+import logging
+import time
+
+from django.conf import settings
+
+from . import metrics
+from .attendance import mark_students_present
+from .embeddings import embedding_index
+from .inference import InferenceQueueFull, get_inference_pool
+from .matchers import get_matcher
+from .preprocessing import ImageRejected, inspect_image
+from .recognition import analyze_stream_frame
+from .sections import section_scope
+from .tracking import IoUTracker
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class StreamError(Exception):
+    """The upload is not a stream of frames we can read."""
+
+
+def _config():
+    return getattr(settings, 'STREAM_RECOGNITION', {})
+
+
+def request_stream(request):
+    """
+    The file-like body of a request, including chunked uploads.
+
+    Django only reads up to Content-Length; when there is none and the
+    server has de-chunked the body for us, read wsgi.input directly.
+    """
+    environ = request.META
+    if not environ.get('CONTENT_LENGTH') and environ.get('wsgi.input_terminated'):
+        return environ['wsgi.input']
+    return request
+
+
+def iter_multipart_frames(stream, boundary, max_frame_bytes=None):
+    """
+    Yield the body of each part of a multipart/x-mixed-replace stream.
+
+    Parts are split on the boundary delimiter as the stream is read, so
+    frames are handed over as soon as they are complete. Raises StreamError
+    when a part outgrows max_frame_bytes.
+    """
+    if max_frame_bytes is None:
+        max_frame_bytes = getattr(settings, 'IMAGE_PREPROCESSING', {}).get(
+            'MAX_UPLOAD_BYTES', 20 * 1024 * 1024)
+    delimiter = b'--' + boundary.encode('latin-1')
+    buffer = b''
+    started = False
+    while True:
+        chunk = stream.read(READ_CHUNK_BYTES)
+        if chunk:
+            buffer += chunk
+        while True:
+            position = buffer.find(delimiter)
+            if position < 0:
+                break
+            part, buffer = buffer[:position], buffer[position + len(delimiter):]
+            if started:
+                # Headers, a blank line, then the body up to the CRLF before the delimiter
+                header_end = part.find(b'\r\n\r\n')
+                if header_end >= 0:
+                    body = part[header_end + 4:]
+                    yield body[:-2] if body.endswith(b'\r\n') else body
+            started = True
+            if buffer.startswith(b'--'):
+                return
+        if len(buffer) > max_frame_bytes + 1024:
+            raise StreamError(
+                f'Frame exceeds the {max_frame_bytes // (1024 * 1024)}MB upload limit')
+        if not chunk:
+            # Tolerate a stream cut off after its last frame
+            header_end = buffer.find(b'\r\n\r\n') if started else -1
+            if header_end >= 0 and len(buffer) > header_end + 4:
+                yield buffer[header_end + 4:].rstrip(b'\r\n')
+            return
+
+
+def _box_location(box, confidence, scale):
+    x1, y1, x2, y2 = (int(round(float(v) * scale)) for v in box)
+    return {'x': x1, 'y': y1, 'width': x2 - x1, 'height': y2 - y1,
+            'confidence': confidence}
+
+
+def recognize_stream(frames, session_id, recognized_by, section=None):
+    """
+    Track, identify and mark present the faces in a sequence of frames.
+
+    With a section, faces are matched against its students first (see
+    core/sections.py).
+
+    Yields event dicts: one 'frame' event per processed frame listing the
+    visible tracks and the students newly marked present, an 'error' event
+    for frames that could not be read, and a closing 'summary'.
+    """
+    config = _config()
+    tracker = IoUTracker(
+        iou_threshold=config.get('IOU_THRESHOLD', 0.3),
+        max_misses=config.get('MAX_MISSES', 10),
+        retry_interval=config.get('RETRY_INTERVAL', 5),
+        max_attempts=config.get('MAX_ATTEMPTS', 5),
+    )
+    max_fps = config.get('MAX_FPS', 5)
+    min_interval = 1.0 / max_fps if max_fps else 0.0
+    threshold = settings.FACE_MATCH_THRESHOLD
+    pool = get_inference_pool()
+
+    # pk -> Student, for every student identified on this stream
+    students = {}
+    marked_here = set()
+    totals = {'frames': 0, 'processed': 0, 'skipped': 0, 'dropped': 0, 'rejected': 0,
+              'encoded': 0}
+    last_processed = None
+
+    for number, img_data in enumerate(frames, 1):
+        totals['frames'] = number
+        now = time.monotonic()
+        if last_processed is not None and now - last_processed < min_interval:
+            totals['skipped'] += 1
+            continue
+        last_processed = now
+
+        try:
+            inspect_image(img_data)
+        except ImageRejected as e:
+            totals['rejected'] += 1
+            yield {'event': 'error', 'frame': number, 'error': str(e)}
+            continue
+
+        try:
+            analysis = pool.run(analyze_stream_frame, img_data, tracker, key=session_id)
+        except (InferenceQueueFull, concurrent.futures.TimeoutError):
+            # A live feed is better served by its next frame than by a backlog
+            totals['dropped'] += 1
+            continue
+        if not analysis['valid']:
+            totals['rejected'] += 1
+            yield {'event': 'error', 'frame': number, 'error': analysis['error']}
+            continue
+        totals['processed'] += 1
+        # Came back from the worker with this frame applied
+        tracker = analysis['tracker']
+        timer = metrics.StageTimer()
+        timer.update(analysis['timings'])
+        metrics.faces_detected.inc(analysis['detected'])
+
+        newly_marked = []
+        encodings = analysis['encodings']
+        totals['encoded'] += len(encodings)
+        if encodings:
+            with timer.stage('match'):
+                embedding_index.ensure_loaded()
+                queries = [encoding for _, encoding in encodings]
+                scope = section_scope(section)
+                if scope is not None:
+                    matches = scope.match(queries, threshold)
+                else:
+                    matches = get_matcher().match(queries, threshold)
+            identified = {}
+            for (track_id, _), (student_pk, distance) in zip(encodings, matches):
+                if student_pk is not None:
+                    identified[track_id] = (student_pk, float(distance))
+            metrics.faces_matched.inc(len(identified))
+            metrics.faces_unknown.inc(len(encodings) - len(identified))
+
+            if identified:
+                with timer.stage('attendance'):
+                    found, newly_marked_pks = mark_students_present(
+                        {pk for pk, _ in identified.values()}, session_id, recognized_by)
+                students.update(found)
+                for track_id, (student_pk, distance) in identified.items():
+                    # Deleted since the index was last updated
+                    if student_pk in found:
+                        tracker.identify(track_id, student_pk, distance)
+                marked_here |= newly_marked_pks
+                newly_marked = [
+                    {'student_id': found[pk].student_id, 'name': found[pk].name}
+                    for pk in newly_marked_pks]
+        metrics.observe_stages(timer.timings)
+
+        tracks = []
+        for track in tracker.tracks:
+            if not track.visible:
+                continue
+            student = students.get(track.student_pk)
+            tracks.append({
+                'track_id': track.track_id,
+                'student_id': student.student_id if student else None,
+                'name': student.name if student else 'Unknown',
+                'distance': track.distance,
+                'face_location': _box_location(track.box, track.confidence,
+                                               analysis['scale']),
+            })
+        yield {'event': 'frame', 'frame': number, 'detected': analysis['detected'],
+               'encoded': len(encodings), 'tracks': tracks, 'newly_marked': newly_marked}
+
+    logger.info("stream ended session=%s frames=%d processed=%d skipped=%d dropped=%d "
+                "encoded=%d newly_marked=%d", session_id, totals['frames'],
+                totals['processed'], totals['skipped'], totals['dropped'],
+                totals['encoded'], len(marked_here))
+    yield {'event': 'summary', 'session_id': session_id, **totals,
+           'newly_marked': len(marked_here),
+           'already_marked': len(students.keys() - marked_here)}
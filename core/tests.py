@@ -1,3 +1,1447 @@
-from django.test import TestCase
+import collections
+import datetime
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import admission, runtime
+from .admission import AdmissionController, AdmissionRejected, get_admission_controller
+from .attendance import mark_recognized_faces, record_attendance
+from .bulk_enrollment import create_job, run_job
+from .benchmark import (
+    StubFaceEncoder, benchmark_environment, default_layouts, run_benchmark, run_layout_benchmark,
+    sample_images,
+)
+from .debug_capture import DebugCapture
+from .embeddings import (
+    EMBEDDING_DIM, EmbeddingFormatError, EmbeddingIndex, centroid_embedding,
+    current_embedding_model, embedding_index, pack_embedding, read_snapshot, unpack_embedding,
+    write_snapshot)
+from .inference import InferencePool, InferenceQueueFull, _Job
+from .inference_cache import cache_key, peek_cached, run_cached
+from .matchers import IVFMatcher
+from .metrics import Counter, Gauge, Histogram, Registry, inference_cache_lookups
+from .model_registry import ModelRegistry, YOLOFaceDetector, model_registry
+from .models import (
+    AttendanceRecord, ClassSession, EnrollmentJob, Section, Student, StudentEmbedding)
+from .photos import is_derived
+from .preprocessing import ImageRejected, inspect_image, load_image
+from .quality import assess_face
+from .recognition import analyze_images, encode_faces, extract_faces, face_locations
+from .sections import SectionError, get_section_indexes, session_section
+from .session_cache import SessionAttendanceCache, get_session_cache
+from .streaming import iter_multipart_frames
+from .tracking import IoUTracker, iou
+
+
+def random_embeddings(n, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(n, EMBEDDING_DIM))
+    # dlib encodings sit on a sphere of radius ~1
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class RecordingFaceEncoder(StubFaceEncoder):
+    """StubFaceEncoder that records the locations of every call, failing on request."""
+
+    def __init__(self, fail=lambda locations: False):
+        self.calls = []
+        self.fail = fail
+
+    def encode(self, rgb_image, locations, num_jitters=1):
+        self.calls.append(list(locations))
+        if self.fail(locations):
+            raise RuntimeError('dlib failed')
+        return super().encode(rgb_image, locations, num_jitters)
+
+
+class EmbeddingIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = EmbeddingIndex()
+        self.vectors = random_embeddings(50)
+        for pk, vector in enumerate(self.vectors, start=1):
+            self.index.add(pk, pack_embedding(vector))
+
+    def test_distances_match_brute_force(self):
+        queries = random_embeddings(7, seed=1)
+        ids, distances = self.index.distances(queries)
+        expected = np.linalg.norm(
+            queries[:, None, :] - self.vectors[None, :, :], axis=2)
+        np.testing.assert_array_equal(ids, np.arange(1, 51))
+        # The index holds float32, so agreement is to float32 precision
+        np.testing.assert_allclose(distances, expected, atol=1e-5)
+
+    def test_match_applies_threshold(self):
+        near = self.vectors[9] + 0.01
+        far = -self.vectors[9]
+        (pk, distance), (far_pk, _) = self.index.match([near, far], 0.4)
+        self.assertEqual(pk, 10)
+        self.assertLess(distance, 0.4)
+        self.assertIsNone(far_pk)
+
+    def test_add_replaces_and_remove_drops(self):
+        self.index.add(3, pack_embedding(self.vectors[0]))
+        self.assertEqual(len(self.index), 50)
+        self.index.remove(1)
+        self.assertEqual(len(self.index), 49)
+        self.assertEqual(self.index.match([self.vectors[0]], 0.4)[0][0], 3)
+
+    def test_subset_only_searches_its_students(self):
+        subset = self.index.subset(np.arange(1, 11))
+        self.assertEqual(len(subset), 10)
+        (pk, _), (outside_pk, _) = subset.match(self.vectors[[3, 20]], 0.1)
+        self.assertEqual(pk, 4)
+        self.assertIsNone(outside_pk)
+
+    def test_empty_index(self):
+        self.assertEqual(EmbeddingIndex().match([self.vectors[0]], 0.4),
+                         [(None, None)])
+
+    def test_reranks_against_enrolled_embeddings(self):
+        # Two photos from different angles: the face matches one photo
+        # closely but is far from their average
+        profile = random_embeddings(1, seed=3)[0]
+        frontal = random_embeddings(1, seed=4)[0]
+        centroid = (profile + frontal) / 2
+        self.index.add(100, pack_embedding(centroid))
+        face = profile + 0.01
+        self.assertNotEqual(self.index.match([face], 0.4)[0][0], 100)
+
+        self.index.add(100, pack_embedding(centroid),
+                       members=[pack_embedding(profile), pack_embedding(frontal)])
+        pk, distance = self.index.match([face], 0.4)[0]
+        self.assertEqual(pk, 100)
+        self.assertAlmostEqual(distance, 0.01 * np.sqrt(EMBEDDING_DIM), places=4)
+        self.assertEqual(self.index.member_count, 2)
+
+        self.index.remove(100)
+        self.assertEqual(self.index.member_count, 0)
+
+
+class EmbeddingFormatTests(SimpleTestCase):
+    def test_round_trip_is_float32_view(self):
+        vector = random_embeddings(1)[0]
+        data = pack_embedding(vector)
+        self.assertEqual(len(data), 32 + EMBEDDING_DIM * 4)
+
+        header, decoded = unpack_embedding(data)
+        self.assertEqual(header.model, 'dlib-resnet-v1')
+        self.assertEqual(header.dim, EMBEDDING_DIM)
+        self.assertAlmostEqual(header.norm, 1.0, places=5)
+        self.assertEqual(decoded.dtype, np.float32)
+        self.assertFalse(decoded.flags.owndata)
+        np.testing.assert_allclose(decoded, vector, rtol=1e-6)
+
+    def test_reads_legacy_float64(self):
+        vector = random_embeddings(1)[0]
+        header, decoded = unpack_embedding(vector.tobytes())
+        self.assertEqual(header.version, 0)
+        self.assertEqual(header.model, 'dlib-resnet-v1')
+        np.testing.assert_allclose(decoded, vector, rtol=1e-6)
+
+    def test_rejects_other_models_and_corruption(self):
+        data = pack_embedding(random_embeddings(1)[0], model='arcface-r100')
+        with self.assertRaises(EmbeddingFormatError):
+            unpack_embedding(data, model='dlib-resnet-v1')
+        corrupted = bytearray(data)
+        corrupted[43] ^= 0x7F
+        with self.assertRaises(EmbeddingFormatError):
+            unpack_embedding(bytes(corrupted))
+        with self.assertRaises(EmbeddingFormatError):
+            EmbeddingIndex().add(1, data)
+
+
+class EmbeddingIndexSignalTests(TestCase):
+    def tearDown(self):
+        embedding_index.clear()
+
+    def test_index_follows_student_rows(self):
+        vectors = random_embeddings(2)
+        first = Student.objects.create(
+            name='A', student_id='S1', embedding=pack_embedding(vectors[0]))
+        embedding_index.load()
+        second = Student.objects.create(
+            name='B', student_id='S2', embedding=pack_embedding(vectors[1]))
+        self.assertEqual(embedding_index.match([vectors[1]], 0.4)[0][0],
+                         second.pk)
+        first.delete()
+        self.assertEqual(len(embedding_index), 1)
+
+    def test_deleting_an_enrolled_embedding_refreshes_the_student(self):
+        vectors = random_embeddings(2)
+        student = Student.objects.create(name='A', student_id='S1', embedding=b'')
+        first, second = StudentEmbedding.objects.bulk_create(
+            StudentEmbedding(student=student, embedding=pack_embedding(vector))
+            for vector in vectors)
+        student.refresh_centroid()
+        embedding_index.load()
+        self.assertEqual(embedding_index.member_count, 2)
+
+        first.delete()
+        student.refresh_from_db()
+        self.assertEqual(bytes(student.embedding), centroid_embedding([second.embedding]))
+        self.assertEqual(embedding_index.member_count, 1)
+        self.assertEqual(embedding_index.match([vectors[1]], 0.4)[0][0], student.pk)
+
+        second.delete()
+        self.assertEqual(embedding_index.member_count, 0)
+        self.assertEqual(len(embedding_index), 1)
+        student.delete()
+        self.assertEqual(len(embedding_index), 0)
+
+    def test_other_model_embeddings_are_not_indexed(self):
+        vectors = random_embeddings(2)
+        Student.objects.create(name='A', student_id='S1', embedding=pack_embedding(vectors[0]))
+        Student.objects.create(name='B', student_id='S2',
+                               embedding=pack_embedding(vectors[1], model='arcface-r100'))
+        with self.assertLogs('core.embeddings', 'WARNING'):
+            embedding_index.load()
+        self.assertEqual(len(embedding_index), 1)
+        self.assertEqual(embedding_index.rejected, 1)
+        self.assertIsNone(embedding_index.match([vectors[1]], 0.4)[0][0])
+
+
+class EmbeddingSnapshotTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'embeddings.snapshot')
+        self.settings = override_settings(EMBEDDING_SNAPSHOT={'PATH': self.path})
+        self.settings.enable()
+        self.vectors = random_embeddings(20)
+        Student.objects.bulk_create([
+            Student(name=f'S{i}', student_id=f'S{i}', embedding=pack_embedding(vector))
+            for i, vector in enumerate(self.vectors)
+        ])
+
+    def tearDown(self):
+        self.settings.disable()
+        self.tmp.cleanup()
+
+    def test_workers_map_the_snapshot_written_by_load(self):
+        writer = EmbeddingIndex()
+        writer.load()
+        self.assertTrue(os.path.exists(self.path))
+
+        reader = EmbeddingIndex()
+        # Only the signature aggregates of Student and StudentEmbedding
+        with self.assertNumQueries(2):
+            reader.ensure_loaded()
+        ids, matrix, _ = reader.state
+        self.assertIsInstance(matrix.base, np.memmap)
+        self.assertFalse(matrix.flags.writeable)
+        np.testing.assert_array_equal(ids, writer.state[0])
+        self.assertEqual(reader.match(self.vectors[:3], 0.4),
+                         writer.match(self.vectors[:3], 0.4))
+
+    def test_stale_snapshot_falls_back_to_database(self):
+        EmbeddingIndex().load()
+        Student.objects.bulk_create([
+            Student(name='New', student_id='new', embedding=pack_embedding(self.vectors[0]))])
+
+        reader = EmbeddingIndex()
+        self.assertFalse(reader.load_snapshot())
+        reader.ensure_loaded()
+        self.assertEqual(len(reader), 21)
+
+    def test_embedding_changed_without_snapshot_write_is_noticed(self):
+        EmbeddingIndex().load()
+        # Committed, but the process died before its on_commit snapshot write
+        student = Student.objects.first()
+        student.embedding = pack_embedding(self.vectors[1])
+        student.save()
+
+        reader = EmbeddingIndex()
+        self.assertFalse(reader.load_snapshot())
+
+    def test_member_changed_without_snapshot_write_is_noticed(self):
+        EmbeddingIndex().load()
+        student = Student.objects.first()
+        StudentEmbedding.objects.bulk_create([
+            StudentEmbedding(student=student, embedding=pack_embedding(self.vectors[1]))])
+
+        reader = EmbeddingIndex()
+        self.assertFalse(reader.load_snapshot())
+        reader.ensure_loaded()
+        self.assertEqual(reader.member_count, 1)
+
+        # Written with the member rows, the new snapshot is trusted again
+        self.assertTrue(EmbeddingIndex().load_snapshot())
+
+    def test_concurrent_writes_never_share_a_temp_file(self):
+        index = EmbeddingIndex()
+        index.load()
+        ids, matrix, sq_norms = index.state
+        errors = []
+
+        def write():
+            try:
+                for _ in range(10):
+                    write_snapshot(self.path, ids, matrix, sq_norms, np.empty(0, dtype=np.int64),
+                                   index._members, current_embedding_model())
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        np.testing.assert_array_equal(read_snapshot(self.path).ids, ids)
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ['embeddings.snapshot'])
+
+    def test_follows_snapshots_written_by_other_processes(self):
+        reader = EmbeddingIndex()
+        reader.ensure_loaded()
+        writer = EmbeddingIndex()
+        writer.ensure_loaded()
+
+        student = Student.objects.first()
+        writer.remove(student.pk)
+        Student.objects.filter(pk=student.pk).delete()
+        writer.save_snapshot()
+
+        reader.ensure_loaded()
+        self.assertEqual(len(reader), 19)
+        self.assertNotIn(student.pk, reader.state[0])
+
+
+class IVFMatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.index = EmbeddingIndex()
+        self.index._loaded = True
+        self.vectors = random_embeddings(2000)
+        for pk, vector in enumerate(self.vectors, start=1):
+            self.index.add(pk, pack_embedding(vector))
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'face_index.npz')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def matcher(self, **options):
+        return IVFMatcher(index=self.index, path=self.path, min_size=0,
+                          n_lists=32, **options)
+
+    def test_finds_enrolled_faces_within_threshold(self):
+        self.matcher().rebuild()
+        queries = self.vectors[::100] + 0.005
+        matches = self.matcher(n_probe=4).match(queries, 0.4)
+        self.assertEqual([pk for pk, _ in matches],
+                         list(range(1, 2001, 100)))
+        self.assertIsNone(self.matcher(n_probe=4).match([-self.vectors[0]], 0.4)[0][0])
+
+    def test_probing_every_list_is_exact(self):
+        self.matcher().rebuild()
+        queries = random_embeddings(20, seed=5)
+        approximate = self.matcher(n_probe=32).match(queries, 2.0)
+        exact = self.index.match(queries, 2.0)
+        self.assertEqual([pk for pk, _ in approximate], [pk for pk, _ in exact])
+        np.testing.assert_allclose([d for _, d in approximate],
+                                   [d for _, d in exact], rtol=1e-6)
+
+    def test_follows_roster_changes_without_rebuild(self):
+        matcher = self.matcher(n_probe=2)
+        matcher.rebuild()
+        new_vector = random_embeddings(1, seed=9)[0]
+        self.index.add(5000, pack_embedding(new_vector))
+        self.index.remove(1)
+        self.assertEqual(matcher.match([new_vector], 0.4)[0][0], 5000)
+        self.assertNotEqual(matcher.match([self.vectors[0]], 0.4)[0][0], 1)
+
+    def test_picks_up_a_partition_rebuilt_elsewhere(self):
+        self.matcher().rebuild()
+        serving = self.matcher(n_probe=1)
+        serving.match(self.vectors[:1], 0.4)
+        self.assertEqual(len(serving._centroids), 32)
+        IVFMatcher(index=self.index, path=self.path, n_lists=8).rebuild()
+        self.assertEqual(serving.match(self.vectors[:1], 0.4)[0][0], 1)
+        self.assertEqual(len(serving._centroids), 8)
+
+    def test_falls_back_to_exact_without_saved_index(self):
+        queries = self.vectors[:3]
+        self.assertEqual(self.matcher().match(queries, 0.4),
+                         self.index.match(queries, 0.4))
+
+
+class InferencePoolTests(SimpleTestCase):
+    def test_inline_pool_runs_jobs_and_records_stages(self):
+        pool = InferencePool(workers=0)
+        result = pool.run(dict, timings={'detect': 0.25})
+        self.assertEqual(result, {'timings': {'detect': 0.25}})
+        stats = pool.stats()
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['latency']['detect']['count'], 1)
+        self.assertEqual(stats['latency']['detect']['p50_ms'], 250.0)
+
+    def test_dispatch_is_round_robin_across_keys(self):
+        pool = InferencePool(workers=1)
+        for key, n in [('hall-a', 3), ('room-b', 1), ('room-c', 1)]:
+            for i in range(n):
+                job = _Job(None, (key, i), {})
+                pool._queues.setdefault(key, collections.deque()).append(job)
+                pool._waiting += 1
+        order = [pool._next_job().args for _ in range(5)]
+        self.assertEqual(order, [('hall-a', 0), ('room-b', 0), ('room-c', 0),
+                                 ('hall-a', 1), ('hall-a', 2)])
+
+    def test_full_queue_is_refused(self):
+        pool = InferencePool(workers=1, max_queue=0)
+        with self.assertRaises(InferenceQueueFull):
+            pool.submit(dict)
+
+
+class RecordAttendanceTests(TestCase):
+    def setUp(self):
+        vectors = random_embeddings(3)
+        self.students = [
+            Student.objects.create(name=f'S{i}', student_id=f'S{i}',
+                                   embedding=pack_embedding(vector))
+            for i, vector in enumerate(vectors)]
+        self.pks = {student.pk for student in self.students}
+
+    def test_bulk_marks_new_students(self):
+        AttendanceRecord.objects.create(
+            student=self.students[0], session_id='lecture-1')
+        with self.assertNumQueries(3):
+            newly, already = record_attendance(self.pks, 'lecture-1', 'tablet')
+        self.assertEqual(newly, self.pks - {self.students[0].pk})
+        self.assertEqual(already, {self.students[0].pk})
+        self.assertEqual(
+            AttendanceRecord.objects.filter(session_id='lecture-1').count(), 3)
+
+    def test_rows_a_concurrent_call_inserted_are_not_ours(self):
+        now = timezone.now()
+        bulk_create = AttendanceRecord.objects.bulk_create
+
+        def racing_bulk_create(rows, **kwargs):
+            # Another request marks the first student in the same clock tick
+            AttendanceRecord.objects.create(
+                student=self.students[0], session_id='lecture-1', timestamp=now)
+            return bulk_create(rows, **kwargs)
+
+        with mock.patch('core.attendance.timezone.now', return_value=now), \
+                mock.patch.object(AttendanceRecord.objects, 'bulk_create', racing_bulk_create):
+            newly, already = record_attendance(self.pks, 'lecture-1', 'tablet')
+        self.assertEqual(newly, self.pks - {self.students[0].pk})
+        self.assertEqual(already, {self.students[0].pk})
+
+    def test_everyone_already_marked_is_one_query(self):
+        record_attendance(self.pks, 'lecture-1', 'tablet')
+        with self.assertNumQueries(1):
+            newly, already = record_attendance(self.pks, 'lecture-1', 'tablet')
+        self.assertEqual((newly, already), (set(), self.pks))
+
+
+class SessionAttendanceCacheTests(TestCase):
+    def setUp(self):
+        self.student = Student.objects.create(
+            name='A', student_id='S1', embedding=pack_embedding(random_embeddings(1)[0]))
+
+    def test_cold_session_loads_from_database(self):
+        AttendanceRecord.objects.create(student=self.student, session_id='lab')
+        cache = SessionAttendanceCache()
+        self.assertEqual(cache.get_present('lab'), {self.student.pk})
+        with self.assertNumQueries(0):
+            cache.get_present('lab')
+
+    def test_shared_cache_is_visible_to_other_processes(self):
+        writer = SessionAttendanceCache(cache_alias='default')
+        reader = SessionAttendanceCache(cache_alias='default')
+        writer.add_present('lab', {self.student.pk})
+        with self.assertNumQueries(0):
+            self.assertEqual(reader.get_present('lab'), {self.student.pk})
+        writer.end_session('lab')
+        self.assertEqual(reader.get_present('lab'), {self.student.pk})
+        self.assertEqual(SessionAttendanceCache(cache_alias='default').get_present('lab'), set())
+
+    def test_concurrent_processes_do_not_overwrite_each_other(self):
+        shared = caches['default']
+        get = type(shared).get
+
+        def slow_get(cache, key, *args, **kwargs):
+            # Widen the window between reading the shared set and writing it back
+            value = get(cache, key, *args, **kwargs)
+            time.sleep(0.01)
+            return value
+
+        writers = [threading.Thread(
+            target=SessionAttendanceCache(cache_alias='default').add_present,
+            args=('lab-race', {pk})) for pk in range(1, 5)]
+        with mock.patch.object(type(shared), 'get', slow_get):
+            for writer in writers:
+                writer.start()
+            for writer in writers:
+                writer.join()
+        self.assertEqual(shared.get('attendance-session:lab-race'), {1, 2, 3, 4})
+        SessionAttendanceCache(cache_alias='default').end_session('lab-race')
+
+    def test_roster_reads_do_not_make_a_session_active(self):
+        AttendanceRecord.objects.create(student=self.student, session_id='lab-roster')
+        get_session_cache().clear()
+        data = self.client.get('/api/sessions/lab-roster/').json()
+        self.assertEqual(data['summary']['present'], 1)
+        self.assertFalse(get_session_cache().is_active('lab-roster'))
+
+    def test_expired_sessions_are_evicted(self):
+        cache = SessionAttendanceCache(ttl=0)
+        cache.add_present('lab', {self.student.pk})
+        self.assertEqual(cache.get_present('lab'), set())
+
+
+class MarkRecognizedFacesTests(TestCase):
+    def setUp(self):
+        self.vectors = random_embeddings(3)
+        for i, vector in enumerate(self.vectors):
+            Student.objects.create(name=f'S{i}', student_id=f'S{i}',
+                                   embedding=pack_embedding(vector))
+        embedding_index.load()
+        get_session_cache().clear()
+
+    def tearDown(self):
+        embedding_index.clear()
+        get_session_cache().clear()
+
+    def faces(self, *vectors):
+        return [{'frame': 0, 'encoding': vector,
+                 'location': {'x': 0, 'y': 0, 'width': 10, 'height': 10,
+                              'confidence': 0.9}}
+                for vector in vectors]
+
+    def test_known_present_students_skip_attendance_queries(self):
+        payload = mark_recognized_faces(
+            self.faces(self.vectors[0], self.vectors[1], -self.vectors[2]),
+            'lecture-1', 'tablet')
+        self.assertEqual(payload['summary']['newly_marked'], 2)
+        self.assertEqual(payload['summary']['unknown_faces'], 1)
+
+        # Only the student lookup remains once everyone seen is cached
+        with self.assertNumQueries(1):
+            payload = mark_recognized_faces(
+                self.faces(self.vectors[0], self.vectors[1]), 'lecture-1', 'tablet')
+        self.assertEqual(payload['summary']['already_marked'], 2)
+
+
+class SectionMatchingTests(TestCase):
+    def setUp(self):
+        self.vectors = random_embeddings(3)
+        self.students = [Student.objects.create(name=f'S{i}', student_id=f'S{i}',
+                                                embedding=pack_embedding(vector))
+                         for i, vector in enumerate(self.vectors)]
+        self.section = Section.objects.create(code='CS101')
+        self.section.students.add(*self.students[:2])
+        embedding_index.load()
+        get_session_cache().clear()
+        get_section_indexes().clear()
+
+    def tearDown(self):
+        embedding_index.clear()
+        get_session_cache().clear()
+        get_section_indexes().clear()
+
+    def faces(self, *vectors):
+        return [{'frame': 0, 'encoding': vector,
+                 'location': {'x': 0, 'y': 0, 'width': 10, 'height': 10, 'confidence': 0.9}}
+                for vector in vectors]
+
+    def test_sessions_are_bound_to_one_section(self):
+        self.assertIsNone(session_section('lecture-1'))
+        self.assertEqual(session_section('lecture-1', 'CS101'), self.section)
+        self.assertEqual(session_section('lecture-1'), self.section)
+        Section.objects.create(code='MA201')
+        with self.assertRaises(SectionError):
+            session_section('lecture-1', 'MA201')
+        with self.assertRaises(SectionError):
+            session_section('lecture-2', 'NOPE')
+
+    def test_matches_the_section_first_and_falls_back_to_everyone(self):
+        payload = mark_recognized_faces(self.faces(*self.vectors), 'lecture-1', 'tablet',
+                                        section=self.section)
+        in_section = {r['student_id']: r['in_section'] for r in payload['results']}
+        self.assertEqual(in_section, {'S0': True, 'S1': True, 'S2': False})
+
+        with override_settings(SECTION_MATCHING={'GLOBAL_FALLBACK': False}):
+            payload = mark_recognized_faces(self.faces(self.vectors[2]), 'lecture-2',
+                                            'tablet', section=self.section)
+        self.assertEqual(payload['summary']['unknown_faces'], 1)
+
+    def test_sub_index_follows_membership(self):
+        with override_settings(SECTION_MATCHING={'GLOBAL_FALLBACK': False}):
+            payload = mark_recognized_faces(self.faces(self.vectors[2]), 'lecture-1',
+                                            'tablet', section=self.section)
+            self.assertEqual(payload['summary']['unknown_faces'], 1)
+
+            response = self.client.post('/api/sections/CS101/students/',
+                                        {'student_ids': ['S2']},
+                                        content_type='application/json')
+            self.assertEqual(response.json()['students'], 3)
+            payload = mark_recognized_faces(self.faces(self.vectors[2]), 'lecture-1',
+                                            'tablet', section=self.section)
+        self.assertTrue(payload['results'][0]['in_section'])
+
+    def test_debug_log_of_an_empty_section(self):
+        empty = Section.objects.create(code='EMPTY')
+        with override_settings(SECTION_MATCHING={'GLOBAL_FALLBACK': False}):
+            with self.assertLogs('core.attendance', 'DEBUG') as logs:
+                payload = mark_recognized_faces(self.faces(self.vectors[0]), 'lecture-3',
+                                                'tablet', section=empty)
+        self.assertEqual(payload['summary']['unknown_faces'], 1)
+        self.assertIn('distance=None', logs.output[0])
+
+    def test_create_section(self):
+        response = self.client.post('/api/sections/', {
+            'code': 'PH100', 'name': 'Physics', 'student_ids': ['S0', 'S2']},
+            content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json(), {'code': 'PH100', 'name': 'Physics', 'students': 2})
+        response = self.client.post('/api/sections/', {'code': 'PH101', 'student_ids': ['S9']},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class EnrollmentTests(TestCase):
+    def setUp(self):
+        self.images = sample_images()[:3]
+
+    def upload(self, index):
+        name, data = self.images[index]
+        return SimpleUploadedFile(name, data, content_type='image/jpeg')
+
+    def test_enrolls_several_photos_and_adds_more_later(self):
+        with benchmark_environment():
+            response = self.client.post('/api/register/', {
+                'name': 'Ada', 'student_id': 'A1',
+                'photos': [self.upload(0), self.upload(1)],
+            })
+            self.assertEqual(response.status_code, 201, response.content)
+            self.assertEqual(response.json()['enrolled_photos'], 2)
+
+            student = Student.objects.get(student_id='A1')
+            members = [unpack_embedding(e)[1] for e in
+                       student.embeddings.values_list('embedding', flat=True)]
+            np.testing.assert_allclose(unpack_embedding(student.embedding)[1],
+                                       np.mean(members, axis=0), rtol=1e-5)
+            # The first photo is stored once and shared with its embedding
+            self.assertEqual(student.embeddings.first().photo.name, student.photo.name)
+
+            response = self.client.post('/api/students/A1/photos/',
+                                        {'photos': [self.upload(2)]})
+            self.assertEqual(response.status_code, 201, response.content)
+            self.assertEqual(StudentEmbedding.objects.filter(student=student).count(), 3)
+
+    @override_settings(STUDENT_PHOTOS={'MAX_SIDE': 320, 'THUMBNAIL_SIZE': 64})
+    def test_stores_capped_photos_and_a_cacheable_thumbnail(self):
+        with benchmark_environment():
+            response = self.client.post('/api/register/', {
+                'name': 'Ada', 'student_id': 'A1', 'photo': self.upload(0)})
+            self.assertEqual(response.status_code, 201, response.content)
+            student = Student.objects.get(student_id='A1')
+            self.assertTrue(is_derived(student.photo.name))
+            self.assertTrue(is_derived(student.thumbnail.name))
+            self.assertEqual(response.json()['thumbnail'], student.thumbnail.url)
+            self.assertLessEqual(max(student.photo.width, student.photo.height), 320)
+            self.assertEqual((student.thumbnail.width, student.thumbnail.height), (64, 64))
+
+            response = self.client.get(student.thumbnail.url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('immutable', response['Cache-Control'])
+            response = self.client.get(student.thumbnail.url,
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(self.client.get('/media/students/thumbs/../../db.sqlite3')
+                             .status_code, 404)
+
+    def test_backfill_converts_photos_stored_as_uploaded(self):
+        name, data = self.images[0]
+        with benchmark_environment():
+            original = default_storage.save(f'students/{name}', ContentFile(data))
+            student = Student.objects.create(name='Ada', student_id='A1', embedding=b'',
+                                              photo=original)
+            StudentEmbedding.objects.create(student=student, embedding=b'', photo=original)
+
+            call_command('backfill_student_photos', '--delete-originals',
+                         stdout=io.StringIO(), stderr=io.StringIO())
+            student.refresh_from_db()
+            self.assertTrue(is_derived(student.photo.name))
+            self.assertTrue(is_derived(student.thumbnail.name))
+            self.assertEqual(student.embeddings.get().photo.name, student.photo.name)
+            self.assertFalse(default_storage.exists(original))
+
+    @override_settings(ENROLLMENT_MAX_PHOTOS=2)
+    def test_rejects_too_many_photos(self):
+        response = self.client.post('/api/register/', {
+            'name': 'Ada', 'student_id': 'A1',
+            'photos': [self.upload(0), self.upload(1), self.upload(2)],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Student.objects.exists())
+
+
+@override_settings(BULK_ENROLLMENT={'BATCH_SIZE': 2, 'BACKGROUND': False})
+class BulkEnrollmentTests(TestCase):
+    def setUp(self):
+        self.images = sample_images()[:3]
+
+    def manifest_zip(self, rows, photos):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('term/manifest.csv', 'student_id,name,photo\n' + ''.join(
+                f'{student_id},{name},{photo}\n' for student_id, name, photo in rows))
+            for name, data in photos:
+                archive.writestr(f'term/{name}', data)
+        return SimpleUploadedFile('term.zip', buffer.getvalue(), content_type='application/zip')
+
+    def test_imports_a_zip_and_reports_item_errors(self):
+        (first, first_data), (second, second_data), (third, third_data) = self.images
+        Student.objects.create(name='Existing', student_id='B6', embedding=b'')
+        upload = self.manifest_zip([
+            ('B1', 'Ada', first), ('B2', 'Grace', second), ('B3', 'Edsger', 'missing.jpg'),
+            ('B1', 'Ada again', third), ('B4', 'Alan', 'notes.txt'), ('B5', '', third),
+            ('B6', 'Existing', third),
+        ], [(first, first_data), (second, second_data), (third, third_data),
+            ('notes.txt', b'not a photo')])
+
+        with benchmark_environment():
+            response = self.client.post('/api/enrollment-jobs/', {'manifest': upload})
+            self.assertEqual(response.status_code, 202, response.content)
+            job = response.json()
+            self.assertEqual((job['status'], job['total'], job['enrolled'], job['failed']),
+                             ('done', 7, 2, 5))
+
+            response = self.client.get(f"/api/enrollment-jobs/{job['id']}/")
+        errors = {item['line']: item['error'] for item in response.json()['results']}
+        self.assertEqual(errors[4], 'Photo not found: missing.jpg')
+        self.assertEqual(errors[5], 'Duplicate of line 2')
+        self.assertIn('name', errors[7])
+        self.assertEqual(errors[8], 'Student already exists')
+        self.assertIn(6, errors)
+
+        student = Student.objects.get(student_id='B2')
+        self.assertEqual(student.name, 'Grace')
+        self.assertEqual(student.embeddings.get().photo.name, student.photo.name)
+
+    def test_resumes_after_a_failure(self):
+        (first, first_data), (second, second_data), _ = self.images
+        upload = self.manifest_zip([('B1', 'Ada', first), ('B2', 'Grace', second)],
+                                   [(first, first_data), (second, second_data)])
+        with benchmark_environment():
+            job = create_job(upload)
+            path = job.source.path
+            os.rename(path, path + '.offline')
+            job = run_job(job)
+            self.assertEqual(job.status, EnrollmentJob.FAILED)
+            self.assertEqual(job.items.filter(status='pending').count(), 2)
+
+            os.rename(path + '.offline', path)
+            job = run_job(job)
+        self.assertEqual(job.status, EnrollmentJob.DONE)
+        self.assertEqual(Student.objects.filter(student_id__in=['B1', 'B2']).count(), 2)
+
+    def test_command_imports_a_csv_next_to_its_photos(self):
+        name, data = self.images[0]
+        with tempfile.TemporaryDirectory() as tmp, benchmark_environment():
+            with open(os.path.join(tmp, name), 'wb') as f:
+                f.write(data)
+            manifest = os.path.join(tmp, 'manifest.csv')
+            with open(manifest, 'w') as f:
+                f.write(f'student_id,name,photo\nC1,Ada,{name}\nC2,Alan,../etc/passwd\n')
+            output = io.StringIO()
+            call_command('enroll_students', manifest, stdout=output, stderr=io.StringIO())
+        progress = json.loads(output.getvalue())
+        self.assertEqual((progress['enrolled'], progress['failed']), (1, 1))
+        self.assertTrue(Student.objects.filter(student_id='C1').exists())
+
+
+class IoUTrackerTests(SimpleTestCase):
+    def test_iou(self):
+        overlaps = iou([[0, 0, 10, 10]], [[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]])
+        np.testing.assert_allclose(overlaps, [[1.0, 1 / 3, 0.0]])
+
+    def test_boxes_keep_their_track_across_frames(self):
+        tracker = IoUTracker(max_misses=1)
+        first = tracker.update([[0, 0, 10, 10], [50, 50, 60, 60]])
+        second = tracker.update([[52, 51, 62, 61], [1, 1, 11, 11], [100, 0, 110, 10]])
+        self.assertEqual([t.track_id for t in second], [first[1].track_id,
+                                                        first[0].track_id, 3])
+
+        # Dropped once unmatched for more than max_misses frames
+        tracker.update([[100, 0, 110, 10]])
+        tracker.update([[100, 0, 110, 10]])
+        self.assertEqual([t.track_id for t in tracker.tracks], [3])
+
+    def test_only_new_or_unidentified_tracks_are_encoded(self):
+        tracker = IoUTracker(retry_interval=2, max_attempts=2)
+        known, unknown = tracker.update([[0, 0, 10, 10], [50, 50, 60, 60]])
+        self.assertEqual(len(tracker.select_for_encoding()), 2)
+        tracker.identify(known.track_id, 7, 0.3)
+
+        selected = []
+        for _ in range(5):
+            tracker.update([[0, 0, 10, 10], [50, 50, 60, 60]])
+            selected.append([t.track_id for t in tracker.select_for_encoding()])
+        # Retried every other frame until max_attempts, never once identified
+        self.assertEqual(selected, [[], [unknown.track_id], [], [], []])
+
+
+class FaceEncodingTests(SimpleTestCase):
+    def test_face_locations_are_padded_and_clipped_to_the_image(self):
+        boxes = np.array([[20, 10, 70, 110], [5, 2, 95, 58]], dtype=np.float32)
+        self.assertEqual(face_locations(boxes, (60, 100, 3)),
+                         [(0, 75, 59, 15), (0, 99, 59, 0)])
+        # (x1, y1, x2, y2) -> (top, right, bottom, left), padded by 10% a side
+        self.assertEqual(face_locations(boxes[:1], (200, 200, 3)), [(0, 75, 120, 15)])
+        self.assertEqual(face_locations(boxes[:1], (200, 200, 3), padding=0),
+                         [(10, 70, 110, 20)])
+
+    def test_all_boxes_go_to_one_encoder_call(self):
+        image = np.random.default_rng(0).integers(0, 255, size=(120, 160, 3), dtype=np.uint8)
+        boxes = np.array([[10, 10, 50, 60], [60, 20, 110, 80], [100, 40, 150, 110]],
+                         dtype=np.float32)
+        encoder = RecordingFaceEncoder()
+        with mock.patch.object(model_registry, 'encoder', return_value=encoder):
+            encodings = encode_faces(image, boxes)
+            self.assertEqual(encode_faces(image, boxes[:0]), [])
+        self.assertEqual(encoder.calls, [face_locations(boxes, image.shape)])
+        self.assertEqual(len(encodings), 3)
+        self.assertEqual([encoding.shape for encoding in encodings], [(EMBEDDING_DIM,)] * 3)
+
+
+class QualityGateTests(SimpleTestCase):
+    def setUp(self):
+        # Textured and mirror-symmetric, like a sharp frontal face
+        half = np.random.default_rng(0).integers(0, 255, size=(200, 100, 3), dtype=np.uint8)
+        self.image = np.concatenate([half, half[:, ::-1]], axis=1)
+        self.box = np.array([40, 20, 160, 170], dtype=np.float32)
+
+    def test_reasons(self):
+        self.assertIsNone(assess_face(self.image, self.box, 0.9).reason)
+        self.assertEqual(assess_face(self.image, self.box, 0.3).reason, 'low_confidence')
+        self.assertEqual(assess_face(self.image, [90, 90, 110, 115], 0.9).reason, 'too_small')
+        self.assertEqual(assess_face(self.image, [0, 50, 200, 120], 0.9).reason, 'pose')
+        blurred = cv2.GaussianBlur(self.image, (0, 0), 8)
+        self.assertEqual(assess_face(blurred, self.box, 0.9).reason, 'blurry')
+
+        turned = self.image.copy()
+        turned[:, 100:] = 0
+        self.assertEqual(assess_face(turned, self.box, 0.9).reason, 'pose')
+
+    @override_settings(FACE_QUALITY={'MAX_FACES': 1})
+    def test_budget_keeps_the_most_promising_faces(self):
+        boxes = np.array([[90, 90, 110, 115], self.box, self.box + 2])
+        detections = [(boxes, np.array([0.9, 0.6, 0.95], dtype=np.float32))]
+        with benchmark_environment():
+            faces, skipped = extract_faces([self.image], detections)
+        self.assertEqual(len(faces), 1)
+        self.assertAlmostEqual(faces[0]['location']['confidence'], 0.95, places=5)
+        self.assertEqual([face['reason'] for face in skipped], ['too_small', 'budget'])
+
+    def test_faces_of_an_image_are_encoded_in_one_call(self):
+        boxes = np.array([self.box, self.box + 2])
+        detections = [(boxes, np.array([0.9, 0.8], dtype=np.float32))] * 2
+        encoder = RecordingFaceEncoder()
+        with mock.patch.object(model_registry, 'encoder', return_value=encoder):
+            faces, skipped = extract_faces([self.image, self.image], detections)
+        self.assertEqual([len(locations) for locations in encoder.calls], [2, 2])
+        self.assertEqual([face['frame'] for face in faces], [0, 0, 1, 1])
+        self.assertEqual(skipped, [])
+
+    def test_a_failed_call_is_retried_face_by_face(self):
+        boxes = np.array([self.box, self.box + 2])
+        detections = [(boxes, np.array([0.9, 0.8], dtype=np.float32))]
+        bad = face_locations(boxes[1:], self.image.shape)[0]
+        encoder = RecordingFaceEncoder(fail=lambda locations: bad in locations)
+        with mock.patch.object(model_registry, 'encoder', return_value=encoder):
+            faces, skipped = extract_faces([self.image], detections)
+        self.assertEqual([len(locations) for locations in encoder.calls], [2, 1, 1])
+        self.assertEqual(len(faces), 1)
+        self.assertEqual([face['reason'] for face in skipped], ['encoding_failed'])
+
+    @override_settings(FACE_QUALITY={'ENCODE_BUDGET_SECONDS': 0.0})
+    def test_time_budget_is_checked_between_calls(self):
+        boxes = np.array([self.box])
+        detections = [(boxes, np.array([0.9], dtype=np.float32))] * 2
+        with benchmark_environment():
+            faces, skipped = extract_faces([self.image, self.image], detections)
+        self.assertEqual(faces, [])
+        self.assertEqual([face['reason'] for face in skipped], ['budget', 'budget'])
+
+    def test_detector_noise_is_dropped_not_reported(self):
+        boxes = np.array([self.box, self.box + 2])
+        detections = [(boxes, np.array([0.2, 0.9], dtype=np.float32))]
+        with benchmark_environment():
+            faces, skipped = extract_faces([self.image], detections)
+            self.assertEqual((len(faces), skipped), (1, []))
+            with override_settings(FACE_QUALITY={'MIN_CONFIDENCE': 0.1}):
+                faces, skipped = extract_faces([self.image], detections)
+        self.assertEqual(len(faces), 2)
+
+
+class StreamingTests(TestCase):
+    def mjpeg(self, frames, boundary='frame'):
+        body = b'preamble\r\n'
+        for frame in frames:
+            body += (f'--{boundary}\r\nContent-Type: image/jpeg\r\n'
+                     f'Content-Length: {len(frame)}\r\n\r\n').encode() + frame + b'\r\n'
+        return body + f'--{boundary}--\r\n'.encode()
+
+    def test_splits_parts_on_the_boundary(self):
+        frames = [b'\xff\xd8one\r\n\xff\xd9', b'\xff\xd8two\xff\xd9']
+        parsed = list(iter_multipart_frames(io.BytesIO(self.mjpeg(frames)), 'frame'))
+        self.assertEqual(parsed, frames)
+
+        # A feed cut off mid-stream still yields its last complete frame
+        truncated = self.mjpeg(frames)[:-len('--frame--\r\n')]
+        self.assertEqual(list(iter_multipart_frames(io.BytesIO(truncated), 'frame')), frames)
+
+    @override_settings(STREAM_RECOGNITION={'MAX_FPS': 0})
+    def test_stream_encodes_each_track_once_and_marks_attendance(self):
+        name, data = sample_images()[0]
+        with benchmark_environment():
+            response = self.client.post('/api/register/', {
+                'name': 'Ada', 'student_id': 'A1',
+                'photo': SimpleUploadedFile(name, data, content_type='image/jpeg'),
+            })
+            self.assertEqual(response.status_code, 201, response.content)
+
+            response = self.client.post(
+                '/api/sessions/lecture-1/stream/', self.mjpeg([data] * 4),
+                content_type='multipart/x-mixed-replace; boundary=frame')
+            self.assertEqual(response.status_code, 200)
+            events = [json.loads(line) for line in
+                      b''.join(response.streaming_content).splitlines()]
+
+        frames, summary = events[:-1], events[-1]
+        self.assertEqual([e['encoded'] for e in frames], [1, 0, 0, 0])
+        self.assertEqual(frames[0]['newly_marked'], [{'student_id': 'A1', 'name': 'Ada'}])
+        self.assertEqual(frames[3]['tracks'][0]['student_id'], 'A1')
+        self.assertEqual(summary['processed'], 4)
+        self.assertEqual(summary['newly_marked'], 1)
+        self.assertTrue(AttendanceRecord.objects.filter(
+            session_id='lecture-1', student__student_id='A1').exists())
+
+    def test_rejects_other_content_types(self):
+        response = self.client.post('/api/sessions/lecture-1/stream/', b'{}',
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 415)
+
+
+class BatchRecognitionTests(TestCase):
+    def tearDown(self):
+        embedding_index.clear()
+
+    def test_student_in_several_frames_is_reported_once_at_the_closest_match(self):
+        vector, offset = random_embeddings(2)
+        offset -= (offset @ vector) * vector
+        offset /= np.linalg.norm(offset)
+        # Frames in upload order match at distances 0.3, 0.1 and 0.2
+        encodings = iter([vector + distance * offset for distance in (0.3, 0.1, 0.2)])
+
+        class FrameEncoder:
+            def encode(self, rgb_image, locations, num_jitters=1):
+                return [next(encodings) for _ in locations]
+
+        name, data = sample_images()[0]
+        with benchmark_environment():
+            Student.objects.create(name='Ada', student_id='A1', embedding=pack_embedding(vector))
+            embedding_index.clear()
+            with mock.patch.object(model_registry, 'encoder', return_value=FrameEncoder()):
+                response = self.client.post('/api/recognize/batch/', {
+                    'images': [SimpleUploadedFile(f'{i}-{name}', data, content_type='image/jpeg')
+                               for i in range(3)],
+                    'session_id': 'lecture-1'})
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertEqual(len(data['results']), 1)
+        result = data['results'][0]
+        self.assertEqual((result['student_id'], result['frame']), ('A1', 1))
+        self.assertAlmostEqual(result['distance'], 0.1, places=5)
+        self.assertEqual(data['summary']['frames'], 3)
+        self.assertEqual(data['summary']['newly_marked'], 1)
+        self.assertEqual(AttendanceRecord.objects.filter(session_id='lecture-1').count(), 1)
+
+
+class AttendanceReportTests(TestCase):
+    def setUp(self):
+        self.students = [Student.objects.create(name=f'S{i}', student_id=f'S{i}',
+                                                embedding=b'') for i in range(3)]
+        day = timezone.make_aware(datetime.datetime(2026, 3, 2, 9, 0))
+        attendance = [(0, 'mon', 0), (1, 'mon', 5), (0, 'tue', 24 * 60), (2, 'tue', 24 * 60 + 1)]
+        for student, session_id, minutes in attendance:
+            AttendanceRecord.objects.create(
+                student=self.students[student], session_id=session_id,
+                timestamp=day + datetime.timedelta(minutes=minutes), recognized_by='camera')
+
+    def test_session_roster_is_paginated_in_arrival_order(self):
+        # COUNT, the page, the session's section, and the enrolled total
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/attendance/sessions/mon/?page_size=1')
+        data = response.json()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual([row['student_code'] for row in data['results']], ['S0'])
+        self.assertIsNotNone(data['next'])
+        self.assertEqual(data['summary'], {'present': 2, 'enrolled': 3, 'section': None})
+
+    def test_session_of_a_section_counts_its_students(self):
+        section = Section.objects.create(code='CS101')
+        section.students.add(*self.students[:2])
+        ClassSession.objects.create(session_id='mon', section=section)
+        data = self.client.get('/api/attendance/sessions/mon/').json()
+        self.assertEqual(data['summary'], {'present': 2, 'enrolled': 2, 'section': 'CS101'})
+
+    def test_roster_of_a_section_session_lists_only_its_students(self):
+        cs101, cs102 = Section.objects.create(code='CS101'), Section.objects.create(code='CS102')
+        cs101.students.add(*self.students[:2])
+        cs102.students.add(self.students[2])
+        ClassSession.objects.create(session_id='mon', section=cs101)
+        get_session_cache().clear()
+        data = self.client.get('/api/sessions/mon/').json()
+        self.assertEqual(data['section'], 'CS101')
+        self.assertEqual([row['student_id'] for row in data['present']], ['S0', 'S1'])
+        self.assertEqual(data['absent'], [])
+        self.assertEqual(data['summary'], {'present': 2, 'absent': 0, 'total': 2})
+
+        data = self.client.get('/api/sessions/tue/').json()
+        self.assertIsNone(data['section'])
+        self.assertEqual([row['student_id'] for row in data['absent']], ['S1'])
+        self.assertEqual(data['summary']['total'], 3)
+
+    def test_student_history_in_range(self):
+        data = self.client.get('/api/attendance/students/S0/?from=2026-03-03').json()
+        self.assertEqual([row['session_id'] for row in data['results']], ['tue'])
+        self.assertEqual(data['summary']['sessions'], 1)
+
+        data = self.client.get('/api/attendance/students/S0/?to=2026-03-03').json()
+        self.assertEqual([row['session_id'] for row in data['results']], ['tue', 'mon'])
+        self.assertEqual(self.client.get('/api/attendance/students/nobody/').status_code, 404)
+
+    def test_summaries(self):
+        rows = self.client.get('/api/attendance/summary/?group=student').json()['results']
+        self.assertEqual([(row['student_code'], row['present']) for row in rows],
+                         [('S0', 2), ('S1', 1), ('S2', 1)])
+        rows = self.client.get('/api/attendance/summary/?group=day&from=2026-03-02'
+                               '&to=2026-03-02').json()['results']
+        self.assertEqual([(row['day'], row['present'], row['sessions']) for row in rows],
+                         [('2026-03-02', 2, 1)])
+        self.assertEqual(self.client.get('/api/attendance/summary/?group=week').status_code, 400)
+        self.assertEqual(self.client.get('/api/attendance/summary/?from=soon').status_code, 400)
+
+    def test_csv_export_streams_every_record(self):
+        response = self.client.get('/api/attendance/export/?session_id=tue')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'student_id,name,session_id,timestamp,recognized_by')
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['S0', 'S2'])
+
+
+class InferenceCacheTests(TestCase):
+    def setUp(self):
+        caches['inference'].clear()
+        self.name, self.data = sample_images()[0]
+
+    def upload(self):
+        return SimpleUploadedFile(self.name, self.data, content_type='image/jpeg')
+
+    def test_key_follows_content_and_pipeline(self):
+        key = cache_key(analyze_images, ([self.data],), {})
+        self.assertEqual(key, cache_key(analyze_images, ([bytes(self.data)],), {}))
+        self.assertNotEqual(key, cache_key(analyze_images, ([self.data + b'\0'],), {}))
+        with override_settings(FACE_QUALITY={'MIN_FACE_SIZE': 80}):
+            self.assertNotEqual(key, cache_key(analyze_images, ([self.data],), {}))
+
+    def test_repeated_uploads_skip_inference(self):
+        with benchmark_environment(), override_settings(
+                INFERENCE_CACHE={'ENABLED': True, 'CACHE_ALIAS': 'inference'}):
+            hits = inference_cache_lookups.value(result='hit')
+            for student_id in ('A1', 'A2'):
+                response = self.client.post('/api/register/', {
+                    'name': 'Ada', 'student_id': student_id, 'photo': self.upload()})
+                self.assertEqual(response.status_code, 201, response.content)
+            self.assertEqual(inference_cache_lookups.value(result='hit'), hits + 1)
+
+            timings = []
+            for _ in range(2):
+                response = self.client.post('/api/recognize/?timings=1', {
+                    'image': self.upload(), 'session_id': 'lecture-1'})
+                self.assertEqual(response.status_code, 200, response.content)
+                timings.append(response.json()['timings'])
+        self.assertIn('detect', timings[0])
+        self.assertNotIn('detect', timings[1])
+        self.assertIn('inference_cache', timings[1])
+
+    @override_settings(FACE_QUALITY={'ENCODE_BUDGET_SECONDS': 0.0})
+    def test_results_cut_short_are_not_cached(self):
+        with benchmark_environment(), override_settings(
+                INFERENCE_CACHE={'ENABLED': True, 'CACHE_ALIAS': 'inference'}):
+            caches['inference'].clear()
+            results = [run_cached(analyze_images, [self.data]) for _ in range(2)]
+            self.assertIsNone(peek_cached(analyze_images, [self.data]))
+        self.assertEqual([face['reason'] for face in results[0]['skipped']], ['budget'])
+        self.assertIn('detect', results[1]['timings'])
+
+
+class AdmissionControlTests(TestCase):
+    def setUp(self):
+        admission._controller = None
+
+    def tearDown(self):
+        admission._controller = None
+
+    def in_thread(self, controller, priority):
+        outcome = {}
+
+        def admit():
+            try:
+                outcome['permit'] = controller.admit(priority=priority)
+            except AdmissionRejected as e:
+                outcome['rejected'] = e
+        thread = threading.Thread(target=admit)
+        thread.start()
+        return thread, outcome
+
+    def wait_for_waiters(self, controller, count):
+        deadline = time.monotonic() + 2
+        while controller.stats()['waiting'] != count and time.monotonic() < deadline:
+            time.sleep(0.005)
+        self.assertEqual(controller.stats()['waiting'], count)
+
+    def test_queues_then_sheds_and_prefers_sessions_in_progress(self):
+        controller = AdmissionController(max_in_flight=1, max_waiting=1, max_wait=2.0,
+                                         service_time=0.5)
+        permit = controller.admit()
+        new_session, new_outcome = self.in_thread(controller, priority=False)
+        self.wait_for_waiters(controller, 1)
+
+        with self.assertRaises(AdmissionRejected) as rejected:
+            controller.admit()
+        self.assertEqual((rejected.exception.status, rejected.exception.reason),
+                         (429, 'queue_full'))
+        # One running and one waiting, half a second each on one slot
+        self.assertEqual(rejected.exception.retry_after, 1)
+
+        # A session in progress takes the place of the new one
+        in_progress, priority_outcome = self.in_thread(controller, priority=True)
+        new_session.join(2)
+        self.assertEqual(new_outcome['rejected'].reason, 'displaced')
+        self.wait_for_waiters(controller, 1)
+
+        with permit:
+            pass
+        in_progress.join(2)
+        with priority_outcome['permit']:
+            self.assertEqual(controller.stats()['in_flight'], 1)
+        self.assertEqual(controller.stats()['in_flight'], 0)
+
+    def test_sheds_early_from_the_measured_service_time(self):
+        controller = AdmissionController(max_in_flight=1, max_waiting=8, max_wait=1.0,
+                                         service_time=0.1, smoothing=0.5)
+        controller.admit()
+        controller.release(3.1)
+        self.assertAlmostEqual(controller.service_time, 1.6)
+
+        permit = controller.admit()
+        with self.assertRaises(AdmissionRejected) as rejected:
+            controller.admit()
+        self.assertEqual((rejected.exception.status, rejected.exception.reason),
+                         (503, 'overloaded'))
+        self.assertEqual(rejected.exception.retry_after, 2)
+        with permit:
+            pass
+
+    @override_settings(ADMISSION_CONTROL={'MAX_IN_FLIGHT': 1, 'MAX_WAITING': 0})
+    def test_recognize_returns_retry_after_when_saturated(self):
+        caches['inference'].clear()
+        name, data = sample_images()[0]
+        with get_admission_controller().admit():
+            response = self.client.post('/api/recognize/', {
+                'image': SimpleUploadedFile(name, data, content_type='image/jpeg'),
+                'session_id': 'lecture-1'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_cached_uploads_need_no_slot(self):
+        caches['inference'].clear()
+        name, data = sample_images()[0]
+        with benchmark_environment(), override_settings(
+                INFERENCE_CACHE={'ENABLED': True, 'CACHE_ALIAS': 'inference'},
+                ADMISSION_CONTROL={'MAX_IN_FLIGHT': 1, 'MAX_WAITING': 0}):
+            Student.objects.create(name='Ada', student_id='A1', embedding=pack_embedding(
+                random_embeddings(1)[0]))
+
+            def recognize():
+                return self.client.post('/api/recognize/', {
+                    'image': SimpleUploadedFile(name, data, content_type='image/jpeg'),
+                    'session_id': 'lecture-1'})
+
+            self.assertEqual(recognize().status_code, 200)
+            controller = get_admission_controller()
+            service_time = controller.service_time
+            with controller.admit():
+                self.assertEqual(recognize().status_code, 200)
+                self.assertEqual(controller.service_time, service_time)
+
+
+class DebugCaptureTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.image = np.random.default_rng(0).integers(
+            0, 255, size=(120, 160, 3), dtype=np.uint8)
+        self.boxes = np.array([[10, 10, 60, 70]])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_off_writes_nothing(self):
+        capture = DebugCapture(mode='off', directory=self.tmp.name)
+        self.assertFalse(capture.capture(self.image, self.boxes))
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_sampled_captures_one_in_n(self):
+        capture = DebugCapture(mode='sampled', sample_rate=3, directory=self.tmp.name)
+        captured = [capture.capture(self.image, self.boxes, tag='Flutter App')
+                    for _ in range(6)]
+        capture.flush()
+        self.assertEqual(captured, [True, False, False, True, False, False])
+        names = sorted(os.listdir(self.tmp.name))
+        self.assertEqual(len(names), 4)
+        self.assertTrue(all(name.endswith('flutter-app.jpg') or '_flutter-app_' in name
+                            for name in names))
+
+    def test_retention_keeps_directory_under_budget(self):
+        capture = DebugCapture(mode='full', directory=self.tmp.name, max_bytes=20000)
+        for _ in range(5):
+            capture.capture(self.image, self.boxes)
+            capture.flush()
+        total = sum(os.path.getsize(os.path.join(self.tmp.name, name))
+                    for name in os.listdir(self.tmp.name))
+        self.assertLessEqual(total, 20000)
+        self.assertGreater(total, 0)
+
+    def test_retention_leaves_other_files_alone(self):
+        sample = os.path.join(self.tmp.name, 'face_1746886263_Flutter Mobile App.jpg')
+        with open(sample, 'wb') as f:
+            f.write(b'\0' * 50000)
+        capture = DebugCapture(mode='full', directory=self.tmp.name, max_bytes=20000)
+        for _ in range(3):
+            capture.capture(self.image, self.boxes, tag='x')
+            capture.flush()
+        self.assertTrue(os.path.exists(sample))
+        self.assertGreater(len(os.listdir(self.tmp.name)), 1)
+
+
+class PreprocessingTests(SimpleTestCase):
+    def encode(self, width, height, ext='.jpg'):
+        image = np.zeros((height, width, 3), dtype=np.uint8)
+        image[:, :width // 2] = (0, 0, 255)  # left half red in BGR
+        return cv2.imencode(ext, image)[1].tobytes()
+
+    def test_large_jpeg_is_decoded_reduced(self):
+        prepared = load_image(self.encode(4000, 3000), max_side=1000)
+        self.assertEqual(prepared.rgb.shape, (750, 1000, 3))
+        self.assertEqual(prepared.scale, 4.0)
+        self.assertEqual(prepared.original_size, (4000, 3000))
+        # RGB order: red channel first
+        self.assertGreater(prepared.rgb[10, 10, 0], 200)
+
+    def test_png_is_resized_to_working_resolution(self):
+        prepared = load_image(self.encode(3000, 1500, '.png'), max_side=1000)
+        self.assertEqual(prepared.rgb.shape, (500, 1000, 3))
+        self.assertEqual(prepared.scale, 3.0)
+
+    def test_small_image_is_untouched(self):
+        prepared = load_image(self.encode(640, 480), max_side=1000)
+        self.assertEqual(prepared.rgb.shape, (480, 640, 3))
+        self.assertEqual(prepared.scale, 1.0)
+
+    def test_non_image_is_rejected(self):
+        with self.assertRaisesMessage(ImageRejected, 'Invalid image format'):
+            inspect_image(b'%PDF-1.4 not a photo')
+
+    @override_settings(IMAGE_PREPROCESSING={'MAX_UPLOAD_BYTES': 1000})
+    def test_oversized_upload_is_rejected_before_decoding(self):
+        with self.assertRaises(ImageRejected):
+            inspect_image(b'\xff' * 1001)
+
+    @override_settings(IMAGE_PREPROCESSING={'MAX_PIXELS': 1000 * 1000})
+    def test_oversized_resolution_is_rejected(self):
+        with self.assertRaisesMessage(ImageRejected, 'resolution'):
+            inspect_image(self.encode(2000, 1000))
+
+
+class MetricsTests(SimpleTestCase):
+    def test_text_exposition(self):
+        registry = Registry()
+        requests = registry.register(Counter('rtms_requests', 'Requests.', ['status']))
+        stage = registry.register(Histogram('rtms_stage_seconds', 'Stage time.', ['stage'],
+                                            buckets=(0.1, 1.0)))
+        registry.register(Gauge('rtms_roster_size', 'Roster.', callback=lambda: 42))
+
+        requests.inc(status=200)
+        requests.inc(2, status=200)
+        stage.observe(0.05, stage='detect')
+        stage.observe(0.5, stage='detect')
+        stage.observe(5.0, stage='detect')
+
+        text = registry.render()
+        self.assertIn('# TYPE rtms_requests counter', text)
+        self.assertIn('rtms_requests_total{status="200"} 3', text)
+        self.assertIn('rtms_stage_seconds_bucket{stage="detect",le="0.1"} 1', text)
+        self.assertIn('rtms_stage_seconds_bucket{stage="detect",le="1.0"} 2', text)
+        self.assertIn('rtms_stage_seconds_bucket{stage="detect",le="+Inf"} 3', text)
+        self.assertIn('rtms_stage_seconds_sum{stage="detect"} 5.55', text)
+        self.assertIn('rtms_stage_seconds_count{stage="detect"} 3', text)
+        self.assertIn('rtms_roster_size 42', text)
+
+    def test_labels_are_validated(self):
+        counter = Counter('rtms_things', 'Things.', ['kind'])
+        with self.assertRaises(ValueError):
+            counter.inc(other='x')
+
+
+class AttendanceLoadtestTests(SimpleTestCase):
+    def test_concurrent_sessions_mark_the_whole_roster(self):
+        # A process of its own: the command creates and destroys its own test database
+        output = subprocess.run(
+            [sys.executable, 'manage.py', 'loadtest_attendance', '--sessions', '1,2',
+             '--students', '10'],
+            cwd=settings.BASE_DIR, check=True, capture_output=True, text=True,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'config.settings'}).stdout
+        results = json.loads(output)
+        for sessions in (1, 2):
+            level = results['levels'][str(sessions)]
+            self.assertEqual(level['errors'], 0, level['error_samples'])
+            self.assertEqual(level['records'], 10 * sessions)
+            self.assertEqual(level['writes'], 2 * sessions)
+
+
+class BenchmarkTests(TestCase):
+    def test_stub_pipeline_round_trip(self):
+        results = run_benchmark(roster_sizes=[50], iterations=2, faces_per_image=2)
+
+        roster = results['rosters']['50']
+        self.assertEqual(roster['register']['statuses'], {201: 2})
+        self.assertEqual(roster['recognize']['statuses'], {200: 2})
+        self.assertEqual(roster['recognize']['latency']['count'], 2)
+        self.assertIn('match', roster['recognize']['stages'])
+        self.assertIn('detect', roster['recognize']['stages'])
+        self.assertFalse(Student.objects.exists())
+
+    def test_layout_benchmark_runs_stub_workers(self):
+        results = run_layout_benchmark(layouts=[(1, 1)], requests=3, images=sample_images()[:1])
+        layout, = results['layouts']
+        self.assertEqual((layout['workers'], layout['threads']), (1, 1))
+        self.assertEqual(layout['latency']['count'], 3)
+        self.assertEqual(results['best'], {'workers': 1, 'threads': 1})
+
+    def test_default_layouts_split_the_cores(self):
+        self.assertEqual(default_layouts(8), [(1, 8), (2, 4), (4, 2), (8, 1), (8, 8)])
+        self.assertEqual(default_layouts(6), [(1, 6), (2, 3), (4, 1), (6, 1), (6, 6)])
+        self.assertEqual(default_layouts(1), [(1, 1)])
+
+    def test_stub_encoder_is_deterministic(self):
+        rgb = np.random.default_rng(0).integers(0, 255, (120, 160, 3), dtype=np.uint8)
+        first = StubFaceEncoder().encode(rgb, [(10, 80, 90, 20)])
+        second = StubFaceEncoder().encode(rgb.copy(), [(10, 80, 90, 20)])
+        np.testing.assert_array_equal(first[0], second[0])
+        self.assertAlmostEqual(float(np.linalg.norm(first[0])), 1.0)
+
+
+STUB_MODELS = {
+    'DETECTOR': {'BACKEND': 'core.benchmark.StubFaceDetector',
+                 'OPTIONS': {'faces_per_image': 2}},
+    'ENCODER': {'BACKEND': 'core.benchmark.StubFaceEncoder'},
+}
+
+
+class ModelRegistryTests(SimpleTestCase):
+    @override_settings(FACE_MODELS=STUB_MODELS)
+    def test_loads_each_model_once_on_first_use(self):
+        registry = ModelRegistry()
+        self.assertEqual(registry.loaded, [])
+        detector = registry.detector()
+        self.assertIs(registry.detector(), detector)
+        self.assertEqual(detector.faces_per_image, 2)
+        self.assertEqual(registry.loaded, ['DETECTOR'])
+
+        registry.warmup()
+        self.assertEqual(registry.loaded, ['DETECTOR', 'ENCODER'])
+
+    def test_missing_weights_are_reported_before_importing_torch(self):
+        with self.assertRaises(ImproperlyConfigured):
+            YOLOFaceDetector(weights='/nonexistent/yolov8n-face.pt')
+
+    def test_unknown_export_format_is_refused(self):
+        with tempfile.NamedTemporaryFile(suffix='.pt') as weights:
+            with self.assertRaises(ImproperlyConfigured):
+                YOLOFaceDetector(weights=weights.name, export='tflite')
+
+    def test_pool_workers_do_not_start_pools_of_their_own(self):
+        script = ("from core import inference; inference._init_worker(); "
+                  "print(inference.in_worker(), inference._pool)")
+        output = subprocess.run(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR, check=True,
+            capture_output=True, text=True,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'config.settings',
+                 'RTMS_WARMUP': '1', 'FACE_DETECTOR_WEIGHTS': '/nonexistent/yolov8n-face.pt'},
+        ).stdout
+        # The missing weights are logged rather than raised from the initializer
+        self.assertEqual(output.strip(), 'True None')
+
+    def test_management_commands_do_not_import_models(self):
+        script = ("import sys, django; django.setup(); "
+                  "import core.views, core.urls; "
+                  "print(sorted(m for m in ('torch', 'ultralytics', 'face_recognition') "
+                  "if m in sys.modules))")
+        output = subprocess.run(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR, check=True,
+            capture_output=True, text=True,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'config.settings'}).stdout
+        self.assertEqual(output.strip(), '[]')
+
+
+class RuntimeTests(SimpleTestCase):
+    @override_settings(INFERENCE_POOL={'WORKERS': 2}, INFERENCE_RUNTIME={})
+    def test_cores_are_shared_among_pool_workers(self):
+        with mock.patch('os.cpu_count', return_value=8):
+            self.assertEqual(runtime.thread_settings(workers=2),
+                             {'threads': 4, 'interop_threads': 1, 'opencv_threads': 4})
+            self.assertEqual(runtime.thread_settings(workers=0)['threads'], 8)
+            self.assertEqual(runtime.thread_settings(workers=16)['threads'], 1)
+            # Web processes only match embeddings, beside the workers
+            self.assertEqual(runtime.thread_settings()['threads'], 1)
+
+    @override_settings(INFERENCE_RUNTIME={'THREADS': 3, 'OPENCV_THREADS': 0})
+    def test_configured_threads_win(self):
+        self.assertEqual(runtime.thread_settings(workers=1),
+                         {'threads': 3, 'interop_threads': 1, 'opencv_threads': 0})
+
+    def test_environment_keeps_explicit_variables(self):
+        with mock.patch.dict(os.environ, {'OMP_NUM_THREADS': '7'}):
+            for name in (*runtime.THREAD_ENV_VARS[1:], runtime._CONFIGURED_ENV_VAR):
+                os.environ.pop(name, None)
+            runtime.configure_environment(1)
+            self.assertEqual(os.environ['OMP_NUM_THREADS'], '7')
+            self.assertEqual(os.environ['OPENBLAS_NUM_THREADS'], '1')
+
+            # A pool worker inherits the web process's variables but takes its own share
+            runtime.configure_environment(4)
+            self.assertEqual(os.environ['OMP_NUM_THREADS'], '7')
+            self.assertEqual(os.environ['OPENBLAS_NUM_THREADS'], '4')
@@ -0,0 +1,156 @@
+"""
+Lightweight IoU tracking of face boxes across video frames.
+
+A classroom camera sees the same faces frame after frame, and YOLOv8 is
+cheap next to the dlib encoding and matching that follow it. The tracker
+links each frame's detections to the previous frame's boxes by overlap, so
+a face only needs encoding while its track is new or still unidentified;
+once a track is matched to a student it keeps that identity for as long as
+it stays in view.
+
+The tracker is plain data and pickles cheaply, so it travels with each
+frame to the inference worker (core.recognition.analyze_stream_frame) and
+back.
+"""
+import numpy as np
+
+
+def iou(boxes_a, boxes_b):
+    """Intersection over union of every pair of (x1, y1, x2, y2) boxes."""
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection),
+                     where=union > 0)
+
+
+class Track:
+    """One face followed across frames."""
+
+    __slots__ = ('track_id', 'box', 'confidence', 'hits', 'misses', 'student_pk',
+                 'distance', 'attempts', 'last_attempt')
+
+    def __init__(self, track_id, box, confidence):
+        self.track_id = track_id
+        self.box = box
+        self.confidence = confidence
+        self.hits = 1
+        self.misses = 0
+        # Set once an encoding of this face matched a student
+        self.student_pk = None
+        self.distance = None
+        self.attempts = 0
+        self.last_attempt = None
+
+    @property
+    def confirmed(self):
+        return self.student_pk is not None
+
+    @property
+    def visible(self):
+        return self.misses == 0
+
+
+class IoUTracker:
+    """
+    Greedy IoU association of detections to tracks.
+
+    Each detection continues the unmatched track it overlaps most, as long
+    as the overlap reaches iou_threshold; the rest start new tracks. A track
+    that goes unmatched for more than max_misses frames is dropped.
+    Unidentified tracks are re-encoded every retry_interval frames (the
+    face may have been turned away) until max_attempts encodings failed to
+    match.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_misses=10, retry_interval=5, max_attempts=5):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        self.tracks = []
+        self.frame = 0
+        self._next_id = 1
+
+    def update(self, boxes, confidences=None):
+        """Advance one frame; returns the track of each detection, in order."""
+        self.frame += 1
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        if confidences is None:
+            confidences = np.ones(len(boxes), dtype=np.float32)
+
+        assigned = [None] * len(boxes)
+        if self.tracks and len(boxes):
+            overlaps = iou([track.box for track in self.tracks], boxes)
+            taken = set()
+            for flat in np.argsort(overlaps, axis=None)[::-1]:
+                t, d = np.unravel_index(flat, overlaps.shape)
+                if overlaps[t, d] < self.iou_threshold:
+                    break
+                if t in taken or assigned[d] is not None:
+                    continue
+                taken.add(t)
+                assigned[d] = self.tracks[t]
+
+        for track in self.tracks:
+            track.misses += 1
+        for d, (box, confidence) in enumerate(zip(boxes, confidences)):
+            track = assigned[d]
+            if track is None:
+                track = Track(self._next_id, box, float(confidence))
+                self._next_id += 1
+                self.tracks.append(track)
+                assigned[d] = track
+            else:
+                track.box = box
+                track.confidence = float(confidence)
+                track.hits += 1
+            track.misses = 0
+
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+        return assigned
+
+    def select_for_encoding(self, accept=None):
+        """
+        Visible tracks that need an encoding this frame.
+
+        Records the attempt, so a track is not selected again until
+        retry_interval frames have passed. Tracks failing accept(track)
+        are passed over without using up an attempt.
+        """
+        selected = []
+        for track in self.tracks:
+            if (not track.visible or track.confirmed
+                    or track.attempts >= self.max_attempts):
+                continue
+            if (track.last_attempt is not None
+                    and self.frame - track.last_attempt < self.retry_interval):
+                continue
+            if accept is not None and not accept(track):
+                continue
+            track.attempts += 1
+            track.last_attempt = self.frame
+            selected.append(track)
+        return selected
+
+    def get(self, track_id):
+        for track in self.tracks:
+            if track.track_id == track_id:
+                return track
+        return None
+
+    def identify(self, track_id, student_pk, distance):
+        """Attach a matched student to a track."""
+        track = self.get(track_id)
+        if track is not None:
+            track.student_pk = student_pk
+            track.distance = distance
+        return track
+
+    def __len__(self):
+        return len(self.tracks)
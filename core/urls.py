@@ -1,7 +1,42 @@
 from django.urls import path
-from .views import RegisterFaceView, RecognizeFaceView
+from .views import (
+    RegisterFaceView, StudentPhotosView, RecognizeFaceView, BatchRecognizeFaceView,
+    InferenceStatsView, SessionRosterView, SessionStreamView, EndSessionView,
+    SessionAttendanceView, StudentAttendanceView, AttendanceSummaryView,
+    AttendanceExportView, SectionsView, SectionStudentsView, EnrollmentJobsView,
+    EnrollmentJobView, ResumeEnrollmentJobView, metrics_view, student_image_view)
 
 urlpatterns = [
+    path('metrics', metrics_view, name='metrics'),
+    path('media/students/<str:kind>/<str:name>', student_image_view, name='student_image'),
     path('api/register/', RegisterFaceView.as_view(), name='register_face'),
+    path('api/students/<str:student_id>/photos/', StudentPhotosView.as_view(),
+         name='student_photos'),
+    path('api/enrollment-jobs/', EnrollmentJobsView.as_view(), name='enrollment_jobs'),
+    path('api/enrollment-jobs/<int:job_id>/', EnrollmentJobView.as_view(),
+         name='enrollment_job'),
+    path('api/enrollment-jobs/<int:job_id>/resume/', ResumeEnrollmentJobView.as_view(),
+         name='resume_enrollment_job'),
+    path('api/sections/', SectionsView.as_view(), name='sections'),
+    path('api/sections/<str:code>/students/', SectionStudentsView.as_view(),
+         name='section_students'),
     path('api/recognize/', RecognizeFaceView.as_view(), name='recognize_face'),
+    path('api/recognize/batch/', BatchRecognizeFaceView.as_view(),
+         name='recognize_face_batch'),
+    path('api/inference/stats/', InferenceStatsView.as_view(),
+         name='inference_stats'),
+    path('api/sessions/<str:session_id>/', SessionRosterView.as_view(),
+         name='session_roster'),
+    path('api/sessions/<str:session_id>/stream/', SessionStreamView.as_view(),
+         name='session_stream'),
+    path('api/sessions/<str:session_id>/end/', EndSessionView.as_view(),
+         name='end_session'),
+    path('api/attendance/sessions/<str:session_id>/', SessionAttendanceView.as_view(),
+         name='session_attendance'),
+    path('api/attendance/students/<str:student_id>/', StudentAttendanceView.as_view(),
+         name='student_attendance'),
+    path('api/attendance/summary/', AttendanceSummaryView.as_view(),
+         name='attendance_summary'),
+    path('api/attendance/export/', AttendanceExportView.as_view(),
+         name='attendance_export'),
 ]
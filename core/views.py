@@ -1,342 +1,777 @@
-import cv2
-import numpy as np
-import torch
-from ultralytics import YOLO
-import face_recognition  # Still useful for face embeddings
+import concurrent.futures
+import contextlib
+import csv
+import json
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import condition, require_GET
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Student, AttendanceRecord
+from rest_framework.pagination import PageNumberPagination
+from . import metrics, reports
+from .admission import AdmissionRejected, get_admission_controller
+from .attendance import mark_recognized_faces
+from .bulk_enrollment import (
+    EnrollmentImportError, create_job, failed_items, is_queued, job_progress, start_job)
+from .embeddings import centroid_embedding, pack_embedding
+from .inference import InferenceQueueFull, get_inference_pool
+from .inference_cache import peek_cached, run_cached
+from .models import EnrollmentItem, EnrollmentJob, Section, Student, StudentEmbedding
+from .photos import cache_max_age, open_derived, store_photo
+from .preprocessing import ImageRejected, inspect_image
+from .recognition import analyze_enrollment, analyze_images
 from .serializers import StudentSerializer
-import time
-
-# Load the YOLOv8 face detection model once at module level
-# or 'yolov8s-face.pt' for better accuracy
-face_detector = YOLO(
-    '/Users/shay/Dev/Projects/project_open_rtms/open_rtms_api/yolov8n-face-lindevs.pt')
-
+from .sections import SectionError, session_section
+from .session_cache import get_session_cache
+from .streaming import StreamError, iter_multipart_frames, recognize_stream, request_stream
+
+logger = logging.getLogger(__name__)
+
+
+def run_inference(fn, *args, key=None, cache=False, **kwargs):
+    """
+    Run an inference job on the worker pool.
+
+    With cache=True a repeat of the same job (same uploaded bytes) is
+    answered from the inference cache. Returns (result, None) on success or
+    (None, Response) when the pool is saturated or the job did not finish
+    in time.
+    """
+    run = run_cached if cache else get_inference_pool().run
+    try:
+        return run(fn, *args, key=key, **kwargs), None
+    except InferenceQueueFull:
+        logger.warning("inference queue full key=%s", key)
+        return None, busy_response('Server busy, please retry shortly')
+    except concurrent.futures.TimeoutError:
+        logger.warning("inference job timed out key=%s", key)
+        return None, busy_response('Face analysis timed out, please retry')
+
+
+def busy_response(error, status_code=status.HTTP_503_SERVICE_UNAVAILABLE, retry_after=None):
+    """An overload response, with Retry-After from the measured service time when known."""
+    if retry_after is None:
+        controller = get_admission_controller()
+        retry_after = controller.retry_after() if controller else None
+    headers = {'Retry-After': str(retry_after)} if retry_after else None
+    return Response({'error': error}, status=status_code, headers=headers)
+
+
+def run_recognition(images, session_id, recognized_by):
+    """
+    analyze_images() for a recognition request, admitted by admission control.
+
+    Uploads already in the inference cache need no inference, so they are
+    answered without taking (or waiting for) a slot. Returns (analysis,
+    None) or (None, Response) when the request is shed or the pool is busy.
+    """
+    analysis = peek_cached(analyze_images, images, capture_tag=recognized_by)
+    if analysis is not None:
+        return analysis, None
+    permit, error_response = admit_recognition(session_id)
+    if error_response is not None:
+        return None, error_response
+    with permit:
+        return run_inference(analyze_images, images, capture_tag=recognized_by,
+                             key=session_id, cache=True)
+
+
+def admit_recognition(session_id):
+    """
+    Wait for an inference slot for a recognition request (see core/admission.py).
+
+    Requests of a session in progress are admitted first. Returns (permit,
+    None), where permit is a context manager holding the slot, or (None,
+    Response) with 429 or 503 and Retry-After when the request is shed.
+    """
+    controller = get_admission_controller()
+    if controller is None:
+        return contextlib.nullcontext(), None
+    try:
+        return controller.admit(priority=get_session_cache().is_active(session_id)), None
+    except AdmissionRejected as e:
+        logger.warning("recognition shed session=%s reason=%s retry_after=%d",
+                       session_id, e.reason, e.retry_after)
+        return None, busy_response('Server busy, please retry shortly',
+                                   status_code=e.status, retry_after=e.retry_after)
+
+
+def wants_timings(request):
+    """Whether the client asked for a per-stage `timings` block (?timings=1)."""
+    value = request.query_params.get('timings') or request.data.get('timings')
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+class InstrumentedAPIView(APIView):
+    """APIView that counts its responses by status code for /metrics."""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        metrics.requests_total.inc(endpoint=type(self).__name__,
+                                   status=response.status_code)
+        return response
+
+
+def read_enrollment_photos(request):
+    """
+    The enrollment photos of a request (`photos`, or a single `photo`).
+
+    Returns (files, images, None), or (None, None, Response) when there are
+    too many photos or one of them is not an acceptable image.
+    """
+    photo_files = request.FILES.getlist('photos') or request.FILES.getlist('photo')
+    max_photos = settings.ENROLLMENT_MAX_PHOTOS
+    if len(photo_files) > max_photos:
+        return None, None, Response({'error': f'At most {max_photos} photos per enrollment'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+    # Reject non-images and oversized uploads from the header alone
+    images = []
+    for photo in photo_files:
+        img_data = photo.read()
+        try:
+            inspect_image(img_data)
+        except ImageRejected as e:
+            return None, None, Response({'error': f'{e}: {photo.name}'},
+                                        status=status.HTTP_400_BAD_REQUEST)
+        images.append(img_data)
+    return photo_files, images, None
+
+
+def encode_enrollment_photos(photo_files, images, key):
+    """
+    Encode the face in every enrollment photo on the inference pool.
+
+    Returns (embeddings, boxes, None) with one packed embedding and face box
+    per photo, or (None, None, Response) when any photo has no usable face.
+    """
+    # Jitter smooths out a single photo; several photos already average out noise
+    num_jitters = 3 if len(images) == 1 else 1
+    analysis, error_response = run_inference(
+        analyze_enrollment, images, num_jitters=num_jitters, key=key, cache=True)
+    if error_response is not None:
+        return None, None, error_response
+    metrics.observe_stages(analysis['timings'])
+
+    photos = analysis['photos']
+    metrics.faces_detected.inc(sum(photo['detected'] for photo in photos))
+    single = len(photos) == 1
+    for photo_file, photo in zip(photo_files, photos):
+        if not photo['valid']:
+            error = photo['error']
+        elif photo['detected'] == 0:
+            error = 'No face detected'
+        elif photo['encoding'] is None:
+            error = 'Could not generate face encoding. Please try again with a clearer photo.'
+        else:
+            continue
+        return None, None, Response(
+            {'error': error if single else f'{error}: {photo_file.name}'},
+            status=status.HTTP_400_BAD_REQUEST)
+    return ([pack_embedding(photo['encoding']) for photo in photos],
+            [photo.get('box') for photo in photos], None)
+
+
+def add_student_embeddings(student, photo_names, embeddings):
+    """Store one StudentEmbedding per stored photo and refresh the student's centroid."""
+    StudentEmbedding.objects.bulk_create(
+        StudentEmbedding(student=student, embedding=embedding, photo=photo)
+        for photo, embedding in zip(photo_names, embeddings)
+    )
+    student.refresh_centroid()
+
+
+class RegisterFaceView(InstrumentedAPIView):
+    """
+    Enroll a new student from one or more photos.
+
+    Every photo is encoded (in one inference job) and stored as a
+    StudentEmbedding; the student is matched by the centroid of those
+    embeddings and re-ranked against each of them.
+    """
 
-class RegisterFaceView(APIView):
     def post(self, request):
         name = request.data.get('name')
         student_id = request.data.get('student_id')
-        photo = request.FILES.get('photo')
 
-        if not photo or not name or not student_id:
+        if not name or not student_id or not (
+                request.FILES.get('photos') or request.FILES.get('photo')):
             return Response({'error': 'Missing fields'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            # Load the image using OpenCV
-            img_data = photo.read()
-            nparr = np.frombuffer(img_data, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            if image is None:
-                return Response({'error': 'Invalid image format'}, status=status.HTTP_400_BAD_REQUEST)
+            photo_files, images, error_response = read_enrollment_photos(request)
+            if error_response is not None:
+                return error_response
 
-            # Convert BGR to RGB (face_recognition uses RGB)
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            # Detect and encode the most confident face of each photo on the inference pool
+            embeddings, boxes, error_response = encode_enrollment_photos(
+                photo_files, images, key=student_id)
+            if error_response is not None:
+                return error_response
 
-            # Detect faces using YOLOv8
-            results = face_detector(rgb_image)
+            # Size-capped photos, and a face thumbnail of the first one
+            photo_name, thumbnail_name = store_photo(images[0], boxes[0])
+            photo_names = [photo_name] + [store_photo(img_data, thumbnail=False)[0]
+                                          for img_data in images[1:]]
 
-            # Extract the detected face with the highest confidence
-            if len(results[0].boxes) == 0:
-                return Response({'error': 'No face detected'}, status=status.HTTP_400_BAD_REQUEST)
+            # Create student record in database
+            with transaction.atomic():
+                student = Student.objects.create(
+                    name=name,
+                    student_id=student_id,
+                    photo=photo_name,
+                    thumbnail=thumbnail_name,
+                    embedding=centroid_embedding(embeddings)
+                )
+                add_student_embeddings(student, photo_names, embeddings)
+            logger.info("registered student=%s photos=%d", student_id, len(embeddings))
+
+            data = StudentSerializer(student).data
+            data['enrolled_photos'] = len(embeddings)
+            return Response(data, status=status.HTTP_201_CREATED)
 
-            # Get bounding boxes in (x1, y1, x2, y2) format
-            boxes = results[0].boxes.xyxy.cpu().numpy()
-            # Get confidence scores
-            confidences = results[0].boxes.conf.cpu().numpy()
+        except Exception as e:
+            logger.exception("registration failed student=%s", student_id)
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            # Find the face with highest confidence
-            best_face_idx = np.argmax(confidences)
-            x1, y1, x2, y2 = map(int, boxes[best_face_idx])
 
-            # Extract the face region
-            face_img = rgb_image[y1:y2, x1:x2]
+class StudentPhotosView(InstrumentedAPIView):
+    """Enroll additional photos of an existing student, e.g. from another angle."""
 
-            # Generate face embedding using face_recognition with robust error handling
-            # This step generates a 128-dimension face encoding vector
-            try:
-                # Ensure face image has good dimensions
-                min_face_size = 150
-                if face_img.shape[0] < min_face_size or face_img.shape[1] < min_face_size:
-                    # Calculate new size maintaining aspect ratio
-                    scale = max(
-                        min_face_size / face_img.shape[0], min_face_size / face_img.shape[1])
-                    new_size = (
-                        int(face_img.shape[1] * scale), int(face_img.shape[0] * scale))
-                    face_img = cv2.resize(
-                        face_img, new_size, interpolation=cv2.INTER_CUBIC)
-                    print(f"Resized registration face to {face_img.shape}")
-
-                # Try direct encoding
-                encodings = face_recognition.face_encodings(
-                    face_img, num_jitters=3)
-            except Exception as e:
-                print(f"Direct encoding failed: {str(e)}")
-                encodings = []
+    def post(self, request, student_id):
+        try:
+            student = Student.objects.get(student_id=student_id)
+        except Student.DoesNotExist:
+            return Response({'error': 'Student not found'}, status=status.HTTP_404_NOT_FOUND)
+        if not (request.FILES.get('photos') or request.FILES.get('photo')):
+            return Response({'error': 'Missing fields'}, status=status.HTTP_400_BAD_REQUEST)
 
-            if not encodings:
-                try:
-                    # Try with face locations first
-                    face_locations = face_recognition.face_locations(face_img)
-                    if face_locations:
-                        encodings = face_recognition.face_encodings(
-                            face_img, face_locations, num_jitters=3)
-                except Exception as e:
-                    print(f"Encoding with face_locations failed: {str(e)}")
-                    encodings = []
-
-            if not encodings:
-                try:
-                    # Try with the whole image if face crop fails
-                    # Convert to face_recognition format
-                    face_location = [(y1, x2, y2, x1)]
-                    encodings = face_recognition.face_encodings(
-                        rgb_image, face_location, num_jitters=3)
-                except Exception as e:
-                    print(f"Encoding with original image failed: {str(e)}")
-
-            if not encodings:
-                return Response({'error': 'Could not generate face encoding. Please try again with a clearer photo.'},
-                                status=status.HTTP_400_BAD_REQUEST)
+        try:
+            photo_files, images, error_response = read_enrollment_photos(request)
+            if error_response is not None:
+                return error_response
+
+            max_photos = settings.ENROLLMENT_MAX_PHOTOS
+            enrolled = student.embeddings.count()
+            if enrolled + len(images) > max_photos:
+                return Response(
+                    {'error': f'At most {max_photos} photos per student '
+                              f'({enrolled} already enrolled)'},
+                    status=status.HTTP_400_BAD_REQUEST)
+
+            embeddings, _, error_response = encode_enrollment_photos(
+                photo_files, images, key=student_id)
+            if error_response is not None:
+                return error_response
+
+            photo_names = [store_photo(img_data, thumbnail=False)[0] for img_data in images]
+            with transaction.atomic():
+                add_student_embeddings(student, photo_names, embeddings)
+            logger.info("enrolled photos student=%s photos=%d", student_id, len(embeddings))
+
+            data = StudentSerializer(student).data
+            data['enrolled_photos'] = enrolled + len(embeddings)
+            return Response(data, status=status.HTTP_201_CREATED)
 
-            embedding = encodings[0].tobytes()
+        except Exception as e:
+            logger.exception("photo enrollment failed student=%s", student_id)
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            # Create student record in database
-            student = Student.objects.create(
-                name=name,
-                student_id=student_id,
-                photo=photo,
-                embedding=embedding
-            )
 
-            return Response(StudentSerializer(student).data, status=status.HTTP_201_CREATED)
+class EnrollmentJobsView(InstrumentedAPIView):
+    """
+    Start a bulk enrollment import from `manifest`: a zip of a manifest.csv
+    and the photos it names, or a CSV whose photos are under
+    BULK_ENROLLMENT['PHOTO_ROOT']. Poll the returned job for progress.
+    """
+
+    def post(self, request):
+        upload = request.FILES.get('manifest')
+        if not upload:
+            return Response({'error': 'Missing fields'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            job = create_job(upload)
+        except EnrollmentImportError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        start_job(job)
+        job.refresh_from_db()
+        return Response(job_progress(job), status=status.HTTP_202_ACCEPTED)
 
-        except Exception as e:
-            print(f"Error during registration: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def get_enrollment_job(job_id):
+    try:
+        return EnrollmentJob.objects.get(pk=job_id), None
+    except EnrollmentJob.DoesNotExist:
+        return None, Response({'error': 'Enrollment job not found'},
+                              status=status.HTTP_404_NOT_FOUND)
 
-class RecognizeFaceView(APIView):
+
+class RecognizeFaceView(InstrumentedAPIView):
     def post(self, request):
         image_file = request.FILES.get('image')
         recognized_by = request.data.get('recognized_by', 'mobile_app')
         session_id = request.data.get('session_id', 'unknown_session')
-        print(f"Session ID: {session_id}")
-        print(f"Got recognition request with recognized_by: {recognized_by}")
 
         if not image_file:
-            print("ERROR: No image file found in request")
+            logger.info("recognition rejected session=%s reason=no_image", session_id)
             return Response({'error': 'No image provided'}, status=status.HTTP_400_BAD_REQUEST)
 
-        print(
-            f"Image file received: {image_file.name}, size: {image_file.size} bytes")
+        logger.debug("recognition request session=%s recognized_by=%s image=%s bytes=%d",
+                     session_id, recognized_by, image_file.name, image_file.size)
 
         try:
-            # Load the image
+            try:
+                section = session_section(session_id, request.data.get('section'))
+            except SectionError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Reject non-images and oversized uploads from the header alone
             img_data = image_file.read()
-            nparr = np.frombuffer(img_data, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            try:
+                inspect_image(img_data)
+            except ImageRejected as e:
+                logger.info("recognition rejected session=%s reason=%s", session_id, e)
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Decode, detect and encode on the inference pool
+            analysis, error_response = run_recognition([img_data], session_id, recognized_by)
+            if error_response is not None:
+                return error_response
+            timer = metrics.StageTimer()
+            timer.update(analysis['timings'])
+
+            image_summary = analysis['images'][0]
+            if not image_summary['valid']:
+                logger.info("recognition rejected session=%s reason=%s",
+                            session_id, image_summary['error'])
+                return Response({'error': image_summary['error']}, status=status.HTTP_400_BAD_REQUEST)
+
+            metrics.faces_detected.inc(image_summary['detected'])
+            if image_summary['detected'] == 0:
+                logger.info("recognition session=%s faces=0", session_id)
+                return Response({'error': 'No face detected'}, status=status.HTTP_400_BAD_REQUEST)
 
-            if image is None:
-                print("ERROR: Could not decode image")
-                return Response({'error': 'Invalid image format'}, status=status.HTTP_400_BAD_REQUEST)
+            faces_data = analysis['faces']
+            skipped = analysis['skipped']
+            metrics.observe_skipped_faces(skipped)
 
-            # Convert BGR to RGB (face_recognition uses RGB)
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            print(f"Image loaded, shape: {rgb_image.shape}")
+            if not faces_data:
+                logger.info("recognition session=%s detected=%d encoded=0 skipped=%d",
+                            session_id, image_summary['detected'], len(skipped))
+                return Response({'error': 'Could not extract face features',
+                                 'skipped_faces': skipped},
+                                status=status.HTTP_400_BAD_REQUEST)
 
-            # Save original image for debugging (optional)
-            timestamp = int(time.time())
-            debug_path = f"/tmp/original_{timestamp}.jpg"
-            cv2.imwrite(debug_path, image)
-            print(f"Saved debug image to {debug_path}")
+            payload = mark_recognized_faces(
+                faces_data, session_id, recognized_by, timer=timer, section=section)
+            metrics.observe_stages(timer.timings)
+            if payload is None:
+                logger.warning("no students in database to compare against")
+                return Response({'results': [{'student_id': None, 'name': 'Unknown', 'distance': None}]},
+                                status=status.HTTP_200_OK)
 
-            # Detect faces using YOLOv8
-            results = face_detector(rgb_image)
+            summary = payload['summary']
+            summary['skipped_faces'] = skipped
+            logger.info("recognition session=%s shape=%s detected=%d encoded=%d "
+                        "skipped=%d newly_marked=%d already_marked=%d unknown=%d",
+                        session_id, image_summary['shape'], image_summary['detected'],
+                        summary['total_faces_detected'], len(skipped),
+                        summary['newly_marked'], summary['already_marked'],
+                        summary['unknown_faces'])
+            if wants_timings(request):
+                payload['timings'] = timer.as_milliseconds()
+            return Response(payload, status=status.HTTP_200_OK)
 
-            if len(results[0].boxes) == 0:
-                print("ERROR: No faces detected by YOLOv8")
-                return Response({'error': 'No face detected'}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.exception("recognition failed session=%s", session_id)
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            boxes = results[0].boxes.xyxy.cpu().numpy()
-            confidences = results[0].boxes.conf.cpu().numpy()
 
-            print(f"YOLOv8 detected {len(boxes)} faces")
+class BatchRecognizeFaceView(InstrumentedAPIView):
+    """
+    Recognize faces across several frames of the same session in one request.
 
-            # Process each detected face
-            faces_data = []
-            for i, (box, conf) in enumerate(zip(boxes, confidences)):
-                if conf < 0.5:  # Skip low confidence detections
-                    continue
+    All frames go through YOLOv8 as one batch, and each student is reported
+    once with the closest match found in any frame.
+    """
 
-                x1, y1, x2, y2 = map(int, box)
+    def post(self, request):
+        image_files = request.FILES.getlist('images')
+        recognized_by = request.data.get('recognized_by', 'mobile_app')
+        session_id = request.data.get('session_id')
 
-                # Extract face region
-                face_img = rgb_image[y1:y2, x1:x2]
+        if not image_files or not session_id:
+            return Response({'error': 'Missing fields'}, status=status.HTTP_400_BAD_REQUEST)
 
-                # Save detected face for debugging
-                face_debug_path = f"/tmp/face_{i}_{timestamp}.jpg"
-                cv2.imwrite(face_debug_path, cv2.cvtColor(
-                    face_img, cv2.COLOR_RGB2BGR))
+        max_frames = settings.RECOGNIZE_BATCH_MAX_FRAMES
+        if len(image_files) > max_frames:
+            return Response({'error': f'At most {max_frames} images per batch'},
+                            status=status.HTTP_400_BAD_REQUEST)
 
+        try:
+            try:
+                section = session_section(session_id, request.data.get('section'))
+            except SectionError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Reject non-images and oversized uploads from the header alone
+            images = []
+            for image_file in image_files:
+                img_data = image_file.read()
                 try:
-                    # Generate face embedding using a safer approach
-                    # Ensure image has correct dimensions and type
-                    # face_img must be RGB and uint8
-                    if face_img.shape[0] > 0 and face_img.shape[1] > 0:
-                        # First, ensure the image is resized to a reasonable size
-                        # Too small faces can cause problems with dlib
-                        min_face_size = 150
-                        if face_img.shape[0] < min_face_size or face_img.shape[1] < min_face_size:
-                            # Calculate new size maintaining aspect ratio
-                            scale = max(
-                                min_face_size / face_img.shape[0], min_face_size / face_img.shape[1])
-                            new_size = (
-                                int(face_img.shape[1] * scale), int(face_img.shape[0] * scale))
-                            face_img = cv2.resize(
-                                face_img, new_size, interpolation=cv2.INTER_CUBIC)
-                            print(f"Resized face to {face_img.shape}")
-
-                        # Method 1: Try direct encoding
-                        try:
-                            encoding = face_recognition.face_encodings(
-                                face_img, num_jitters=1)
-                        except Exception as e1:
-                            print(f"Direct encoding failed: {e1}")
-                            encoding = []
-
-                        # If that doesn't work, try with face locations first
-                        if not encoding:
-                            try:
-                                face_locations = face_recognition.face_locations(
-                                    face_img)
-                                if face_locations:
-                                    encoding = face_recognition.face_encodings(
-                                        face_img, face_locations, num_jitters=1)
-                            except Exception as e2:
-                                print(
-                                    f"Encoding with face_locations failed: {e2}")
-                                encoding = []
-                    else:
-                        encoding = []
-
-                    # If both approaches fail with the crop, try with the whole image
-                    if not encoding:
-                        try:
-                            # Convert the YOLO box coordinates to face_recognition format (top, right, bottom, left)
-                            face_location = [(y1, x2, y2, x1)]
-                            encoding = face_recognition.face_encodings(
-                                rgb_image, face_location, num_jitters=1)
-                        except Exception as e3:
-                            print(f"Encoding with original image failed: {e3}")
-                            encoding = []
-
-                    if encoding:
-                        faces_data.append({
-                            'encoding': encoding[0],
-                            'location': {
-                                'x': x1,
-                                'y': y1,
-                                'width': x2 - x1,
-                                'height': y2 - y1,
-                                'confidence': float(conf)
-                            }
-                        })
-                except Exception as e:
-                    print(f"Error processing face {i}: {str(e)}")
-                    continue
+                    inspect_image(img_data)
+                except ImageRejected as e:
+                    return Response({'error': f'{e}: {image_file.name}'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                images.append(img_data)
+
+            # Detect faces in all frames with one YOLOv8 call
+            analysis, error_response = run_recognition(images, session_id, recognized_by)
+            if error_response is not None:
+                return error_response
+            timer = metrics.StageTimer()
+            timer.update(analysis['timings'])
+
+            for image_file, image_summary in zip(image_files, analysis['images']):
+                if not image_summary['valid']:
+                    return Response({'error': f"{image_summary['error']}: {image_file.name}"},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+            detected = sum(image_summary['detected'] for image_summary in analysis['images'])
+            metrics.faces_detected.inc(detected)
+            if not detected:
+                return Response({'error': 'No face detected'}, status=status.HTTP_400_BAD_REQUEST)
 
+            faces_data = analysis['faces']
+            skipped = analysis['skipped']
+            metrics.observe_skipped_faces(skipped)
             if not faces_data:
-                print("ERROR: Could not extract face encodings")
-                return Response({'error': 'Could not extract face features'},
+                return Response({'error': 'Could not extract face features',
+                                 'skipped_faces': skipped},
                                 status=status.HTTP_400_BAD_REQUEST)
 
-            print(f"Successfully extracted {len(faces_data)} face encodings")
-
-            # Get all stored students
-            students = Student.objects.all()
-            if not students:
-                print("WARNING: No students in database to compare against")
+            payload = mark_recognized_faces(
+                faces_data, session_id, recognized_by, include_frame=True, timer=timer,
+                section=section)
+            metrics.observe_stages(timer.timings)
+            if payload is None:
+                logger.warning("no students in database to compare against")
                 return Response({'results': [{'student_id': None, 'name': 'Unknown', 'distance': None}]},
                                 status=status.HTTP_200_OK)
 
-            known_encodings = [np.frombuffer(s.embedding) for s in students]
-
-            results = []
-            newly_marked = []
-            already_marked = []
-            unknown_faces = 0
-
-            # Match faces
-            for face_data in faces_data:
-                encoding = face_data['encoding']
-                face_location = face_data['location']
-
-                distances = face_recognition.face_distance(
-                    known_encodings, encoding)
-                if len(distances) == 0:
-                    continue
-
-                best_match_index = int(np.argmin(distances))
-                best_distance = distances[best_match_index]
-                print(
-                    f"Best match distance: {best_distance:.4f} (threshold: 0.6)")
-
-                if best_distance < 0.4:  # Lower is better match
-                    student = students[best_match_index]
-                    # Check if already marked for this session
-                    already_exists = AttendanceRecord.objects.filter(
-                        student=student,
-                        session_id=session_id
-                    ).exists()
-
-                    # Create result dictionary with face location
-                    result_data = {
-                        'student_id': student.student_id,
-                        'name': student.name,
-                        'distance': float(best_distance),
-                        'face_location': face_location,
-                        'confidence': face_location['confidence']
-                    }
-
-                    if already_exists:
-                        print(
-                            f"Attendance record already exists for this student and session")
-                        result_data['status'] = 'already_marked'
-                        already_marked.append(result_data)
-                    else:
-                        # Create attendance record
-                        AttendanceRecord.objects.create(
-                            student=student,
-                            recognized_by=recognized_by,
-                            session_id=session_id,
-                        )
-                        result_data['status'] = 'newly_marked'
-                        newly_marked.append(result_data)
-                else:
-                    unknown_faces += 1
-                    # You can optionally track unknown faces locations
-
-            results.extend(newly_marked)
-            results.extend(already_marked)
-
-            return Response({
-                'results': results,
-                'summary': {
-                    'total_faces_detected': len(faces_data),
-                    'newly_marked': len(newly_marked),
-                    'already_marked': len(already_marked),
-                    'unknown_faces': unknown_faces,
-                }
-            }, status=status.HTTP_200_OK)
+            payload['summary']['frames'] = len(image_files)
+            summary = payload['summary']
+            summary['skipped_faces'] = skipped
+            logger.info("batch recognition session=%s frames=%d detected=%d encoded=%d "
+                        "skipped=%d newly_marked=%d already_marked=%d unknown=%d",
+                        session_id, len(image_files), detected,
+                        summary['total_faces_detected'], len(skipped), summary['newly_marked'],
+                        summary['already_marked'], summary['unknown_faces'])
+            if wants_timings(request):
+                payload['timings'] = timer.as_milliseconds()
+            return Response(payload, status=status.HTTP_200_OK)
 
         except Exception as e:
-            print(f"ERROR during face recognition: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("batch recognition failed session=%s", session_id)
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class InferenceStatsView(InstrumentedAPIView):
+    """Queue depth and per-stage latency of the inference worker pool."""
+
+    def get(self, request):
+        stats = get_inference_pool().stats()
+        controller = get_admission_controller()
+        stats['admission'] = controller.stats() if controller else None
+        return Response(stats)
+
+
+class SessionRosterView(InstrumentedAPIView):
+    """
+    Present/absent roster of a session, served from the session cache.
+
+    The roster is the session's section, or every student for an unscoped
+    session.
+    """
+
+    def get(self, request, session_id):
+        present_pks = get_session_cache().peek_present(session_id)
+        section = session_section(session_id)
+        students = section.students.all() if section else Student.objects.all()
+        present = []
+        absent = []
+        for student in students.order_by('name').values('id', 'student_id', 'name'):
+            entry = {'student_id': student['student_id'], 'name': student['name']}
+            (present if student['id'] in present_pks else absent).append(entry)
+
+        return Response({
+            'session_id': session_id,
+            'section': section.code if section else None,
+            'present': present,
+            'absent': absent,
+            'summary': {
+                'present': len(present),
+                'absent': len(absent),
+                'total': len(present) + len(absent),
+            }
+        })
+
+
+class SessionStreamView(InstrumentedAPIView):
+    """
+    Live recognition from a camera's MJPEG stream (see core/streaming.py).
+
+    The body is a multipart/x-mixed-replace stream of JPEG frames; the
+    response streams one NDJSON event per processed frame while the upload
+    is still being read.
+    """
+
+    def post(self, request, session_id):
+        boundary = request.content_params.get('boundary')
+        if not request.content_type.startswith('multipart/x-mixed-replace') or not boundary:
+            return Response({'error': 'Expected a multipart/x-mixed-replace stream with a boundary'},
+                            status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        recognized_by = request.query_params.get('recognized_by', 'camera_stream')
+        try:
+            section = session_section(session_id, request.query_params.get('section'))
+        except SectionError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        logger.info("stream started session=%s recognized_by=%s", session_id, recognized_by)
+
+        frames = iter_multipart_frames(request_stream(request), boundary)
+
+        def events():
+            try:
+                for event in recognize_stream(frames, session_id, recognized_by, section):
+                    yield json.dumps(event) + '\n'
+            except StreamError as e:
+                logger.info("stream rejected session=%s reason=%s", session_id, e)
+                yield json.dumps({'event': 'error', 'error': str(e)}) + '\n'
+            except Exception as e:
+                logger.exception("stream recognition failed session=%s", session_id)
+                yield json.dumps({'event': 'error', 'error': str(e)}) + '\n'
+
+        response = StreamingHttpResponse(events(), content_type='application/x-ndjson')
+        # Keep proxies from holding events back until the stream ends
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class EndSessionView(InstrumentedAPIView):
+    """Drop a finished session from the attendance cache."""
+
+    def post(self, request, session_id):
+        get_session_cache().end_session(session_id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def requested_student_ids(request):
+    """`student_ids` as a list, from a JSON body or repeated form fields."""
+    if hasattr(request.data, 'getlist'):
+        return request.data.getlist('student_ids')
+    return request.data.get('student_ids') or []
+
+
+def section_data(section):
+    return {'code': section.code, 'name': section.name,
+            'students': section.students.count()}
+
+
+class SectionsView(InstrumentedAPIView):
+    """Create a class section, optionally with its students (`student_ids`)."""
+
+    def post(self, request):
+        code = request.data.get('code')
+        if not code:
+            return Response({'error': 'Missing fields'}, status=status.HTTP_400_BAD_REQUEST)
+        if Section.objects.filter(code=code).exists():
+            return Response({'error': f'Section {code} already exists'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        student_ids = requested_student_ids(request)
+        students = list(Student.objects.filter(student_id__in=student_ids))
+        if len(students) != len(set(student_ids)):
+            return Response({'error': 'Unknown student_ids'}, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            section = Section.objects.create(code=code, name=request.data.get('name', ''))
+            section.students.add(*students)
+        return Response(section_data(section), status=status.HTTP_201_CREATED)
+
+
+class SectionStudentsView(InstrumentedAPIView):
+    """Enroll (POST) or drop (DELETE) students of a section by `student_ids`."""
+
+    def _change(self, request, code, method):
+        try:
+            section = Section.objects.get(code=code)
+        except Section.DoesNotExist:
+            return Response({'error': 'Section not found'}, status=status.HTTP_404_NOT_FOUND)
+        student_ids = requested_student_ids(request)
+        if not student_ids:
+            return Response({'error': 'Missing fields'}, status=status.HTTP_400_BAD_REQUEST)
+        students = list(Student.objects.filter(student_id__in=student_ids))
+        if len(students) != len(set(student_ids)):
+            return Response({'error': 'Unknown student_ids'}, status=status.HTTP_400_BAD_REQUEST)
+        getattr(section.students, method)(*students)
+        return Response(section_data(section))
+
+    def post(self, request, code):
+        return self._change(request, code, 'add')
+
+    def delete(self, request, code):
+        return self._change(request, code, 'remove')
+
+
+class ReportPagination(PageNumberPagination):
+    """Page-number pagination whose page size the client may raise, up to a cap."""
+
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class ReportView(InstrumentedAPIView):
+    """Base for the attendance reports: a paginated query plus a few totals."""
+
+    def paginated(self, request, queryset, **extra):
+        paginator = ReportPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        response = paginator.get_paginated_response(page)
+        response.data.update(extra)
+        return response
+
+
+class EnrollmentJobView(ReportView):
+    """Progress of a bulk enrollment job, with its failed items and why (paginated)."""
+
+    def get(self, request, job_id):
+        job, error_response = get_enrollment_job(job_id)
+        if error_response is not None:
+            return error_response
+        return self.paginated(request, failed_items(job), job=job_progress(job))
+
+
+class ResumeEnrollmentJobView(InstrumentedAPIView):
+    """Run a stopped or failed enrollment job again, for its items still pending."""
+
+    def post(self, request, job_id):
+        job, error_response = get_enrollment_job(job_id)
+        if error_response is not None:
+            return error_response
+        if is_queued(job):
+            return Response({'error': 'Enrollment job is already running'},
+                            status=status.HTTP_409_CONFLICT)
+        if not job.items.filter(status=EnrollmentItem.PENDING).exists():
+            return Response({'error': 'Nothing left to enroll'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        start_job(job)
+        job.refresh_from_db()
+        return Response(job_progress(job), status=status.HTTP_202_ACCEPTED)
+
+
+class SessionAttendanceView(ReportView):
+    """
+    Students marked present in a session, in arrival order.
+
+    enrolled counts the students of the session's section, or everyone for
+    a session not bound to one.
+    """
+
+    def get(self, request, session_id):
+        response = self.paginated(
+            request, reports.session_roster(session_id), session_id=session_id)
+        section = session_section(session_id)
+        enrolled = section.students.count() if section else Student.objects.count()
+        response.data['summary'] = {'present': response.data['count'], 'enrolled': enrolled,
+                                    'section': section.code if section else None}
+        return response
+
+
+class StudentAttendanceView(ReportView):
+    """A student's attendance history, optionally limited to ?from=&to=."""
+
+    def get(self, request, student_id):
+        try:
+            student = Student.objects.get(student_id=student_id)
+        except Student.DoesNotExist:
+            return Response({'error': 'Student not found'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            start, end = reports.date_range(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return self.paginated(
+            request, reports.student_history(student, start, end),
+            student={'student_id': student.student_id, 'name': student.name},
+            summary=reports.student_totals(student, start, end))
+
+
+class AttendanceSummaryView(ReportView):
+    """Attendance over ?from=&to=, grouped by ?group=session (default), student or day."""
+
+    def get(self, request):
+        group = request.query_params.get('group', 'session')
+        try:
+            start, end = reports.date_range(request.query_params)
+            queryset = reports.range_summary(group, start, end)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return self.paginated(request, queryset, group=group)
+
+
+class _Echo:
+    """File-like object whose write() hands back what was written, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+class AttendanceExportView(InstrumentedAPIView):
+    """
+    CSV export of attendance over ?from=&to= (and optionally ?session_id=).
+
+    Rows are streamed as they are read from the database, so large ranges
+    never build up in memory.
+    """
+
+    def get(self, request):
+        try:
+            start, end = reports.date_range(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        writer = csv.writer(_Echo())
+        rows = reports.export_rows(start, end, request.query_params.get('session_id'))
+        response = StreamingHttpResponse((writer.writerow(row) for row in rows),
+                                         content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="attendance.csv"'
+        return response
+
+
+def metrics_view(request):
+    """Prometheus text exposition of this process's metrics."""
+    return HttpResponse(metrics.registry.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@require_GET
+@condition(etag_func=lambda request, kind, name: name.removesuffix('.jpg'))
+def student_image_view(request, kind, name):
+    """
+    A stored student photo or face thumbnail (see core/photos.py).
+
+    Their names are hashes of their content, so responses never change and
+    are cached for STUDENT_PHOTOS['CACHE_MAX_AGE'] as immutable.
+    """
+    try:
+        image = open_derived(kind, name)
+    except FileNotFoundError:
+        raise Http404
+    response = FileResponse(image, content_type='image/jpeg')
+    response['Cache-Control'] = f'public, max-age={cache_max_age()}, immutable'
+    return response